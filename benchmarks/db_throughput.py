@@ -0,0 +1,120 @@
+# benchmarks/db_throughput.py
+
+"""
+Concurrent add/toggle throughput against one SQLite file, or against
+several task shards (see src/common/sharding.py).
+
+Each worker process owns a user and alternates TaskOperations.add_many (one
+task) and change_status on its own tasks. Run with the tuned defaults, or
+with --untuned to reproduce the old settings (rollback journal, FULL sync,
+no busy timeout):
+
+    python -m benchmarks.db_throughput --workers 1 4 16 --ops 500
+
+With --shards, every run is repeated over that many SQLite files, with the
+workers' users spread evenly across them. Write throughput should grow
+with the shard count until the disk or the CPUs run out:
+
+    python -m benchmarks.db_throughput --workers 16 --shards 1 2 4
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+
+UNTUNED = {"SQLITE_JOURNAL_MODE": "DELETE", "SQLITE_SYNCHRONOUS": "FULL", "SQLITE_BUSY_TIMEOUT_MS": "0"}
+
+
+def worker(user_id: int, ops: int, start, results):
+    from src.common.db_storage import engine, open_storage
+    from src.modules.task_operations import TaskOperations
+
+    engine.echo = False
+    task_operations = TaskOperations(open_storage())
+    task_ids, errors = [], 0
+
+    start.wait()
+    for i in range(ops):
+        try:
+            if i % 2 == 0 or not task_ids:
+                task_ids += [task.id for task in task_operations.add_many(user_id, [f"task {i}"])]
+            else:
+                task_operations.change_status(task_ids[i % len(task_ids)], user_id)
+        except Exception:
+            task_operations.db_storage.rollback()
+            errors += 1
+    results.put(errors)
+
+
+def spread_users(workers: int) -> list[int]:
+    """One user per worker, as evenly spread over the shards as the ring allows"""
+    from src.common.db_storage import shard_router
+
+    if shard_router is None:
+        return list(range(1, workers + 1))
+    by_shard = {name: [] for name in shard_router.names}
+    user_id = 0
+    while sum(map(len, by_shard.values())) < workers:
+        user_id += 1
+        users = by_shard[shard_router.shard_of(user_id)]
+        if len(users) < -(-workers // len(by_shard)):
+            users.append(user_id)
+    return sorted(user for users in by_shard.values() for user in users)
+
+
+def run(workers: int, ops: int) -> dict:
+    from src.common.migrations import run_all_migrations
+    from src.common.db_storage import engine, shard_engines
+
+    engine.echo = False
+    run_all_migrations()
+
+    context = multiprocessing.get_context("spawn")
+    start, results = context.Event(), context.Queue()
+    processes = [context.Process(target=worker, args=(user_id, ops, start, results)) for user_id in spread_users(workers)]
+    for process in processes:
+        process.start()
+    time.sleep(2)  # let every worker import and connect
+
+    began = time.perf_counter()
+    start.set()
+    errors = sum(results.get() for _ in processes)
+    elapsed = time.perf_counter() - began
+    for process in processes:
+        process.join()
+
+    done = workers * ops - errors
+    return {"workers": workers, "shards": len(shard_engines) or 1, "ops": done, "errors": errors, "ops_per_sec": round(done / elapsed, 1)}
+
+
+def report_run(workers: int, ops: int, report):
+    report.put(run(workers, ops))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--ops", type=int, default=500)
+    parser.add_argument("--shards", type=int, nargs="+", default=[0], help="task shards per run; 0 keeps tasks in the one database")
+    parser.add_argument("--untuned", action="store_true")
+    args = parser.parse_args()
+
+    if args.untuned:
+        os.environ.update(UNTUNED)
+    os.environ["CACHE_URL"] = "none"
+
+    for workers, shards in ((workers, shards) for shards in args.shards for workers in args.workers):
+        with tempfile.TemporaryDirectory() as directory:
+            os.environ["DATABASE_URL"] = f"sqlite:///{directory}/bench.db"
+            os.environ["DATABASE_SHARD_URLS"] = ",".join(f"s{i}=sqlite:///{directory}/shard{i}.db" for i in range(shards))
+            # Fresh interpreter per run so the engines pick up the new URLs
+            context = multiprocessing.get_context("spawn")
+            report = context.Queue()
+            runner = context.Process(target=report_run, args=(workers, args.ops, report))
+            runner.start()
+            print(json.dumps(report.get()))
+            runner.join()
@@ -0,0 +1,109 @@
+# benchmarks/import_tasks.py
+
+"""
+Bulk import and export throughput on SQLite, with peak memory.
+
+Streams a generated CSV of --rows tasks through import_tasks into a fresh
+database in 64 KiB chunks, as an upload arrives, then exports it back.
+Runs once per --chunk-size, each in its own process so peak RSS is that
+run's alone. SQLite's mmap_size counts the mapped database file into RSS;
+run with SQLITE_MMAP_SIZE=0 to see the import's own memory:
+
+    python -m benchmarks.import_tasks --rows 1000000 --chunk-size 500 5000
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+WORDS = "buy call email fix pay book plan read send clean milk bread plumber invoice report taxes flight hotel".split()
+
+
+async def upload(rows: int, chunk_bytes: int = 64 * 1024):
+    buffer = ["content,completed\n"]
+    size = 0
+    for i in range(rows):
+        line = f"{WORDS[i % len(WORDS)]} {WORDS[i * 7 % len(WORDS)]} number {i},{'true' if i % 3 == 0 else 'false'}\n"
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield "".join(buffer).encode()
+            buffer, size = [], 0
+    yield "".join(buffer).encode()
+
+
+def run(rows: int, chunk_size: int, results) -> None:
+    from sqlmodel import Session
+    from src.common import cache as caching
+    from src.common.db_storage import DBStorageHandler, create_db_engine
+    from src.common.migrations import run_migrations
+    from src.common.models import User
+    from src.modules import task_transfer
+    from src.modules.task_operations import TaskOperations
+
+    caching.default_cache = None
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_db_engine(f"sqlite:///{directory}/import.db")
+        run_migrations(engine)
+        with Session(engine, expire_on_commit=False) as session:
+            session.add(User(id=1, username="bench", email="bench@bench.local", password="-"))
+            session.commit()
+            task_operations = TaskOperations(DBStorageHandler(session))
+
+            async def insert(chunk: list[dict]) -> int:
+                return task_operations.import_rows(1, chunk)
+
+            began = time.perf_counter()
+            report = asyncio.run(task_transfer.import_tasks(upload(rows), "csv", insert, chunk_size=chunk_size))
+            imported_s = time.perf_counter() - began
+            import_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+            # Export reads through a fresh storage per stream; point it at this engine
+            task_transfer.stream_user_tasks = lambda user_id: stream(engine, user_id)
+
+            async def export() -> int:
+                return sum([len(text) async for text in task_transfer.export_tasks(1, "csv")])
+
+            began = time.perf_counter()
+            exported_bytes = asyncio.run(export())
+            exported_s = time.perf_counter() - began
+            counts = task_operations.get_counts(1)
+        engine.dispose()
+
+    results.put({
+        "chunk_size": chunk_size, "imported": report.imported, "counts": counts,
+        "import_s": round(imported_s, 1), "rows_per_s": round(report.imported / imported_s),
+        "export_s": round(exported_s, 1), "export_mb": round(exported_bytes / 2**20, 1),
+        "import_rss_mb": round(import_rss / 1024), "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024),
+    })
+
+
+async def stream(engine, user_id: int):
+    from sqlmodel import Session
+    from src.common.db_storage import DBStorageHandler
+    from src.common.models import Task
+
+    with Session(engine) as session:
+        for chunk in DBStorageHandler(session).stream_where(Task, Task.user_id == user_id, batch_size=500):
+            yield chunk
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--chunk-size", type=int, nargs="+", default=[500, 5000])
+    args = parser.parse_args()
+
+    os.environ["CACHE_URL"] = "none"
+    context = multiprocessing.get_context("spawn")
+    for chunk_size in args.chunk_size:
+        results = context.Queue()
+        process = context.Process(target=run, args=(args.rows, chunk_size, results))
+        process.start()
+        print(json.dumps(results.get(), indent=2))
+        process.join()
@@ -0,0 +1,380 @@
+# benchmarks/load.py
+
+"""
+End-to-end load test of /login, /tasks and the /ws add/update/delete loop.
+
+Seeds a fresh SQLite file with N users x M tasks, starts uvicorn on it, and
+drives each scenario with concurrent clients. Latencies are kept per request
+and reported as p50/p95/p99 with a bucketed histogram, alongside requests
+per second and errors. Results go to a JSON file named after the commit:
+
+    python -m benchmarks.load run --users 50 --tasks 200 --concurrency 32
+    python -m benchmarks.load run --scenarios tasks ws --baseline build/bench/3e74f88.json
+
+Two results files can be compared later. The exit status is 1 when any
+scenario's p95 grew, or its throughput fell, by more than the threshold:
+
+    python -m benchmarks.load compare build/bench/old.json build/bench/new.json --threshold 0.1
+
+The server runs with rate limiting off (every request comes from one IP) and
+everything else at its defaults; pass KEY=VALUE pairs with --env to change
+that, e.g. --env DATABASE_URL=sqlite+aiosqlite:///{dir}/bench.db.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+import websockets
+
+RESULTS_DIR = Path("build/bench")
+PASSWORD = "benchpass"
+# Generous, so a slow server shows up as latency rather than as client timeouts
+CLIENT_TIMEOUT = httpx.Timeout(120)
+# Upper bounds in ms; the last bucket takes everything slower
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+# --- Statistics ---
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def histogram(samples: list[float]) -> dict[str, int]:
+    counts = {f"le_{bound}ms": 0 for bound in BUCKETS_MS} | {"inf": 0}
+    for sample in samples:
+        ms = sample * 1000
+        bucket = next((f"le_{bound}ms" for bound in BUCKETS_MS if ms <= bound), "inf")
+        counts[bucket] += 1
+    return counts
+
+
+def summarize(samples: list[float], errors: int, elapsed: float) -> dict:
+    if not samples:
+        return {"requests": 0, "errors": errors, "rps": 0.0}
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "rps": round(len(samples) / elapsed, 1),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 2),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 95) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        "max_ms": round(max(samples) * 1000, 2),
+        "histogram": histogram(samples),
+    }
+
+
+class Recorder:
+    """Latency samples and error count for one scenario (or one ws action)"""
+
+    def __init__(self):
+        self.samples: list[float] = []
+        self.errors = 0
+
+    @contextmanager
+    def measure(self):
+        began = time.perf_counter()
+        try:
+            yield
+        except (httpx.HTTPError, websockets.WebSocketException, OSError, AssertionError):
+            self.errors += 1
+        else:
+            self.samples.append(time.perf_counter() - began)
+
+
+# --- Seed data ---
+
+def username(i: int) -> str:
+    return f"bench_{i:05d}"
+
+
+def seed(database_url: str, users: int, tasks: int) -> None:
+    """Migrate and bulk-load users x tasks; every user shares one password hash"""
+    from sqlalchemy import insert, make_url
+
+    from src.common.db_storage import create_db_engine, sync_url
+    from src.common.migrations import run_migrations
+    from src.common.models import Task, User
+    from src.modules.auth_operations import hash_password
+
+    engine = create_db_engine(sync_url(make_url(database_url)))
+    run_migrations(engine)
+    password = hash_password(PASSWORD)
+
+    with engine.begin() as conn:
+        conn.execute(insert(User.__table__), [
+            {"id": i, "username": username(i), "email": f"{username(i)}@bench.local",
+             "email_normalized": f"{username(i)}@bench.local", "password": password, "created_at": datetime.now()}
+            for i in range(1, users + 1)
+        ])
+        for user_id in range(1, users + 1):
+            conn.execute(insert(Task.__table__), [
+                {"user_id": user_id, "content": f"seeded task {n}", "completed": n % 3 == 0} for n in range(tasks)
+            ])
+    engine.dispose()
+
+
+# --- Server ---
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def serve(env: dict, workers: int):
+    port = free_port()
+    command = [sys.executable, "-m", "uvicorn", "--factory", "src.server.app:create_app",
+               "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    process = subprocess.Popen(command, env={**os.environ, **env})
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                if httpx.get(f"{base_url}/login").status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            if process.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError("Server did not start")
+            time.sleep(0.1)
+        yield base_url
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+# --- Scenarios ---
+
+async def login(client: httpx.AsyncClient, user: int) -> str:
+    response = await client.post("/login", data={"username": username(user), "password": PASSWORD})
+    assert response.status_code == 302, response.status_code
+    return response.cookies["session"]
+
+
+async def drive(concurrency: int, requests: int, step) -> tuple[float, Recorder]:
+    """Run step(i) for i in range(requests) on `concurrency` clients"""
+    recorder = Recorder()
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            with recorder.measure():
+                await step(i)
+
+    began = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - began, recorder
+
+
+async def login_scenario(base_url: str, users: int, concurrency: int, requests: int) -> dict:
+    async with httpx.AsyncClient(base_url=base_url, timeout=CLIENT_TIMEOUT, limits=httpx.Limits(max_connections=concurrency)) as client:
+        elapsed, recorder = await drive(concurrency, requests, lambda i: login(client, i % users + 1))
+    return summarize(recorder.samples, recorder.errors, elapsed)
+
+
+async def tasks_scenario(base_url: str, cookies: list[str], concurrency: int, requests: int) -> dict:
+    async with httpx.AsyncClient(base_url=base_url, timeout=CLIENT_TIMEOUT, limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def get_tasks(i: int):
+            response = await client.get("/tasks", headers={"Cookie": f"session={cookies[i % len(cookies)]}"})
+            assert response.status_code == 200, response.status_code
+
+        elapsed, recorder = await drive(concurrency, requests, get_tasks)
+    return summarize(recorder.samples, recorder.errors, elapsed)
+
+
+async def reply(ws) -> dict:
+    """Next reply to this socket, skipping changes made by the user's other sockets"""
+    while True:
+        message = json.loads(await ws.recv())
+        if message.get("action") != "changes":
+            assert message["status"] == 1, message
+            return message
+
+
+async def ws_client(ws_url: str, cookie: str, loops: int, recorders: dict[str, Recorder], start: asyncio.Event):
+    async with websockets.connect(ws_url, additional_headers={"Cookie": f"session={cookie}"}, max_queue=None) as ws:
+        await start.wait()
+        for i in range(loops):
+            task_id = None
+            with recorders["add"].measure():
+                await ws.send(json.dumps({"action": "add", "content": f"bench task {i}"}))
+                task_id = (await reply(ws))["id"]
+            if task_id is None:
+                continue
+            for action in ("update", "delete"):
+                with recorders[action].measure():
+                    await ws.send(json.dumps({"action": action, "id": task_id}))
+                    await reply(ws)
+
+
+async def ws_scenario(base_url: str, cookies: list[str], clients: int, loops: int) -> dict:
+    ws_url = base_url.replace("http", "ws", 1) + "/ws"
+    recorders = {action: Recorder() for action in ("add", "update", "delete")}
+    start = asyncio.Event()
+
+    runners = [asyncio.create_task(ws_client(ws_url, cookies[i % len(cookies)], loops, recorders, start))
+               for i in range(clients)]
+    await asyncio.sleep(1)  # let every socket finish its handshake
+    began = time.perf_counter()
+    start.set()
+    await asyncio.gather(*runners)
+    elapsed = time.perf_counter() - began
+
+    samples = [sample for recorder in recorders.values() for sample in recorder.samples]
+    errors = sum(recorder.errors for recorder in recorders.values())
+    return {
+        **summarize(samples, errors, elapsed),
+        "actions": {action: summarize(r.samples, r.errors, elapsed) for action, r in recorders.items()},
+    }
+
+
+async def run_scenarios(base_url: str, args) -> dict:
+    results = {}
+    if "login" in args.scenarios:
+        results["login"] = await login_scenario(base_url, args.users, args.login_concurrency, args.requests)
+
+    if {"tasks", "ws"} & set(args.scenarios):
+        sessions = min(args.users, args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, timeout=CLIENT_TIMEOUT) as client:
+            cookies = [await login(client, user) for user in range(1, sessions + 1)]
+        if "tasks" in args.scenarios:
+            results["tasks"] = await tasks_scenario(base_url, cookies, args.concurrency, args.requests)
+        if "ws" in args.scenarios:
+            results["ws"] = await ws_scenario(base_url, cookies, args.concurrency, args.ws_loops)
+    return results
+
+
+# --- Results ---
+
+def git_revision() -> str:
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{revision}-dirty" if dirty else revision
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[str]:
+    """Scenarios whose p95 grew or rps fell by more than threshold (a fraction)"""
+    regressions = []
+    for name, result in current["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if not before or not before.get("requests") or not result.get("requests"):
+            continue
+        if result["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {result['p95_ms']}ms")
+        if result["rps"] < before["rps"] * (1 - threshold):
+            regressions.append(f"{name}: rps {before['rps']} -> {result['rps']}")
+    return regressions
+
+
+def print_table(results: dict) -> None:
+    print(f"{'scenario':<10} {'requests':>9} {'errors':>7} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, result in results["scenarios"].items():
+        rows = [(name, result)] + [(f"  {action}", r) for action, r in result.get("actions", {}).items()]
+        for label, r in rows:
+            print(f"{label:<10} {r['requests']:>9} {r['errors']:>7} {r['rps']:>9} "
+                  f"{r.get('p50_ms', '-'):>9} {r.get('p95_ms', '-'):>9} {r.get('p99_ms', '-'):>9}")
+
+
+def report_regressions(baseline: dict, current: dict, threshold: float) -> int:
+    if baseline["meta"].get("params") != current["meta"].get("params"):
+        print("WARNING results were produced with different parameters; deltas may not mean much")
+    regressions = compare(baseline, current, threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print(f"No regressions beyond {threshold:.0%} against {baseline['meta']['revision']}")
+    return 1 if regressions else 0
+
+
+def run(args) -> int:
+    with tempfile.TemporaryDirectory() as directory:
+        env = {
+            "DATABASE_URL": f"sqlite:///{directory}/bench.db",
+            "ASSETS_DIR": f"{directory}/assets",
+            "RATE_LIMIT_URL": "none",
+        }
+        env.update(pair.replace("{dir}", directory).split("=", 1) for pair in args.env)
+        if "BCRYPT_ROUNDS" in env:
+            # Seed hashes at the server's cost, or every first login would rehash and write
+            os.environ["BCRYPT_ROUNDS"] = env["BCRYPT_ROUNDS"]
+
+        seed(env["DATABASE_URL"], args.users, args.tasks)
+        with serve(env, args.workers) as base_url:
+            scenarios = asyncio.run(run_scenarios(base_url, args))
+
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "params": {key: getattr(args, key) for key in ("users", "tasks", "concurrency", "login_concurrency", "requests", "ws_loops", "workers", "env")},
+        },
+        "scenarios": scenarios,
+    }
+    output = Path(args.output or RESULTS_DIR / f"{results['meta']['revision']}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+
+    print_table(results)
+    print(f"Results written to {output}")
+    if args.baseline:
+        return report_regressions(json.loads(Path(args.baseline).read_text()), results, args.threshold)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="seed, serve and load-test")
+    run_parser.add_argument("--users", type=int, default=50)
+    run_parser.add_argument("--tasks", type=int, default=200, help="tasks seeded per user")
+    run_parser.add_argument("--concurrency", type=int, default=32, help="HTTP clients, and websocket clients")
+    run_parser.add_argument("--login-concurrency", type=int,
+                            help="login clients, default --concurrency; past the DB pool size, so logins holding a connection through bcrypt fail")
+    run_parser.add_argument("--requests", type=int, default=500, help="requests per HTTP scenario")
+    run_parser.add_argument("--ws-loops", type=int, default=20, help="add/update/delete loops per websocket client")
+    run_parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    run_parser.add_argument("--scenarios", nargs="+", choices=["login", "tasks", "ws"], default=["login", "tasks", "ws"])
+    run_parser.add_argument("--env", nargs="*", default=[], metavar="KEY=VALUE", help="extra server environment")
+    run_parser.add_argument("--output", help=f"results file, default {RESULTS_DIR}/<revision>.json")
+    run_parser.add_argument("--baseline", help="results file to check for regressions against")
+    run_parser.add_argument("--threshold", type=float, default=0.1)
+
+    compare_parser = commands.add_parser("compare", help="check one results file against another")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        args.login_concurrency = args.login_concurrency or args.concurrency
+        sys.exit(run(args))
+    sys.exit(report_regressions(*(json.loads(Path(path).read_text()) for path in (args.baseline, args.current)), args.threshold))
@@ -0,0 +1,88 @@
+# benchmarks/render_tasks.py
+
+"""
+Rendering cost of index.html for a large task list.
+
+Compares the old per-row url_for('static', ...) against the hoisted icon URL,
+and a full in-memory render against streaming with generate_async (total time
+and time to first chunk):
+
+    python -m benchmarks.render_tasks --tasks 10000 --repeat 5
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from starlette.requests import Request
+
+from src.common.models import Task, User
+from src.server import templating
+
+
+def make_request() -> Request:
+    from src.server.app import create_app
+
+    app = create_app()
+
+    scope = {
+        "type": "http", "method": "GET", "path": "/tasks", "query_string": b"", "headers": [],
+        "scheme": "http", "server": ("127.0.0.1", 8000), "root_path": "", "app": app, "router": app.router,
+    }
+    return Request(scope)
+
+
+def per_row_url_template():
+    """index.html as it was, calling url_for for every row's trash icon"""
+    source, _, _ = templating.templates.env.loader.get_source(templating.templates.env, "index.html")
+    source = source.replace("{{ trash_icon }}", "{{ url_for('static', path='icons/trash.png') }}")
+    return templating.templates.env.from_string(source)
+
+
+def timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        began = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - began)
+    return best
+
+
+async def stream(context: dict) -> tuple[float, float]:
+    began = time.perf_counter()
+    first = None
+    async for _ in templating.stream_template("index.html", context):
+        if first is None:
+            first = time.perf_counter() - began
+    return first, time.perf_counter() - began
+
+
+def run(count: int, repeat: int) -> dict:
+    templating.precompile()
+    tasks = [Task(id=i, content=f"task number {i}", completed=i % 3 == 0, user_id=1) for i in range(1, count + 1)]
+    context = {
+        "request": make_request(), "tasks": tasks, "next_cursor": None,
+        "user": User(id=1, username="bench", email="bench@x.io", password="-"),
+    }
+
+    hoisted = templating.templates.env.get_template("index.html")
+    per_row = per_row_url_template()
+    streamed = [asyncio.run(stream(context)) for _ in range(repeat)]
+
+    return {
+        "tasks": count,
+        "per_row_url_ms": round(timed(lambda: per_row.render(context), repeat) * 1000, 1),
+        "hoisted_url_ms": round(timed(lambda: hoisted.render(context), repeat) * 1000, 1),
+        "streamed_total_ms": round(min(total for _, total in streamed) * 1000, 1),
+        "streamed_first_chunk_ms": round(min(first for first, _ in streamed) * 1000, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.tasks, args.repeat), indent=2))
@@ -0,0 +1,77 @@
+# benchmarks/search_tasks.py
+
+"""
+Search latency for a user with a large list, on SQLite with the FTS5 index.
+
+Seeds --tasks tasks for the searching user and as many again spread over
+other users, then times TaskOperations.search for a few query shapes (best
+of --repeat):
+
+    python -m benchmarks.search_tasks --tasks 100000 --repeat 20
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+WORDS = (
+    "buy call email fix pay book plan read send clean cook order write check review update renew cancel "
+    "milk bread groceries plumber dentist invoice report taxes flight hotel garden car laundry meeting "
+    "birthday present insurance passport library tickets budget slides"
+).split()
+
+QUERIES = {"one word": "invoice", "two-letter prefix": "bu", "two words": "pay invoice", "no match": "zebra"}
+
+
+def seed(engine, count: int) -> None:
+    from sqlalchemy import insert
+    from src.common.models import Task, User
+
+    rng = random.Random(42)
+    with engine.begin() as conn:
+        conn.execute(insert(User.__table__), [
+            {"id": i, "username": f"user{i}", "email": f"user{i}@bench.local", "password": "-"} for i in range(1, 11)
+        ])
+        rows = [{"user_id": 1, "content": " ".join(rng.sample(WORDS, 4)), "completed": False} for _ in range(count)]
+        rows += [{"user_id": rng.randint(2, 10), "content": " ".join(rng.sample(WORDS, 4)), "completed": False} for _ in range(count)]
+        conn.execute(insert(Task.__table__), rows)
+
+
+def run(count: int, repeat: int) -> dict:
+    from sqlmodel import Session
+    from src.common.db_storage import DBStorageHandler, create_db_engine
+    from src.common.migrations import run_migrations
+    from src.modules.task_operations import TaskOperations
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_db_engine(f"sqlite:///{directory}/search.db")
+        run_migrations(engine)
+        began = time.perf_counter()
+        seed(engine, count)
+        seeded = time.perf_counter() - began
+
+        results = {"tasks": count, "seed_s": round(seeded, 1)}
+        with Session(engine) as session:
+            task_operations = TaskOperations(DBStorageHandler(session))
+            for name, query in QUERIES.items():
+                best, matches = float("inf"), 0
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    matches = len(task_operations.search(1, query, limit=50))
+                    best = min(best, time.perf_counter() - started)
+                results[name] = {"query": query, "ms": round(best * 1000, 2), "returned": matches}
+        engine.dispose()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ["CACHE_URL"] = "none"
+    print(json.dumps(run(args.tasks, args.repeat), indent=2))
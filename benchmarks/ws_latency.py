@@ -0,0 +1,81 @@
+# benchmarks/ws_latency.py
+
+"""
+Websocket round-trip latency under concurrent clients.
+
+Start the server first, once per backend you want to compare:
+
+    DATABASE_URL=sqlite:///./bench.db uvicorn --factory src.server.app:create_app
+    DATABASE_URL=sqlite+aiosqlite:///./bench.db uvicorn --factory src.server.app:create_app
+
+then run:
+
+    python -m benchmarks.ws_latency --clients 500 --messages 10
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import httpx
+import websockets
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def login_cookie(base_url: str) -> str:
+    """Register a throwaway user and return its session cookie"""
+    name = f"bench_{uuid.uuid4().hex[:10]}"
+    with httpx.Client(base_url=base_url) as client:
+        client.post("/register", data={"username": name, "email": f"{name}@bench.local", "password": "benchpass"})
+        client.post("/login", data={"username": name, "password": "benchpass"})
+        return client.cookies["session"]
+
+
+async def run_client(ws_url: str, cookie: str, messages: int, samples: list[float], start: asyncio.Event):
+    async with websockets.connect(ws_url, additional_headers={"Cookie": f"session={cookie}"}, max_queue=None) as ws:
+        await start.wait()
+        for i in range(messages):
+            sent = time.perf_counter()
+            await ws.send(json.dumps({"action": "add", "content": f"bench task {i}"}))
+            await ws.recv()
+            samples.append(time.perf_counter() - sent)
+
+
+async def main(base_url: str, clients: int, messages: int) -> dict:
+    cookie = login_cookie(base_url)
+    ws_url = base_url.replace("http", "ws", 1) + "/ws"
+    samples: list[float] = []
+    start = asyncio.Event()
+
+    runners = [asyncio.create_task(run_client(ws_url, cookie, messages, samples, start)) for _ in range(clients)]
+    await asyncio.sleep(1)  # let every socket finish its handshake
+    began = time.perf_counter()
+    start.set()
+    await asyncio.gather(*runners)
+    elapsed = time.perf_counter() - began
+
+    return {
+        "clients": clients,
+        "messages": len(samples),
+        "rps": round(len(samples) / elapsed, 1),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 95) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=10)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(main(args.url, args.clients, args.messages)), indent=2))
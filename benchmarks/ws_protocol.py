@@ -0,0 +1,110 @@
+# benchmarks/ws_protocol.py
+
+"""
+Per-frame cost and size of the /ws protocol, without a server.
+
+Compares the old handling (stdlib json, no validation) with the typed
+protocol in JSON (orjson when installed) and MessagePack. For each frame shape
+it times decode + validate for client frames and encode for server frames,
+best of --repeat, and reports bytes per frame raw and through a
+permessage-deflate stream (shared context, as browsers negotiate it):
+
+    python -m benchmarks.ws_protocol --repeat 5
+"""
+
+import argparse
+import json
+import time
+import zlib
+
+CLIENT_FRAMES = {
+    "add": {"action": "add", "content": "Buy milk and bread on the way home"},
+    "update": {"action": "update", "id": "48213"},
+    "batch of 50 adds": {"action": "batch", "operations": [{"action": "add", "content": f"Pasted line number {i}"} for i in range(50)]},
+}
+
+WORDS = "buy call email fix pay book plan read send clean milk bread plumber invoice report taxes flight hotel".split()
+
+
+def words(seed: int, count: int = 5) -> str:
+    return " ".join(WORDS[(seed * 7 + i * 3) % len(WORDS)] for i in range(count))
+
+
+# The n-th frame of a session, so deflate sees frames that differ like real ones do
+SERVER_FRAMES = {
+    "add reply": lambda n: {
+        "status": 1, "action": "add", "id": 48213 + n, "content": words(n),
+        "counts": {"total": 120 + n, "completed": 45, "open": 75 + n},
+    },
+    "page of 100": lambda n: {
+        "status": 1, "action": "page", "next": 48313 + n * 100, "counts": {"total": 2000, "completed": 45, "open": 1955},
+        "tasks": [{"id": 48213 + n * 100 + i, "content": words(n * 100 + i), "completed": (n + i) % 3 == 0} for i in range(100)],
+    },
+}
+
+
+def best_of(repeat: int, loops: int, func) -> float:
+    """Microseconds per call"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, (time.perf_counter() - started) / loops)
+    return round(best * 1e6, 2)
+
+
+def deflated_size(frames: list[bytes]) -> float:
+    """Mean bytes per frame through one permessage-deflate context"""
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    total = 0
+    for frame in frames:
+        # Each message ends with a sync flush, whose 00 00 ff ff tail isn't sent
+        total += len(compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+    return round(total / len(frames), 1)
+
+
+def run(repeat: int, loops: int) -> dict:
+    from src.common.protocol import JSON, MSGPACK, msgpack, orjson, parse_frame
+
+    def stdlib_encode(message):
+        return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+    codecs = {"stdlib json, unvalidated": None, "json": JSON}
+    if msgpack:
+        codecs["msgpack"] = MSGPACK
+
+    results = {"orjson": orjson is not None, "client frames": {}, "server frames": {}}
+    for name, message in CLIENT_FRAMES.items():
+        row = results["client frames"][name] = {}
+        for label, codec in codecs.items():
+            if codec is None:
+                frame = stdlib_encode(message)
+                row[label] = {"us": best_of(repeat, loops, lambda: json.loads(frame)), "bytes": len(frame.encode())}
+            else:
+                frame = codec.encode(message)
+                size = len(frame.encode() if isinstance(frame, str) else frame)
+                row[label] = {"us": best_of(repeat, loops, lambda: parse_frame(codec, frame)), "bytes": size}
+
+    for name, frame_at in SERVER_FRAMES.items():
+        row = results["server frames"][name] = {}
+        message = frame_at(0)
+        for label, codec in codecs.items():
+            encode = stdlib_encode if codec is None else codec.encode
+            session = [encode(frame_at(n)) for n in range(20)]
+            session = [frame.encode() if isinstance(frame, str) else frame for frame in session]
+            row[label] = {
+                "us": best_of(repeat, loops, lambda: encode(message)),
+                "bytes": round(sum(map(len, session)) / len(session), 1),
+                "deflated": deflated_size(session),
+            }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--loops", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.repeat, args.loops), indent=2))
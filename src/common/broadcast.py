@@ -0,0 +1,302 @@
+# src/common/broadcast.py
+
+import os
+import asyncio
+import logging
+import uuid
+from collections import defaultdict
+from collections.abc import Callable
+from typing import Protocol
+from urllib.parse import urlparse
+
+from src.common.protocol import JSON, JSONCodec, MessagePackCodec
+
+# memory:// or redis://host:6379. The memory backend only reaches sockets held
+# by its own process, so run with a redis:// URL when serving from several workers.
+BROADCAST_URL = os.getenv("BROADCAST_URL", "memory://")
+# Frames buffered per socket before a client that isn't reading gets dropped
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# "Try again later"; the client reconnects and reloads its list
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+logger = logging.getLogger("simplist.broadcast")
+
+
+def encode(message: dict) -> str:
+    # What goes through the backend; connections speaking another codec re-encode it
+    return JSON.encode(message)
+
+
+class Connection:
+    """
+    A websocket with a bounded send queue drained by its own writer task.
+    Replies to the socket's own messages wait for room in the queue; fan-out
+    from other sockets never waits, and drops the connection instead.
+    """
+
+    def __init__(self, websocket, max_queued: int = WS_SEND_QUEUE_SIZE, codec: JSONCodec | MessagePackCodec = JSON):
+        self.websocket = websocket
+        self.codec = codec
+        self.id = uuid.uuid4().hex
+        self.queue: asyncio.Queue[str | bytes] = asyncio.Queue(max_queued)
+        self.closed = False
+        self._writer: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._writer = asyncio.create_task(self._write())
+
+    def stop(self) -> None:
+        if self._writer is not None:
+            self._writer.cancel()
+
+    async def send(self, message: dict) -> None:
+        if self.closed:
+            raise ConnectionError("Connection closed")
+        await self.queue.put(self.codec.encode(message))
+
+    def offer(self, frame: str | bytes) -> bool:
+        """Queue a frame already in this connection's codec without waiting; a full queue drops the connection"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            logger.warning("Dropping slow websocket consumer %s", self.id)
+            self.stop()
+            self._release()
+            asyncio.create_task(self._close(SLOW_CONSUMER_CLOSE_CODE))
+            return False
+
+    async def _write(self):
+        try:
+            while True:
+                frame = await self.queue.get()
+                if isinstance(frame, bytes):
+                    await self.websocket.send_bytes(frame)
+                else:
+                    await self.websocket.send_text(frame)
+        finally:
+            self._release()
+
+    def _release(self):
+        # Nothing reads the queue from here on: unblock anyone waiting in send()
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    async def _close(self, code: int):
+        try:
+            await self.websocket.close(code)
+        except Exception:
+            # The client may already be gone
+            pass
+
+
+class BroadcastBackend(Protocol):
+    async def subscribe(self, channel: str, callback: Callable[[str], None]) -> None: ...
+    async def unsubscribe(self, channel: str) -> None: ...
+    async def publish(self, channel: str, payload: str) -> None: ...
+    async def close(self) -> None: ...
+
+
+class MemoryBroadcastBackend:
+    """Delivers within the publishing process"""
+
+    def __init__(self):
+        self._channels: dict[str, Callable[[str], None]] = {}
+
+    async def subscribe(self, channel: str, callback: Callable[[str], None]) -> None:
+        self._channels[channel] = callback
+
+    async def unsubscribe(self, channel: str) -> None:
+        self._channels.pop(channel, None)
+
+    async def publish(self, channel: str, payload: str) -> None:
+        callback = self._channels.get(channel)
+        if callback is not None:
+            callback(payload)
+
+    async def close(self) -> None:
+        self._channels.clear()
+
+
+def command(*args) -> bytes:
+    parts = [f"*{len(args)}\r\n".encode()]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(parts)
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed by broadcast server")
+    kind, payload = line[:1], line[1:-2]
+    if kind == b"*":
+        return [await read_reply(reader) for _ in range(int(payload))]
+    if kind == b"$":
+        length = int(payload)
+        return None if length < 0 else (await reader.readexactly(length + 2))[:-2]
+    if kind == b":":
+        return int(payload)
+    if kind == b"-":
+        raise ConnectionError(payload.decode())
+    return payload
+
+
+async def round_trip(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    await writer.drain()
+    return await read_reply(reader)
+
+
+class RedisBroadcastBackend:
+    """
+    PUBLISH/SUBSCRIBE over RESP, one channel per user, so a worker only
+    receives changes for users it holds sockets for. Uses one connection to
+    publish and one to listen; the listener reconnects and resubscribes.
+    Messages published while it is disconnected are lost.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, timeout: float = 0.5, reconnect_delay: float = 1):
+        self.host, self.port, self.timeout, self.reconnect_delay = host, port, timeout, reconnect_delay
+        self._channels: dict[str, Callable[[str], None]] = {}
+        self._listener: asyncio.Task | None = None
+        self._subscriber: asyncio.StreamWriter | None = None
+        self._publisher: tuple[asyncio.StreamReader, asyncio.StreamWriter] | None = None
+        self._publish_lock = asyncio.Lock()
+
+    async def subscribe(self, channel: str, callback: Callable[[str], None]) -> None:
+        self._channels[channel] = callback
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+        await self._send_subscriber("SUBSCRIBE", channel)
+
+    async def unsubscribe(self, channel: str) -> None:
+        if self._channels.pop(channel, None) is not None:
+            await self._send_subscriber("UNSUBSCRIBE", channel)
+
+    async def publish(self, channel: str, payload: str) -> None:
+        async with self._publish_lock:
+            try:
+                if self._publisher is None:
+                    self._publisher = await self._connect()
+                reader, writer = self._publisher
+                writer.write(command("PUBLISH", channel, payload))
+                # Bounded, or a stalled server would hold up the handler publishing, and every publish queued behind it
+                await asyncio.wait_for(round_trip(reader, writer), self.timeout)
+            except (OSError, EOFError, asyncio.TimeoutError) as e:
+                # Other tabs miss this change until they reload; the write itself went through. A late reply
+                # would answer the next PUBLISH, so the connection goes too
+                logger.warning("Broadcast publish failed, dropping the message: %r", e)
+                self._close_publisher()
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._subscriber is not None:
+            self._subscriber.close()
+            self._subscriber = None
+        self._close_publisher()
+
+    async def _connect(self):
+        return await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+
+    async def _send_subscriber(self, *args):
+        # Before the listener connects this is a no-op; it subscribes to every channel once up
+        if self._subscriber is None:
+            return
+        try:
+            self._subscriber.write(command(*args))
+            await self._subscriber.drain()
+        except OSError:
+            # The listener notices the broken connection and resubscribes
+            pass
+
+    async def _listen(self):
+        while True:
+            try:
+                reader, self._subscriber = await self._connect()
+                if self._channels:
+                    self._subscriber.write(command("SUBSCRIBE", *self._channels))
+                while True:
+                    reply = await read_reply(reader)
+                    if reply[0] == b"message":
+                        callback = self._channels.get(reply[1].decode())
+                        if callback is not None:
+                            callback(reply[2].decode())
+            except (OSError, EOFError, asyncio.TimeoutError) as e:
+                logger.warning("Broadcast subscriber disconnected: %s", e)
+                self._subscriber = None
+                await asyncio.sleep(self.reconnect_delay)
+
+    def _close_publisher(self):
+        if self._publisher is not None:
+            self._publisher[1].close()
+        self._publisher = None
+
+
+class Broadcaster:
+    """
+    Fans task changes out to every open socket of a user. Frames are encoded
+    once per publish (and per codec) and queued as-is on each socket; the socket
+    a change came from is skipped, since it already got the reply.
+    """
+
+    def __init__(self, backend: BroadcastBackend):
+        self.backend = backend
+        self.connections: dict[int, set[Connection]] = defaultdict(set)
+
+    async def join(self, user_id: int | None, connection: Connection) -> None:
+        if user_id is None:
+            return
+        first = not self.connections[user_id]
+        self.connections[user_id].add(connection)
+        if first:
+            await self.backend.subscribe(channel(user_id), lambda payload: self.deliver(user_id, payload))
+
+    async def leave(self, user_id: int | None, connection: Connection) -> None:
+        connections = self.connections.get(user_id)
+        if connections is None:
+            return
+        connections.discard(connection)
+        if not connections:
+            del self.connections[user_id]
+            await self.backend.unsubscribe(channel(user_id))
+
+    async def publish(self, user_id: int | None, message: dict, origin: Connection | None = None) -> None:
+        if user_id is None:
+            return
+        origin_id = origin.id if origin is not None else "-"
+        await self.backend.publish(channel(user_id), f"{origin_id} {encode(message)}")
+
+    def deliver(self, user_id: int, payload: str) -> None:
+        origin_id, text = payload.split(" ", 1)
+        # Re-encoded at most once per codec in use among the user's sockets
+        frames = {JSON: text}
+        for connection in list(self.connections.get(user_id, ())):
+            if connection.id != origin_id:
+                if connection.codec not in frames:
+                    frames[connection.codec] = connection.codec.encode(JSON.decode(text))
+                connection.offer(frames[connection.codec])
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+
+def channel(user_id: int) -> str:
+    return f"tasks:{user_id}"
+
+
+def create_broadcaster(url: str) -> Broadcaster:
+    parsed = urlparse(url)
+    if parsed.scheme == "memory":
+        return Broadcaster(MemoryBroadcastBackend())
+    if parsed.scheme == "redis":
+        return Broadcaster(RedisBroadcastBackend(parsed.hostname or "127.0.0.1", parsed.port or 6379))
+    raise ValueError(f"Unsupported BROADCAST_URL scheme: {parsed.scheme}")
+
+
+broadcaster = create_broadcaster(BROADCAST_URL)
@@ -0,0 +1,333 @@
+# src/common/cache.py
+
+import os
+import json
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import Protocol, TypeVar
+from urllib.parse import urlparse, parse_qs
+
+from pydantic import ValidationError
+from sqlmodel import SQLModel
+from starlette.concurrency import run_in_threadpool
+
+T = TypeVar("T", bound=SQLModel)
+
+# memory://?max_entries=10000&ttl=60, redis://host:6379/0?ttl=60 or none (the default).
+# The memory backend only sees writes made by its own process, so it is for a
+# single worker; with several, another worker's writes leave it stale for the
+# TTL. Use a redis:// URL there.
+CACHE_URL = os.getenv("CACHE_URL", "none")
+
+
+class CacheBackend(Protocol):
+    # True when calls wait on the network, so async code runs them in the threadpool
+    blocking: bool
+
+    def get(self, key: str) -> bytes | None: ...
+    def set(self, key: str, value: bytes, ttl: float) -> None: ...
+    def delete(self, *keys: str) -> None: ...
+
+
+class MemoryCacheBackend:
+    """In-process LRU with per-entry expiry"""
+
+    blocking = False
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+
+class RESPConnection:
+    def __init__(self, host: str, port: int, db: int, timeout: float):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.reader = self.sock.makefile("rb")
+        if db:
+            self.send(("SELECT", db))
+
+    def send(self, *commands: tuple) -> list:
+        """Write the commands in one go (pipelined), then read one reply per command"""
+        parts = []
+        for args in commands:
+            parts.append(f"*{len(args)}\r\n".encode())
+            for arg in args:
+                data = arg if isinstance(arg, bytes) else str(arg).encode()
+                parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self.sock.sendall(b"".join(parts))
+        return [self.read_reply() for _ in commands]
+
+    def read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            return self.reader.read(length + 2)[:-2]
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [self.read_reply() for _ in range(length)]
+        if kind == b":":
+            return int(payload)
+        if kind == b"-":
+            raise ConnectionError(payload.decode())
+        return payload
+
+    def close(self):
+        self.sock.close()
+
+
+class RESPClient:
+    """
+    Minimal blocking client for Redis or anything speaking its protocol (RESP).
+    Each call takes a connection of its own from a pool, so threads don't queue
+    behind each other's round trips
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, db: int = 0, timeout: float = 0.5, max_idle: int = 16):
+        self.host, self.port, self.db, self.timeout = host, port, db, timeout
+        self.max_idle = max_idle
+        self._idle: list[RESPConnection] = []
+        self._lock = threading.Lock()
+
+    def command(self, *args):
+        return self._send(args)[0]
+
+    def transaction(self, *commands: tuple) -> list:
+        """Run the commands atomically (MULTI ... EXEC) in one round trip; returns their replies"""
+        return self._send(("MULTI",), *commands, ("EXEC",))[-1]
+
+    def _send(self, *commands: tuple) -> list:
+        with self._lock:
+            connection = self._idle.pop() if self._idle else None
+        try:
+            if connection is None:
+                connection = RESPConnection(self.host, self.port, self.db, self.timeout)
+            replies = connection.send(*commands)
+        except OSError:
+            # Possibly mid-reply, so the connection can't be reused
+            if connection is not None:
+                connection.close()
+            raise
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(connection)
+                connection = None
+        if connection is not None:
+            connection.close()
+        return replies
+
+
+class RedisCacheBackend:
+    """
+    GET, SET PX and DEL against a Redis server. Eviction is left to the
+    server's maxmemory-policy, e.g. allkeys-lru.
+    """
+
+    blocking = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, db: int = 0, timeout: float = 0.5):
+        self.client = RESPClient(host, port, db, timeout)
+
+    def get(self, key: str) -> bytes | None:
+        return self.client.command("GET", key)
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        self.client.command("SET", key, value, "PX", int(ttl * 1000))
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            self.client.command("DEL", *keys)
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    invalidations: int = 0
+    errors: int = 0
+
+
+class Cache:
+    """
+    Model-aware front for a CacheBackend. Rows are stored as JSON column dicts
+    and validated back into detached model instances, so nothing in the backend
+    can make the app run code; backend failures, and entries that don't
+    validate, count as misses.
+    """
+
+    def __init__(self, backend: CacheBackend, ttl: float = 60):
+        self.backend = backend
+        self.ttl = ttl
+        self.stats = CacheStats()
+
+    async def run(self, method, *args):
+        """Call one of these methods from async code, off the event loop when the backend waits on the network"""
+        if self.backend.blocking:
+            return await run_in_threadpool(method, *args)
+        return method(*args)
+
+    def get_model(self, key: str, model_type: type[T]) -> T | None:
+        data = self._get(key)
+        model = None if data is None else self._validate(model_type, [data])
+        self._record(model is not None)
+        return model[0] if model else None
+
+    def get_models(self, key: str, model_type: type[T], limit: int | None = None) -> list[T] | None:
+        """
+        Lists are cached as a prefix (the first `limit` rows, or all of them), so
+        a cached first page also answers smaller first pages and, when it turned
+        out to hold every row, full-list reads
+        """
+        data = self._get(key)
+        models = None
+        if data is not None:
+            cached_limit, rows = data
+            complete = cached_limit is None or len(rows) < cached_limit
+            if complete or (limit is not None and limit <= cached_limit):
+                models = self._validate(model_type, rows[:limit])
+
+        self._record(models is not None)
+        return models
+
+    def set_model(self, key: str, model: SQLModel) -> None:
+        self._set(key, model.model_dump(mode="json"))
+
+    def set_models(self, key: str, models: list[SQLModel], limit: int | None = None) -> None:
+        self._set(key, [limit, [model.model_dump(mode="json") for model in models]])
+
+    def version(self, key: str) -> str | None:
+        """
+        Opaque token for `key` that changes whenever it is invalidated, for use
+        in validators such as ETags. Minted on first use, so losing it to
+        eviction only costs one full response.
+        """
+        token_key = version_key(key)
+        try:
+            token = self.backend.get(token_key)
+            if token is None:
+                token = uuid.uuid4().hex[:16].encode()
+                self.backend.set(token_key, token, self.ttl)
+        except OSError:
+            self.stats.errors += 1
+            return None
+        return token.decode()
+
+    def invalidate(self, *keys: str) -> None:
+        self.stats.invalidations += len(keys)
+        try:
+            self.backend.delete(*keys)
+        except OSError:
+            self.stats.errors += 1
+
+    def _get(self, key: str):
+        try:
+            value = self.backend.get(key)
+        except OSError:
+            self.stats.errors += 1
+            return None
+        try:
+            return None if value is None else json.loads(value)
+        except ValueError:
+            self.stats.errors += 1
+            return None
+
+    def _validate(self, model_type: type[T], rows: list) -> list[T] | None:
+        try:
+            return [model_type.model_validate(row) for row in rows]
+        except (ValidationError, TypeError):
+            self.stats.errors += 1
+            return None
+
+    def _record(self, hit: bool) -> None:
+        if hit:
+            self.stats.hits += 1
+        else:
+            self.stats.misses += 1
+
+    def _set(self, key: str, data) -> None:
+        try:
+            self.backend.set(key, json.dumps(data, separators=(",", ":")).encode(), self.ttl)
+        except OSError:
+            self.stats.errors += 1
+
+
+def row_key(model_type: type[SQLModel], id) -> str:
+    return f"{model_type.__tablename__}:{id}"
+
+
+def group_key(model_type: type[SQLModel], field: str, value) -> str:
+    return f"{model_type.__tablename__}:{field}={value}"
+
+
+def version_key(key: str) -> str:
+    return f"{key}:version"
+
+
+def model_keys(model: SQLModel) -> set[str]:
+    """Keys that hold this row: its own entry plus every list it is grouped into, and their versions"""
+    model_type = type(model)
+    # Composite keys (TaskChange's user_id and version) join their columns
+    id = ",".join(str(getattr(model, column)) for column in model_type.__table__.primary_key.columns.keys())
+    values = {field: getattr(model, field) for field in getattr(model_type, "__cache_groups__", ())}
+    return {row_key(model_type, id)} | group_keys(model_type, values)
+
+
+def group_keys(model_type: type[SQLModel], values: Mapping) -> set[str]:
+    """Keys of the lists a row with these column values is grouped into, and their versions"""
+    keys = set()
+    for field in getattr(model_type, "__cache_groups__", ()):
+        key = group_key(model_type, field, values[field])
+        keys |= {key, version_key(key)}
+    return keys
+
+
+def create_cache(url: str) -> Cache | None:
+    parsed = urlparse(url)
+    options = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+    ttl = float(options.get("ttl", 60))
+
+    if parsed.scheme == "memory":
+        return Cache(MemoryCacheBackend(int(options.get("max_entries", 10000))), ttl)
+    if parsed.scheme == "redis":
+        db = int(parsed.path.lstrip("/") or 0)
+        return Cache(RedisCacheBackend(parsed.hostname or "127.0.0.1", parsed.port or 6379, db), ttl)
+    if parsed.scheme in ("", "none"):
+        return None
+    raise ValueError(f"Unsupported CACHE_URL scheme: {parsed.scheme}")
+
+
+default_cache = create_cache(CACHE_URL)
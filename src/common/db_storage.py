@@ -2,18 +2,119 @@
 
 import os
 from typing import Annotated, TypeVar, Generic
-from collections.abc import Generator
+from collections.abc import AsyncGenerator, AsyncIterator, Callable, Generator, Iterator
 
 from fastapi import Depends
-from sqlmodel import Session, SQLModel, create_engine, select
+from sqlmodel import Session, SQLModel, create_engine, select, insert, update, delete
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import Engine, event
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import ColumnElement
+from sqlalchemy.util import await_only, greenlet_spawn
+from starlette.concurrency import run_in_threadpool
+
+import src.common.cache as caching
+from src.common.cache import Cache, row_key, group_key, group_keys, model_keys
+from src.common.instrumentation import instrument_engine
+from src.common.sharding import DATABASE_SHARD_URLS, ShardRouter, parse_shard_urls
 
 # Database setup
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./database.db")
-engine = create_engine(DATABASE_URL, echo=True)
+# Optional replica that get_all* reads go to, past the cache; writes and lookups by id stay on DATABASE_URL.
+# Task shards (DATABASE_SHARD_URLS, see src/common/sharding.py) have no replicas
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+
+# Pool settings; ignored for in-memory SQLite, which keeps a single connection
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+
+# Logs every statement; per-request query stats come from src.common.instrumentation instead
+DB_ECHO = os.getenv("DB_ECHO", "0") == "1"
+
+# Applied to every new SQLite connection
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+}
+
+# An async driver in DATABASE_URL (e.g. sqlite+aiosqlite, postgresql+asyncpg) selects
+# the async backend; the sync engine then uses the dialect's default sync driver
+_database_url = make_url(DATABASE_URL)
+IS_ASYNC_DATABASE = _database_url.get_dialect().is_async
+
+
+def sync_url(url: URL) -> URL:
+    return url.set(drivername=url.get_backend_name()) if url.get_dialect().is_async else url
+
+
+def engine_options(url: URL) -> dict:
+    options = {"echo": DB_ECHO}
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return options
+    return {
+        **options,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def create_db_engine(url: str | URL) -> Engine:
+    url = sync_url(make_url(url))
+    db_engine = create_engine(url, **engine_options(url))
+    instrument_engine(db_engine)
+    if url.get_backend_name() == "sqlite":
+        event.listen(db_engine, "connect", set_sqlite_pragmas)
+    return db_engine
+
+
+def create_async_db_engine(url: str | URL) -> AsyncEngine:
+    url = make_url(url)
+    db_engine = create_async_engine(url, **engine_options(url))
+    instrument_engine(db_engine.sync_engine)
+    if url.get_backend_name() == "sqlite":
+        event.listen(db_engine.sync_engine, "connect", set_sqlite_pragmas)
+    return db_engine
+
+
+engine = create_db_engine(_database_url)
+async_engine = create_async_db_engine(_database_url) if IS_ASYNC_DATABASE else None
+read_engine = create_db_engine(DATABASE_READ_URL) if DATABASE_READ_URL else None
+async_read_engine = create_async_db_engine(DATABASE_READ_URL) if DATABASE_READ_URL and IS_ASYNC_DATABASE else None
 
 SessionLocal = sessionmaker(bind=engine, class_=Session, expire_on_commit=False)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=False) if async_engine else None
+ReadSessionLocal = sessionmaker(bind=read_engine, class_=Session, expire_on_commit=False) if read_engine else None
+AsyncReadSessionLocal = async_sessionmaker(bind=async_read_engine, class_=AsyncSession, expire_on_commit=False) if async_read_engine else None
+
+# Task shards, by name; the engines above are the directory
+shard_engines = {name: create_db_engine(url) for name, url in parse_shard_urls(DATABASE_SHARD_URLS).items()}
+async_shard_engines = {
+    name: create_async_db_engine(url) for name, url in parse_shard_urls(DATABASE_SHARD_URLS).items()
+} if IS_ASYNC_DATABASE else {}
+shard_router = ShardRouter(
+    {name: sessionmaker(bind=shard_engine, class_=Session, expire_on_commit=False) for name, shard_engine in shard_engines.items()},
+    SessionLocal,
+    {name: async_sessionmaker(bind=shard_engine, class_=AsyncSession, expire_on_commit=False) for name, shard_engine in async_shard_engines.items()},
+) if shard_engines else None
 
 def get_session() -> Generator[Session, None, None]:
     session = SessionLocal()
@@ -22,58 +123,347 @@ def get_session() -> Generator[Session, None, None]:
     finally:
         session.close()
 
+async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as session:
+        yield session
+
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
 
 SessionDep = Annotated[Session, Depends(get_session)]
+AsyncSessionDep = Annotated[AsyncSession, Depends(get_async_session)]
 
 
 T = TypeVar("T", bound=SQLModel)
+R = TypeVar("R")
+
+def page_stmt(model_type: type[T], conditions, after: int | None = None, limit: int | None = None):
+    stmt = select(model_type).where(*conditions)
+    if after is not None:
+        stmt = stmt.where(model_type.id > after)
+    return stmt.order_by(model_type.id).limit(limit)
+
+
+# Set-based statements shared by both handlers. They run against the table,
+# not the mapped class, so nothing passes through the ORM identity map.
+def bulk_insert_stmt(model_type: type[T]):
+    table = model_type.__table__
+    return insert(table).returning(*table.columns, sort_by_parameter_order=True)
+
+def update_where_stmt(model_type: type[T], values: dict, *conditions: ColumnElement):
+    table = model_type.__table__
+    return update(table).where(*conditions).values(values).returning(*table.columns)
+
+def delete_where_stmt(model_type: type[T], *conditions: ColumnElement):
+    table = model_type.__table__
+    return delete(table).where(*conditions).returning(*table.columns)
+
+def increment_stmts(dialect: str, model_type: type[T], id, deltas: dict) -> tuple:
+    """
+    Statements adding `deltas` to a row's columns, creating the row from them when it
+    doesn't exist: one upsert where the dialect has it, else an UPDATE and the INSERT
+    to run when it matched nothing. Both return the row as it ends up
+    """
+    table = model_type.__table__
+    [key] = table.primary_key.columns.keys()
+    values = {key: id, **deltas}
+    dialect_insert = {"sqlite": sqlite_insert, "postgresql": postgresql_insert}.get(dialect)
+    if dialect_insert:
+        stmt = dialect_insert(table).values(values)
+        upsert = stmt.on_conflict_do_update(index_elements=[key], set_={column: table.c[column] + stmt.excluded[column] for column in deltas})
+        return upsert.returning(*table.columns), None
+    added = {column: table.c[column] + delta for column, delta in deltas.items()}
+    return update(table).where(table.c[key] == id).values(added).returning(*table.columns), insert(table).values(values).returning(*table.columns)
+
 
 class DBStorageHandler(Generic[T]):
-    def __init__(self, session: Session):
+    def __init__(
+        self, session: Session, cache: Cache | None = None, read_session: Session | None = None,
+        shards: ShardRouter | None = None,
+    ):
         self.session = session
+        self.read_session = read_session or session
+        self.cache = cache or caching.default_cache
+        self.shards = shards
+        self._stale_keys: set[str] = set()
+        self._shard_storage: dict[str, DBStorageHandler] = {}
+
+    def shard(self, user_id: int) -> "DBStorageHandler[T]":
+        """Storage on the shard holding the user's tasks; this one when unsharded"""
+        return self.on_shard(self.shards.shard_of(user_id)) if self.shards else self
+
+    def on_shard(self, name: str) -> "DBStorageHandler[T]":
+        """Storage on a shard, opened on first use and committed, rolled back and closed with this one"""
+        if name not in self._shard_storage:
+            self._shard_storage[name] = self._open_shard(name)
+        return self._shard_storage[name]
+
+    def all_shards(self) -> list["DBStorageHandler[T]"]:
+        return [self.on_shard(name) for name in self.shards.names] if self.shards else [self]
 
     def get_all(self, model_type: type[T]) -> list[T]:
-        return list(self.session.exec(select(model_type)).all())
-    
+        return list(self.read_session.exec(select(model_type)).all())
+
+    def find(self, model_type: type[T], id: int, replica: bool = False) -> T | None:
+        """
+        Read-through lookup by primary key; cached rows come back detached.
+        `replica` reads it where get_all* reads go, uncached when that is a replica
+        """
+        key = row_key(model_type, id) if self.cache and (not replica or self.caches_reads) else None
+        if key and (cached := self._cached(self.cache.get_model, key, model_type)) is not None:
+            return cached
+
+        db_model = (self.read_session if replica else self.session).get(model_type, id)
+        if db_model and key:
+            self._cached(self.cache.set_model, key, db_model)
+        return db_model
+
+    @property
+    def caches_reads(self) -> bool:
+        """Whether get_all* go through the cache: never from a replica, which could put back rows a commit just invalidated"""
+        return self.read_session is self.session
+
     def get_by_id(self, id: int, model_type: type[T]) -> T:
-        db_model = self.session.get(model_type, id)
+        db_model = self.find(model_type, id)
         if not db_model:
             raise ValueError(f"{model_type.__name__} with id {id} not found")
         return db_model
-    
-    def get_all_where(self, model_type: type[T], *conditions: ColumnElement) -> list[T]:
-        stmt = select(model_type).where(*conditions)
-        return list(self.session.exec(stmt).all())
 
-    def create(self, model: T) -> T:
+    def group_version(self, model_type: type[T], group: tuple[str, object]) -> str | None:
+        """Token that changes whenever a row in the group is written; None without a cache"""
+        return self._cached(self.cache.version, group_key(model_type, *group)) if self.cache else None
+
+    def get_all_where(
+        self, model_type: type[T], *conditions: ColumnElement,
+        group: tuple[str, object] | None = None, after: int | None = None, limit: int | None = None,
+    ) -> list[T]:
+        """
+        Rows ordered by id, optionally as a keyset page: ids greater than `after`, at most `limit`.
+        `group` names the model's __cache_groups__ field the conditions select on, making
+        the first page (or full list) cacheable
+        """
+        key = group_key(model_type, *group) if group and self.cache and self.caches_reads and after is None else None
+        if key and (cached := self._cached(self.cache.get_models, key, model_type, limit)) is not None:
+            return cached
+
+        db_models = list(self.read_session.exec(page_stmt(model_type, conditions, after, limit)).all())
+        if key:
+            self._cached(self.cache.set_models, key, db_models, limit)
+        return db_models
+
+    @property
+    def dialect(self) -> str:
+        return self.read_session.get_bind().dialect.name
+
+    def select(self, stmt) -> list[T]:
+        """Rows of a prebuilt select, for queries the helpers above don't cover"""
+        return list(self.read_session.exec(stmt).all())
+
+    def stream_where(self, model_type: type[T], *conditions: ColumnElement, batch_size: int = 500) -> Generator[list[T], None, None]:
+        """Rows ordered by id in chunks of `batch_size`, read from a server-side cursor"""
+        stmt = page_stmt(model_type, conditions).execution_options(yield_per=batch_size)
+        yield from self.read_session.exec(stmt).partitions()
+
+    def create(self, model: T, commit: bool = True) -> T:
         self.session.add(model)
-        self.session.commit()
-        self.session.refresh(model)
-        return model
+        self.session.flush()
+        self._mark_stale(model)
+        self._persist(commit)
+        return self._finish(model, commit)
 
-    def update(self, id: int, model_type: type[T], updates: dict) -> T:
+    def update(self, id: int, model_type: type[T], updates: dict, commit: bool = True) -> T:
         db_model = self.session.get(model_type, id)
         if not db_model:
             raise ValueError(f"{model_type.__name__} with id {id} not found")
 
+        self._mark_stale(db_model)
         for key, value in updates.items():
             setattr(db_model, key, value)
+        self._mark_stale(db_model)
 
         self.session.add(db_model)
-        self.session.commit()
-        self.session.refresh(db_model)
-        return db_model
+        self._persist(commit)
+        return self._finish(db_model, commit)
+
+    def delete(self, id: int, model_type: type[T], commit: bool = True) -> None:
+        db_model = self.session.get(model_type, id)
+        if not db_model:
+            raise ValueError(f"{model_type.__name__} with id {id} not found")
 
-    def delete(self, id: int, model_type: type[T]) -> None:
-        db_model = self.get_by_id(id, model_type)
+        self._mark_stale(db_model)
         self.session.delete(db_model)
+        self._persist(commit)
+
+    def bulk_insert(self, model_type: type[T], rows: list[dict], commit: bool = True) -> list[T]:
+        """Multi-row INSERT ... RETURNING; rows come back detached, in input order"""
+        if not rows:
+            return []
+        db_models = self._returning(bulk_insert_stmt(model_type), model_type, rows)
+        self._persist(commit)
+        return db_models
+
+    def insert_many(self, model_type: type[T], rows: list[dict], commit: bool = True) -> int:
+        """One executemany INSERT without RETURNING, for loads that don't need the rows back"""
+        if not rows:
+            return 0
+        self.session.exec(insert(model_type.__table__), params=rows)
+        self._mark_groups_stale(model_type, rows)
+        self._persist(commit)
+        return len(rows)
+
+    def update_where(self, model_type: type[T], values: dict, *conditions: ColumnElement, commit: bool = True) -> list[T]:
+        """Single UPDATE ... WHERE ... RETURNING, without loading rows into the session"""
+        db_models = self._returning(update_where_stmt(model_type, values, *conditions), model_type)
+        self._persist(commit)
+        return db_models
+
+    def delete_where(self, model_type: type[T], *conditions: ColumnElement, commit: bool = True) -> int:
+        """Single DELETE ... WHERE, returning the number of rows removed"""
+        return len(self.delete_rows(model_type, *conditions, commit=commit))
+
+    def delete_rows(self, model_type: type[T], *conditions: ColumnElement, commit: bool = True) -> list[T]:
+        """Single DELETE ... WHERE ... RETURNING; the removed rows come back detached"""
+        db_models = self._returning(delete_where_stmt(model_type, *conditions), model_type)
+        self._persist(commit)
+        return db_models
+
+    def increment(self, model_type: type[T], id, deltas: dict, commit: bool = True) -> T:
+        """Add `deltas` to the columns of row `id`, creating it if missing, without reading it first; returns the row after"""
+        upsert, insert_missing = increment_stmts(self.session.get_bind().dialect.name, model_type, id, deltas)
+        db_models = self._returning(upsert, model_type)
+        if not db_models and insert_missing is not None:
+            db_models = self._returning(insert_missing, model_type)
+        self._persist(commit)
+        return db_models[0]
+
+    def commit(self) -> None:
+        # One transaction per database: a write spanning shards can half commit
         self.session.commit()
+        self._invalidate()
+        for shard_storage in self._shard_storage.values():
+            shard_storage.commit()
+
+    def close(self) -> None:
+        self.session.close()
+        if self.read_session is not self.session:
+            self.read_session.close()
+        for shard_storage in self._shard_storage.values():
+            shard_storage.close()
+
+    def rollback(self) -> None:
+        self.session.rollback()
+        self._stale_keys.clear()
+        for shard_storage in self._shard_storage.values():
+            shard_storage.rollback()
+
+    def call_blocking(self, function: Callable[..., R], *args) -> R:
+        """Call `function`, which waits on something other than these sessions (the shard directory, say)"""
+        return function(*args)
+
+    def _cached(self, method: Callable[..., R], *args) -> R:
+        return method(*args)
+
+    def _open_shard(self, name: str) -> "DBStorageHandler[T]":
+        return DBStorageHandler(self.shards.session(name), cache=self.cache)
+
+    def _persist(self, commit: bool) -> None:
+        # commit=False only flushes, so several writes can share one transaction
+        if commit:
+            self.commit()
+        else:
+            self.session.flush()
+
+    def _finish(self, model: T, commit: bool) -> T:
+        if commit:
+            self.session.refresh(model)
+        return model
+
+    def _returning(self, stmt, model_type: type[T], params: list[dict] | None = None) -> list[T]:
+        db_models = [model_type(**row._mapping) for row in self.session.exec(stmt, params=params)]
+        for db_model in db_models:
+            self._mark_stale(db_model)
+        return db_models
+
+    def _mark_stale(self, model: T) -> None:
+        if self.cache:
+            self._stale_keys |= model_keys(model)
+
+    def _mark_groups_stale(self, model_type: type[T], rows: list[dict]) -> None:
+        # New rows have no cached entry of their own, only the lists they join
+        if self.cache:
+            for row in rows:
+                self._stale_keys |= group_keys(model_type, row)
+
+    def _invalidate(self) -> None:
+        # Only after the commit, so readers can't re-cache the old rows
+        stale_keys, self._stale_keys = self._stale_keys, set()
+        if self.cache and stale_keys:
+            self._cached(self.cache.invalidate, *stale_keys)
+
+
+class AsyncDBStorageHandler(DBStorageHandler[T]):
+    """
+    DBStorageHandler on AsyncSessions, for async drivers. Its methods are the
+    sync ones, working on each AsyncSession's sync_session; call them through
+    run(), SQLAlchemy's greenlet bridge, which awaits the driver wherever they
+    wait on the database. From there, calls to a blocking cache backend and
+    call_blocking go to the threadpool instead of holding up the event loop
+    """
+
+    def __init__(
+        self, session: AsyncSession, cache: Cache | None = None, read_session: AsyncSession | None = None,
+        shards: ShardRouter | None = None,
+    ):
+        super().__init__(session.sync_session, cache, read_session.sync_session if read_session else None, shards)
+
+    async def run(self, function: Callable[..., R], *args, **kwargs) -> R:
+        return await greenlet_spawn(function, *args, **kwargs)
+
+    async def iterate(self, iterator: Iterator[R]) -> AsyncIterator[R]:
+        """A sync iterator over these sessions (stream_where, say), each step run through run()"""
+        done = object()
+        while (item := await self.run(next, iterator, done)) is not done:
+            yield item
+
+    async def aclose(self) -> None:
+        await self.run(self.close)
+
+    def call_blocking(self, function: Callable[..., R], *args) -> R:
+        return await_only(run_in_threadpool(function, *args))
+
+    def _cached(self, method: Callable[..., R], *args) -> R:
+        return await_only(self.cache.run(method, *args))
+
+    def _open_shard(self, name: str) -> "AsyncDBStorageHandler[T]":
+        return AsyncDBStorageHandler(self.shards.async_session(name), cache=self.cache)
+
+
+def open_storage() -> DBStorageHandler:
+    """Storage on fresh sessions (plus the replica, if configured); the caller closes it"""
+    return DBStorageHandler(SessionLocal(), read_session=ReadSessionLocal() if ReadSessionLocal else None, shards=shard_router)
+
+
+def open_async_storage() -> AsyncDBStorageHandler:
+    return AsyncDBStorageHandler(AsyncSessionLocal(), read_session=AsyncReadSessionLocal() if AsyncReadSessionLocal else None, shards=shard_router)
 
 
 # Dependency
-def get_storage(session: SessionDep) -> DBStorageHandler:
-    return DBStorageHandler(session)
+def get_storage(session: SessionDep) -> Generator[DBStorageHandler, None, None]:
+    storage = DBStorageHandler(session, read_session=ReadSessionLocal() if ReadSessionLocal else None, shards=shard_router)
+    try:
+        yield storage
+    finally:
+        # The replica and any shards it opened; the session's own dependency closes it again harmlessly
+        storage.close()
 
 StorageDep = Annotated[DBStorageHandler, Depends(get_storage)]
+
+
+async def get_async_storage(session: AsyncSessionDep) -> AsyncGenerator[AsyncDBStorageHandler, None]:
+    storage = AsyncDBStorageHandler(session, read_session=AsyncReadSessionLocal() if AsyncReadSessionLocal else None, shards=shard_router)
+    try:
+        yield storage
+    finally:
+        await storage.aclose()
+
+AsyncStorageDep = Annotated[AsyncDBStorageHandler, Depends(get_async_storage)]
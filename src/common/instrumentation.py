@@ -0,0 +1,183 @@
+# src/common/instrumentation.py
+
+"""
+Per-request SQL accounting built on engine events. Queries only count while
+a request_scope is active, so outside one the listeners cost a ContextVar
+lookup; with SQL_INSTRUMENTATION=0 they are not installed at all.
+"""
+
+import os
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from sqlalchemy import Engine, event
+
+SQL_INSTRUMENTATION = os.getenv("SQL_INSTRUMENTATION", "1") == "1"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+# Also keep a slow statement's parameters, with strings redacted to their length and
+# long parameter lists cut short; off, since they carry password hashes and emails
+SLOW_QUERY_PARAMS = os.getenv("SLOW_QUERY_PARAMS", "0") == "1"
+SLOW_QUERY_MAX_PARAMS = 10
+
+logger = logging.getLogger("simplist.sql")
+
+
+@dataclass
+class RequestStats:
+    tag: str
+    queries: int = 0
+    db_time: float = 0.0
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries"'
+
+
+@dataclass
+class SlowQuery:
+    tag: str
+    statement: str
+    # None unless SLOW_QUERY_PARAMS, and then redacted
+    parameters: object
+    duration_ms: float
+
+
+@dataclass
+class Metrics:
+    """Totals per tag since startup, rendered in Prometheus text format"""
+    requests: dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    queries: dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    db_seconds: dict[str, float] = field(default_factory=lambda: defaultdict(float))
+    slow_queries: dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    recent_slow: deque[SlowQuery] = field(default_factory=lambda: deque(maxlen=100))
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def record(self, stats: RequestStats) -> None:
+        with self.lock:
+            self.requests[stats.tag] += 1
+            self.queries[stats.tag] += stats.queries
+            self.db_seconds[stats.tag] += stats.db_time
+
+    def record_slow(self, slow: SlowQuery) -> None:
+        with self.lock:
+            self.slow_queries[slow.tag] += 1
+            self.recent_slow.append(slow)
+
+    def render(self, extra: dict[str, float] | None = None) -> str:
+        lines = []
+        with self.lock:
+            for name, values, help_text in (
+                ("simplist_requests_total", self.requests, "Requests and websocket rounds handled"),
+                ("simplist_db_queries_total", self.queries, "SQL statements executed"),
+                ("simplist_db_seconds_total", self.db_seconds, "Time spent in SQL statements"),
+                ("simplist_slow_queries_total", self.slow_queries, f"Statements slower than {SLOW_QUERY_MS:g} ms"),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                lines += [f'{name}{{endpoint="{tag}"}} {value:g}' for tag, value in sorted(values.items())]
+
+        for name, value in (extra or {}).items():
+            lines += [f"# TYPE {name} counter", f"{name} {value:g}"]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+current_stats: ContextVar[RequestStats | None] = ContextVar("current_stats", default=None)
+
+
+@contextmanager
+def request_scope(tag: str):
+    stats = RequestStats(tag)
+    token = current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        current_stats.reset(token)
+        metrics.record(stats)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_stats.get() is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def redact(parameters: object) -> object:
+    """Parameters with strings (and bytes) replaced by their length, and at most SLOW_QUERY_MAX_PARAMS of each sequence"""
+    if isinstance(parameters, (str, bytes)):
+        return f"<{type(parameters).__name__} of {len(parameters)}>"
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in list(parameters.items())[:SLOW_QUERY_MAX_PARAMS]}
+    if isinstance(parameters, (list, tuple)):
+        redacted = [redact(value) for value in parameters[:SLOW_QUERY_MAX_PARAMS]]
+        if len(parameters) > SLOW_QUERY_MAX_PARAMS:
+            redacted.append(f"... {len(parameters) - SLOW_QUERY_MAX_PARAMS} more")
+        return type(parameters)(redacted)
+    return parameters
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_stats.get()
+    if stats is None or not conn.info.get("query_started"):
+        return
+
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    stats.queries += 1
+    stats.db_time += elapsed
+
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        slow = SlowQuery(stats.tag, statement, redact(parameters) if SLOW_QUERY_PARAMS else None, elapsed * 1000)
+        metrics.record_slow(slow)
+        if SLOW_QUERY_PARAMS:
+            logger.warning("Slow query (%.1f ms) in %s: %s %r", slow.duration_ms, slow.tag, statement, slow.parameters)
+        else:
+            logger.warning("Slow query (%.1f ms) in %s: %s", slow.duration_ms, slow.tag, statement)
+
+
+def handle_error(context) -> None:
+    # A failed statement never reaches after_cursor_execute; drop its start time, or the next statement on the connection pops it
+    conn = context.connection
+    if conn is not None and conn.info.get("query_started"):
+        conn.info["query_started"].pop()
+
+
+def instrument_engine(engine: Engine) -> None:
+    if not SQL_INSTRUMENTATION:
+        return
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+
+def route_tag(scope) -> str:
+    route = scope.get("route")
+    return f"{scope['method']} {route.path if route else 'unrouted'}"
+
+
+class InstrumentationMiddleware:
+    """Opens a request_scope per HTTP request and reports it in a Server-Timing header"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not SQL_INSTRUMENTATION:
+            return await self.app(scope, receive, send)
+
+        with request_scope(scope["method"]) as stats:
+            async def send_with_timing(message):
+                if message["type"] == "http.response.start":
+                    # Routing has run by now, so tag with the route template
+                    stats.tag = route_tag(scope)
+                    message.setdefault("headers", [])
+                    message["headers"] = [*message["headers"], (b"server-timing", stats.server_timing().encode())]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_timing)
+            except Exception:
+                # The error middleware outside answers, so no response passed through here; routing still ran
+                stats.tag = route_tag(scope)
+                raise
@@ -0,0 +1,215 @@
+# src/common/migrations.py
+
+"""
+Versioned schema migrations for the database and every task shard (see
+src/common/sharding.py), applied in order at startup or with
+
+    python -m src.common.migrations
+
+Each migration runs in its own transaction together with the bump of
+schema_version. Version 1 builds the current metadata with create_all, so
+later migrations must be no-ops against a schema it just created (use
+checkfirst / inspect before altering). A schema that is already current costs
+one SELECT per database.
+"""
+
+import os
+from collections.abc import Callable
+from sqlalchemy import Connection, Engine, Column, Integer, MetaData, Table, case, func, inspect, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import SQLModel
+
+from src.common.db_storage import engine, shard_engines
+from src.common.models import Sequence, ShardPlacement, Task, TaskChange, TaskCount, User
+
+# 0 leaves migrating to a deploy step running this module, so workers start without touching the schema
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "1") == "1"
+
+Migration = Callable[[Connection], None]
+MIGRATIONS: dict[int, tuple[str, Migration]] = {}
+
+version_table = Table("schema_version", MetaData(), Column("version", Integer, primary_key=True))
+
+
+def migration(version: int, description: str):
+    def register(func: Migration) -> Migration:
+        if version in MIGRATIONS:
+            raise ValueError(f"Duplicate migration version {version}")
+        MIGRATIONS[version] = (description, func)
+        return func
+    return register
+
+
+@migration(1, "create tables")
+def create_tables(conn: Connection):
+    SQLModel.metadata.create_all(conn)
+
+
+@migration(2, "index task by (user_id, id) and (user_id, completed, id)")
+def add_task_indexes(conn: Connection):
+    existing = {index["name"] for index in inspect(conn).get_indexes(Task.__tablename__)}
+    for index in Task.__table__.indexes:
+        if index.name not in existing:
+            index.create(conn)
+
+
+@migration(3, "add user.auth_epoch")
+def add_user_auth_epoch(conn: Connection):
+    columns = {column["name"] for column in inspect(conn).get_columns(User.__tablename__)}
+    if "auth_epoch" not in columns:
+        table = conn.dialect.identifier_preparer.quote(User.__tablename__)
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN auth_epoch INTEGER NOT NULL DEFAULT 0"))
+
+
+@migration(4, "add user.email_normalized with a unique index")
+def add_user_email_normalized(conn: Connection):
+    columns = {column["name"] for column in inspect(conn).get_columns(User.__tablename__)}
+    if "email_normalized" not in columns:
+        table = conn.dialect.identifier_preparer.quote(User.__tablename__)
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN email_normalized VARCHAR(100)"))
+        conn.execute(text(f"UPDATE {table} SET email_normalized = lower(trim(email))"))
+        conn.execute(text(f"CREATE UNIQUE INDEX ix_user_email_normalized ON {table} (email_normalized)"))
+
+
+@migration(5, "add the sequence table")
+def add_sequence_table(conn: Connection):
+    Sequence.__table__.create(conn, checkfirst=True)
+
+
+SQLITE_TASK_SEARCH = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS task_fts USING fts5("
+    "content, user_id, content='task', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS task_fts_insert AFTER INSERT ON task BEGIN "
+    "INSERT INTO task_fts (rowid, content, user_id) VALUES (new.id, new.content, new.user_id); END",
+    "CREATE TRIGGER IF NOT EXISTS task_fts_delete AFTER DELETE ON task BEGIN "
+    "INSERT INTO task_fts (task_fts, rowid, content, user_id) VALUES ('delete', old.id, old.content, old.user_id); END",
+    # Toggling completed leaves the index alone
+    "CREATE TRIGGER IF NOT EXISTS task_fts_update AFTER UPDATE OF content, user_id ON task BEGIN "
+    "INSERT INTO task_fts (task_fts, rowid, content, user_id) VALUES ('delete', old.id, old.content, old.user_id); "
+    "INSERT INTO task_fts (rowid, content, user_id) VALUES (new.id, new.content, new.user_id); END",
+    "INSERT INTO task_fts (task_fts) VALUES ('rebuild')",
+]
+
+POSTGRES_TASK_SEARCH = [
+    "ALTER TABLE task ADD COLUMN IF NOT EXISTS content_search tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_task_content_search ON task USING gin (content_search)",
+]
+
+
+@migration(6, "full-text index on task content (see src/common/search.py)")
+def add_task_search(conn: Connection):
+    statements = {"sqlite": SQLITE_TASK_SEARCH, "postgresql": POSTGRES_TASK_SEARCH}.get(conn.dialect.name, [])
+    for statement in statements:
+        conn.execute(text(statement))
+
+
+@migration(7, "add the task_count table and count existing tasks into it")
+def add_task_counts(conn: Connection):
+    TaskCount.__table__.create(conn, checkfirst=True)
+    counts = (
+        select(Task.user_id, func.count(), func.sum(case((Task.completed, 1), else_=0)))
+        .where(Task.user_id.not_in(select(TaskCount.user_id)))
+        .group_by(Task.user_id)
+    )
+    conn.execute(TaskCount.__table__.insert().from_select(["user_id", "total", "completed"], counts))
+
+
+@migration(8, "add the task_change log and task_count.version/first_version")
+def add_task_changes(conn: Connection):
+    TaskChange.__table__.create(conn, checkfirst=True)
+    columns = {column["name"] for column in inspect(conn).get_columns(TaskCount.__tablename__)}
+    table = conn.dialect.identifier_preparer.quote(TaskCount.__tablename__)
+    for column, default in (("version", 0), ("first_version", 1)):
+        if column not in columns:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER NOT NULL DEFAULT {default}"))
+
+
+@migration(9, "add the shard_placement table and task_count.moved")
+def add_shard_placement(conn: Connection):
+    ShardPlacement.__table__.create(conn, checkfirst=True)
+    columns = {column["name"] for column in inspect(conn).get_columns(TaskCount.__tablename__)}
+    if "moved" not in columns:
+        table = conn.dialect.identifier_preparer.quote(TaskCount.__tablename__)
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN moved BOOLEAN NOT NULL DEFAULT FALSE"))
+
+
+def current_version(conn: Connection) -> int:
+    version_table.create(conn, checkfirst=True)
+    return conn.execute(select(version_table.c.version).order_by(version_table.c.version.desc())).scalar() or 0
+
+
+def applied_version(bind: Engine) -> int | None:
+    """The schema's version from a single SELECT, or None when there is no version table to read it from"""
+    try:
+        with bind.connect() as conn:
+            return conn.execute(select(func.max(version_table.c.version))).scalar() or 0
+    except DBAPIError:
+        return None
+
+
+def run_migrations(bind: Engine = engine, finish: Migration | None = None) -> list[int]:
+    """
+    Apply pending migrations, returning the versions that ran. `finish` runs
+    in the transaction of each one, after it
+    """
+    if applied_version(bind) == max(MIGRATIONS):
+        return []
+    with bind.begin() as conn:
+        version = current_version(conn)
+
+    applied = []
+    for target in sorted(v for v in MIGRATIONS if v > version):
+        description, func = MIGRATIONS[target]
+        try:
+            with bind.begin() as conn:
+                func(conn)
+                if finish:
+                    finish(conn)
+                conn.execute(version_table.insert().values(version=target))
+        except DBAPIError:
+            # Another worker starting at the same time may have applied it first
+            with bind.begin() as conn:
+                if current_version(conn) < target:
+                    raise
+            continue
+        applied.append(target)
+    return applied
+
+
+# Task tables whose user_id points at a user kept in the directory, not on the shard
+SHARDED_TABLES = (Task.__table__, TaskCount.__table__, TaskChange.__table__)
+
+
+def drop_user_foreign_keys(conn: Connection):
+    for table in SHARDED_TABLES:
+        for foreign_key in inspect(conn).get_foreign_keys(table.name):
+            if foreign_key["referred_table"] == User.__tablename__ and foreign_key["name"]:
+                preparer = conn.dialect.identifier_preparer
+                conn.execute(text(f"ALTER TABLE {preparer.quote(table.name)} DROP CONSTRAINT {preparer.quote(foreign_key['name'])}"))
+
+
+def prepare_shard(bind: Engine) -> list[int]:
+    """
+    Migrate a task shard like the directory, dropping the foreign keys from
+    its task tables to its (empty) user table along with each migration, so a
+    current shard never has them. SQLite doesn't enforce them unless asked
+    to, so they stay there
+    """
+    return run_migrations(bind, finish=None if bind.dialect.name == "sqlite" else drop_user_foreign_keys)
+
+
+def run_all_migrations() -> dict[str, list[int]]:
+    """Migrate the directory and every task shard, returning the versions applied to each"""
+    applied = {"directory": run_migrations()}
+    for name, shard_engine in shard_engines.items():
+        applied[name] = prepare_shard(shard_engine)
+    return applied
+
+
+if __name__ == "__main__":
+    for database, applied in run_all_migrations().items():
+        for version in applied:
+            print(f"{database}: applied {version}: {MIGRATIONS[version][0]}")
+        if not applied:
+            print(f"{database}: schema is up to date")
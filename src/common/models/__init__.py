@@ -1,2 +1,6 @@
 from .task import Task
-from .user import User
\ No newline at end of file
+from .user import User
+from .sequence import Sequence
+from .task_count import TaskCount
+from .task_change import TaskChange
+from .shard_placement import ShardPlacement
\ No newline at end of file
@@ -0,0 +1,7 @@
+from sqlmodel import SQLModel, Field
+
+
+class Sequence(SQLModel, table=True):
+    """Named counters: task id blocks handed out ahead of inserts, and how far each write-behind journal was applied"""
+    name: str = Field(primary_key=True, max_length=64)
+    value: int = Field(default=0)
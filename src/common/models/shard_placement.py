@@ -0,0 +1,9 @@
+from sqlmodel import SQLModel, Field
+
+
+class ShardPlacement(SQLModel, table=True):
+    """A user whose tasks live somewhere other than their ring shard (see src/common/sharding.py)"""
+    __tablename__ = "shard_placement"
+
+    user_id: int = Field(primary_key=True, foreign_key="user.id")
+    shard: str = Field(max_length=64)
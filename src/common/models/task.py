@@ -1,10 +1,19 @@
-from sqlmodel import SQLModel, Field, Relationship
-from typing import Optional, TYPE_CHECKING
+from sqlmodel import SQLModel, Field, Relationship, Index
+from typing import Optional, TYPE_CHECKING, ClassVar
 
 if TYPE_CHECKING:
     from .user import User
 
 class Task(SQLModel, table=True):
+    __table_args__ = (
+        # Keyset pages of a user's list: WHERE user_id = ? AND id > ? ORDER BY id
+        Index("ix_task_user_id_id", "user_id", "id"),
+        # Same, filtered by completion status
+        Index("ix_task_user_id_completed_id", "user_id", "completed", "id"),
+    )
+    # Cached lists of tasks are keyed by these fields (see src/common/cache.py)
+    __cache_groups__: ClassVar[tuple[str, ...]] = ("user_id",)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id")
     content: str = Field(min_length=3, max_length=128)
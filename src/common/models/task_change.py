@@ -0,0 +1,18 @@
+from sqlmodel import SQLModel, Field
+
+
+class TaskChange(SQLModel, table=True):
+    """
+    One entry of a user's change log, written in the same transaction as the
+    change. Versions count up from 1 per user; TaskCount holds the latest one
+    and the oldest still kept
+    """
+    __tablename__ = "task_change"
+
+    user_id: int = Field(primary_key=True, foreign_key="user.id")
+    version: int = Field(primary_key=True)
+    action: str = Field(max_length=8)
+    task_id: int
+    content: str | None = Field(default=None, max_length=128)
+    # After the change; for a delete, what the task was
+    completed: bool = Field(default=False)
@@ -0,0 +1,18 @@
+from sqlmodel import SQLModel, Field
+
+
+class TaskCount(SQLModel, table=True):
+    """
+    A user's task totals, adjusted in the same transaction as every task write,
+    and the head of their change log (see TaskChange)
+    """
+    __tablename__ = "task_count"
+
+    user_id: int = Field(primary_key=True, foreign_key="user.id")
+    total: int = Field(default=0)
+    completed: int = Field(default=0)
+    # Version of the latest change, and of the oldest one the log still has
+    version: int = Field(default=0)
+    first_version: int = Field(default=1)
+    # Set on the shard the user's tasks were moved off, so writes still routed here fail instead of going missing
+    moved: bool = Field(default=False)
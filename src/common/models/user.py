@@ -9,7 +9,11 @@ class User(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     username: str = Field(min_length=3, max_length=50, unique=True)
     email: str = Field(min_length=5, max_length=100, unique=True)
+    # Trimmed and lowercased email, so uniqueness and login by email ignore case
+    email_normalized: Optional[str] = Field(default=None, max_length=100, unique=True)
     password: str = Field(min_length=6)
     created_at: datetime = Field(default_factory=datetime.now)
+    # Bumped to revoke every session token issued so far
+    auth_epoch: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
 
     tasks: list["Task"] = Relationship(back_populates="user")
\ No newline at end of file
@@ -0,0 +1,149 @@
+# src/common/profiling.py
+
+"""
+Where a worker spends its time: how long each startup phase took, and a
+sampling profiler for production, started on demand.
+
+While a capture runs, the capturing thread reads every other thread's stack
+(sys._current_frames) every PROFILE_INTERVAL_MS and counts identical
+stacks. The result is in the collapsed format flamegraph.pl, inferno and
+speedscope read, one "thread;outermost;...;innermost count" line per stack.
+HTTP handlers and websocket loops show up under the event loop's thread,
+password hashing under the password pool's (unless PASSWORD_POOL=process,
+which hashes in other processes). Between captures nothing samples and
+nothing is hooked, so an idle profiler costs nothing.
+"""
+
+import os
+import re
+import sys
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+# The /debug/profile endpoint answers 404 unless this is 1
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1"
+PROFILE_INTERVAL_S = float(os.getenv("PROFILE_INTERVAL_MS", "10")) / 1000
+# Longest capture one request may ask for
+PROFILE_MAX_S = float(os.getenv("PROFILE_MAX_S", "60"))
+
+# Innermost frames of threads waiting for work: the event loop polling, executor and worker threads blocked on their queues
+IDLE_FRAMES = {("selectors.py", "select"), ("threading.py", "wait"), ("thread.py", "_worker")}
+
+
+@dataclass
+class StartupTimes:
+    """Seconds each startup phase took, in the order they ran"""
+    phases: dict[str, float] = field(default_factory=dict)
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+    @property
+    def total(self) -> float:
+        return sum(self.phases.values())
+
+    def report(self) -> str:
+        phases = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in self.phases.items())
+        return f"{self.total:.3f}s ({phases})"
+
+
+startup_times = StartupTimes()
+
+
+class ProfilerBusy(Exception):
+    """Another capture is running; captures sample every thread, so they don't overlap"""
+
+
+@dataclass
+class Profile:
+    seconds: float
+    samples: int
+    stacks: Counter = field(default_factory=Counter)
+
+    def collapsed(self) -> str:
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+
+@lru_cache(maxsize=4096)
+def short_path(filename: str) -> str:
+    """Paths relative to the repo, site-packages or the standard library, whichever they are under"""
+    for marker in (os.getcwd() + os.sep, f"site-packages{os.sep}", f"{os.sep}lib{os.sep}python{sys.version_info[0]}.{sys.version_info[1]}{os.sep}"):
+        head, found, tail = filename.rpartition(marker)
+        if found:
+            return tail
+    return filename
+
+
+def frame_label(code) -> str:
+    return f"{code.co_name} ({short_path(code.co_filename)}:{code.co_firstlineno})"
+
+
+def thread_label(name: str) -> str:
+    # Threads of one pool merge into one root: "password_3" and "ThreadPoolExecutor-0_1" become "password" and "ThreadPoolExecutor"
+    return re.sub(r"([-_]\d+)+$", "", name)
+
+
+def is_idle(frame) -> bool:
+    return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES
+
+
+def frame_stack(frame) -> list[str]:
+    stack = []
+    while frame is not None:
+        stack.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class SamplingProfiler:
+    """Samples every thread's stack for a while, one capture at a time"""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL_S):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def capture(self, seconds: float, idle: bool = False) -> Profile:
+        """
+        Sample for `seconds`, blocking the calling thread (which is left out).
+        Threads waiting for work are left out too, unless `idle`
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A capture is already running")
+        try:
+            return self._sample(seconds, idle)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float, idle: bool) -> Profile:
+        me = threading.get_ident()
+        profile = Profile(seconds, 0)
+        started = next_at = time.perf_counter()
+        while next_at < started + seconds:
+            names = {thread.ident: thread_label(thread.name) for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me or (not idle and is_idle(frame)):
+                    continue
+                profile.stacks[(names.get(ident, "unknown"), *frame_stack(frame))] += 1
+            profile.samples += 1
+
+            # On a fixed schedule, so the time a sample takes doesn't stretch the interval; after one that overran, the next starts at once
+            next_at = max(next_at + self.interval, time.perf_counter())
+            time.sleep(max(0.0, next_at - time.perf_counter()))
+        return profile
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,160 @@
+# src/common/protocol.py
+
+"""
+The /ws message protocol: one Pydantic model per action, picked by its
+"action" field and validated once per frame, and the codecs frames travel in.
+
+JSON text frames are the default. A client that offers the "simplist.msgpack"
+subprotocol gets MessagePack binary frames both ways instead (when msgpack is
+installed). Either way, uvicorn negotiates permessage-deflate with clients
+that ask for it, which browsers do.
+"""
+
+import os
+import json
+from typing import Annotated, Any, Literal, Union
+
+from pydantic import BaseModel, ConfigDict, Field, StringConstraints, TypeAdapter, ValidationError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Operations one "batch" frame may carry
+WS_MAX_BATCH_OPERATIONS = int(os.getenv("WS_MAX_BATCH_OPERATIONS", "1000"))
+
+# As Task.content declares them; the table model itself doesn't check
+TaskContent = Annotated[str, StringConstraints(min_length=3, max_length=128)]
+
+
+class ProtocolMessage(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
+
+class AddMessage(ProtocolMessage):
+    action: Literal["add"]
+    content: TaskContent
+
+
+class UpdateMessage(ProtocolMessage):
+    action: Literal["update"]
+    id: int
+
+
+class DeleteMessage(ProtocolMessage):
+    action: Literal["delete"]
+    id: int
+
+
+class ClearCompletedMessage(ProtocolMessage):
+    """Delete every completed task of the user's, including ones not on the client's screen"""
+    action: Literal["clear_completed"]
+
+
+Operation = Annotated[Union[AddMessage, UpdateMessage, DeleteMessage, ClearCompletedMessage], Field(discriminator="action")]
+
+
+class BatchMessage(ProtocolMessage):
+    action: Literal["batch"]
+    operations: list[Operation] = Field(max_length=WS_MAX_BATCH_OPERATIONS)
+
+
+class PageMessage(ProtocolMessage):
+    action: Literal["page"]
+    after: int | None = None
+    limit: int | None = Field(default=None, ge=1)
+
+
+class SearchQuery(ProtocolMessage):
+    """A search, as the websocket action or the /tasks/search query string"""
+    q: str = Field(default="", max_length=100)
+    completed: bool | None = None
+    offset: int = Field(default=0, ge=0)
+    limit: int | None = Field(default=None, ge=1)
+
+
+class SearchMessage(SearchQuery):
+    action: Literal["search"]
+
+
+class SyncMessage(ProtocolMessage):
+    """Sent on (re)connecting: the change log version the client's list is at"""
+    action: Literal["sync"]
+    version: int = Field(ge=0)
+
+
+Message = Annotated[
+    Union[AddMessage, UpdateMessage, DeleteMessage, ClearCompletedMessage, BatchMessage, PageMessage, SearchMessage, SyncMessage],
+    Field(discriminator="action"),
+]
+WriteMessage = AddMessage | UpdateMessage | DeleteMessage | ClearCompletedMessage | BatchMessage
+
+message_adapter = TypeAdapter(Message)
+
+
+class ProtocolError(ValueError):
+    """A frame that didn't decode or validate; its text is what the client is told"""
+
+
+class JSONCodec:
+    subprotocol = "simplist.json"
+
+    def encode(self, message: Any) -> str:
+        if orjson:
+            return orjson.dumps(message).decode()
+        return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+    def decode(self, frame: str | bytes) -> Any:
+        return orjson.loads(frame) if orjson else json.loads(frame)
+
+
+class MessagePackCodec:
+    subprotocol = "simplist.msgpack"
+
+    def encode(self, message: Any) -> bytes:
+        return msgpack.packb(message)
+
+    def decode(self, frame: str | bytes) -> Any:
+        return msgpack.unpackb(frame)
+
+
+JSON = JSONCodec()
+MSGPACK = MessagePackCodec()
+
+# Subprotocols a client may ask for, by name
+CODECS = {codec.subprotocol: codec for codec in (MSGPACK if msgpack else None, JSON) if codec}
+
+
+def negotiate(offered: list[str]) -> tuple[JSONCodec | MessagePackCodec, str | None]:
+    """The codec for the first subprotocol offered that we speak, and its name to accept; JSON and none otherwise"""
+    for name in offered:
+        if name in CODECS:
+            return CODECS[name], name
+    return JSON, None
+
+
+def parse_frame(codec: JSONCodec | MessagePackCodec, frame: str | bytes) -> Message:
+    try:
+        data = codec.decode(frame)
+    except Exception:
+        raise ProtocolError("Malformed frame")
+    try:
+        return message_adapter.validate_python(data)
+    except ValidationError as e:
+        raise ProtocolError(describe(e.errors()[0]))
+
+
+def describe(error: dict) -> str:
+    if error["type"] == "union_tag_invalid":
+        return f"Unknown action: {error['ctx']['tag']}"
+    if error["type"] == "union_tag_not_found":
+        return "Missing action"
+    # The leading "add"/"batch" of the location is the union member, not a field
+    location = ".".join(str(part) for part in error["loc"][1:] if part not in ("add", "update", "delete"))
+    return f"{location}: {error['msg']}" if location else error["msg"]
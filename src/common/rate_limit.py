@@ -0,0 +1,159 @@
+# src/common/rate_limit.py
+
+import os
+import math
+import time
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Protocol
+from urllib.parse import urlparse, parse_qs
+
+from src.common.cache import RESPClient
+
+# memory://?max_keys=100000, redis://host:6379/0 or none. As with the cache,
+# the memory backend only counts its own process's requests.
+RATE_LIMIT_URL = os.getenv("RATE_LIMIT_URL", "memory://")
+
+logger = logging.getLogger("simplist.rate_limit")
+
+
+class RateLimitBackend(Protocol):
+    # True when hits wait on the network, so async code runs them in the threadpool
+    blocking: bool
+
+    def hit(self, key: str, window: float, now: float) -> tuple[int, int]:
+        """Count a hit and return (hits in the previous window, hits in the current one)"""
+        ...
+
+
+class MemoryRateLimitBackend:
+    """
+    One (window index, previous, current) entry per key, kept in order of last
+    hit; entries idle for two windows carry no information and are evicted
+    from the front, as are the oldest ones beyond max_keys.
+    """
+
+    blocking = False
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._counters: OrderedDict[str, tuple[int, int, int, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, window: float, now: float) -> tuple[int, int]:
+        index = int(now // window)
+        with self._lock:
+            entry = self._counters.pop(key, None)
+            if entry is None or entry[0] < index - 1:
+                previous, current = 0, 0
+            elif entry[0] == index - 1:
+                previous, current = entry[2], 0
+            else:
+                previous, current = entry[1], entry[2]
+
+            current += 1
+            self._counters[key] = (index, previous, current, (index + 2) * window)
+            self._evict(now)
+        return previous, current
+
+    def __len__(self) -> int:
+        return len(self._counters)
+
+    def _evict(self, now: float) -> None:
+        while self._counters:
+            key, entry = next(iter(self._counters.items()))
+            if entry[3] > now and len(self._counters) <= self.max_keys:
+                break
+            del self._counters[key]
+
+
+class RedisRateLimitBackend:
+    """
+    INCR on a per-window key that expires after two windows, plus a GET of the
+    previous one. One MULTI creates the key with its expiry if missing before
+    counting, so no key is ever left without one
+    """
+
+    blocking = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, db: int = 0, timeout: float = 0.5):
+        self.client = RESPClient(host, port, db, timeout)
+
+    def hit(self, key: str, window: float, now: float) -> tuple[int, int]:
+        index = int(now // window)
+        _, current, previous = self.client.transaction(
+            ("SET", f"{key}:{index}", 0, "PX", int(window * 2000), "NX"),
+            ("INCR", f"{key}:{index}"),
+            ("GET", f"{key}:{index - 1}"),
+        )
+        return int(previous or 0), current
+
+
+@dataclass(frozen=True)
+class Rate:
+    limit: int
+    window: float
+
+    @classmethod
+    def parse(cls, value: str) -> "Rate":
+        """'5/60' is five hits per sixty seconds"""
+        limit, window = value.split("/")
+        return cls(int(limit), float(window))
+
+
+class RateLimiter:
+    """
+    Sliding-window counters: the previous fixed window's count, weighted by
+    how much of it still overlaps the sliding window, plus the current one's.
+    Backend failures let the request through.
+    """
+
+    def __init__(self, backend: RateLimitBackend, prefix: str = "ratelimit"):
+        self.backend = backend
+        self.prefix = prefix
+
+    def hit(self, key: str, rate: Rate, now: float | None = None) -> float | None:
+        """Count a hit; returns the seconds to wait when over the limit, otherwise None"""
+        now = time.time() if now is None else now
+        try:
+            previous, current = self.backend.hit(f"{self.prefix}:{key}", rate.window, now)
+        except OSError as e:
+            logger.warning("Rate limit backend unavailable: %s", e)
+            return None
+
+        elapsed = now % rate.window / rate.window
+        if previous * (1 - elapsed) + current <= rate.limit:
+            return None
+        return retry_after(previous, current, elapsed, rate)
+
+
+def retry_after(previous: int, current: int, elapsed: float, rate: Rate) -> float:
+    """Seconds until one more hit would be allowed, if none arrive in between"""
+    if current < rate.limit:
+        # Within this window, once the previous window's share fades to make room
+        return max((1 - (rate.limit - current - 1) / previous - elapsed) * rate.window, 0)
+    # Only once this window becomes the previous one and its share fades enough
+    return (1 - elapsed + 1 - (rate.limit - 1) / current) * rate.window
+
+
+def create_rate_limiter(url: str) -> RateLimiter | None:
+    parsed = urlparse(url)
+    options = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+
+    if parsed.scheme == "memory":
+        return RateLimiter(MemoryRateLimitBackend(int(options.get("max_keys", 100000))))
+    if parsed.scheme == "redis":
+        db = int(parsed.path.lstrip("/") or 0)
+        return RateLimiter(RedisRateLimitBackend(parsed.hostname or "127.0.0.1", parsed.port or 6379, db))
+    if parsed.scheme in ("", "none"):
+        return None
+    raise ValueError(f"Unsupported RATE_LIMIT_URL scheme: {parsed.scheme}")
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(math.ceil(seconds), 1))
+
+
+rate_limiter = create_rate_limiter(RATE_LIMIT_URL)
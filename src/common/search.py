@@ -0,0 +1,61 @@
+# src/common/search.py
+
+"""
+Full-text search over task content, per user.
+
+SQLite matches against an FTS5 index (task_fts, reading its text from the
+task table and kept in sync by triggers); Postgres against a generated
+tsvector column with a GIN index. Both are created by migration 6. Other
+databases fall back to LIKE. Every query word matches as a prefix, results
+are ranked by relevance, then by id.
+"""
+
+import re
+
+from sqlalchemy import Select, column, func, literal_column, table
+from sqlmodel import select
+
+from src.common.models import Task
+
+SEARCH_MAX_TERMS = 8
+
+task_fts = table("task_fts", column("rowid"))
+
+
+def search_terms(query: str) -> list[str]:
+    """Words of the query, lowercased; anything else (FTS operators, quotes) is dropped"""
+    return re.findall(r"\w+", query.lower())[:SEARCH_MAX_TERMS]
+
+
+def like_escape(term: str) -> str:
+    # "_" is a word character, so terms can carry it; LIKE would read it as any one character
+    return re.sub(r"([\\%_])", r"\\\1", term)
+
+
+def search_stmt(
+    dialect: str, user_id: int, terms: list[str], completed: bool | None = None, limit: int = 50, offset: int = 0,
+) -> Select:
+    conditions = [Task.user_id == user_id]
+    if completed is not None:
+        conditions.append(Task.completed == completed)
+    stmt = select(Task)
+
+    if not terms:
+        stmt = stmt.where(*conditions).order_by(Task.id)
+    elif dialect == "sqlite":
+        # user_id is indexed too, so FTS5 narrows to the user's rows before ranking
+        match = f'user_id : "{user_id}" AND content : (' + " ".join(f'"{term}"*' for term in terms) + ")"
+        fts = literal_column("task_fts")
+        stmt = (
+            stmt.join(task_fts, task_fts.c.rowid == Task.id)
+            .where(fts.op("MATCH")(match), *conditions)
+            .order_by(func.bm25(fts, 1.0, 0.0), Task.id)
+        )
+    elif dialect == "postgresql":
+        query = func.to_tsquery("simple", " & ".join(f"{term}:*" for term in terms))
+        document = literal_column("task.content_search")
+        stmt = stmt.where(document.op("@@")(query), *conditions).order_by(func.ts_rank(document, query).desc(), Task.id)
+    else:
+        stmt = stmt.where(*conditions, *(Task.content.ilike(f"%{like_escape(term)}%", escape="\\") for term in terms)).order_by(Task.id)
+
+    return stmt.limit(limit).offset(offset)
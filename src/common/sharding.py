@@ -0,0 +1,183 @@
+# src/common/sharding.py
+
+"""
+Task storage split across several databases by user_id.
+
+DATABASE_SHARD_URLS lists the shards as name=url pairs, comma separated:
+
+    DATABASE_SHARD_URLS="a=sqlite:///./shard_a.db,b=sqlite:///./shard_b.db"
+
+Tasks, their counts and change log live on the user's shard; users, sessions
+and everything else stay on DATABASE_URL, the directory. A user's shard is
+the one a consistent-hash ring over the shard names picks, unless the
+directory's shard_placement table says otherwise (see
+src/modules/shard_rebalance.py, which writes it when it moves users).
+Every task query is scoped to one user, so one request touches one shard.
+
+Task ids come from blocks reserved in the directory's sequence table, so
+they stay unique across shards and a user can move without renumbering.
+Unset, everything lives on DATABASE_URL as before.
+"""
+
+import os
+import asyncio
+import bisect
+import hashlib
+import logging
+import threading
+from collections.abc import Callable
+
+from sqlalchemy import case, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+from src.common.models import Sequence, ShardPlacement, Task
+
+# name=url pairs; unset keeps tasks on DATABASE_URL
+DATABASE_SHARD_URLS = os.getenv("DATABASE_SHARD_URLS", "")
+# Points per shard on the ring; more spreads users more evenly
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", "64"))
+# Seconds between reloads of shard_placement; a moved user's writes fail for up to this long
+SHARD_PLACEMENT_REFRESH_S = float(os.getenv("SHARD_PLACEMENT_REFRESH_S", "5"))
+# Task ids reserved per round trip to the directory
+SHARD_ID_BLOCK = int(os.getenv("SHARD_ID_BLOCK", "1000"))
+
+TASK_ID_SEQUENCE = "task.id"
+
+logger = logging.getLogger("simplist.sharding")
+
+
+class ShardMoved(Exception):
+    """A write reached the shard a user was moved off; it rolled back, and succeeds once placements refresh"""
+
+    def __init__(self, user_id: int):
+        super().__init__(f"Tasks of user {user_id} are moving to another shard; try again shortly")
+        self.user_id = user_id
+
+
+def parse_shard_urls(value: str) -> dict[str, str]:
+    shards = {}
+    for pair in filter(None, (pair.strip() for pair in value.split(","))):
+        name, separator, url = pair.partition("=")
+        if not separator or not name or not url:
+            raise ValueError(f"Shard {pair!r} is not name=url")
+        if name in shards:
+            raise ValueError(f"Duplicate shard name {name!r}")
+        shards[name] = url
+    return shards
+
+
+def ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hashing over shard names: adding or removing one shard moves
+    only the users between its points and their neighbours, about 1/N of them
+    """
+
+    def __init__(self, names: list[str], vnodes: int = SHARD_VNODES):
+        if not names:
+            raise ValueError("A ring needs at least one shard")
+        points = sorted((ring_hash(f"{name}#{i}"), name) for name in names for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._names = [name for _, name in points]
+
+    def shard_of(self, user_id: int) -> str:
+        i = bisect.bisect(self._hashes, ring_hash(str(user_id)))
+        return self._names[i % len(self._names)]
+
+
+class TaskIdBlocks:
+    """Task ids handed out from blocks reserved in the directory, `block` at a time"""
+
+    def __init__(self, reserve: Callable[[int], range], block: int = SHARD_ID_BLOCK):
+        self.reserve = reserve
+        self.block = block
+        self._ids = range(0)
+        self._lock = threading.Lock()
+
+    def take(self, count: int) -> range:
+        if not count:
+            return range(0)
+        with self._lock:
+            if len(self._ids) < count:
+                self._ids = self.reserve(max(self.block, count))
+            ids, self._ids = self._ids[:count], self._ids[count:]
+        return ids
+
+
+def reserve_task_ids(session_factory: sessionmaker, count: int, task_session_factories: list[sessionmaker] = ()) -> range:
+    """
+    Move the task id sequence in `session_factory`'s database past `count` ids,
+    and past every task already in the databases of `task_session_factories`
+    (by default that same one), and return them
+    """
+    floor = 1
+    for task_sessions in task_session_factories or [session_factory]:
+        with task_sessions() as session:
+            floor = max(floor, (session.execute(select(func.max(Task.id))).scalar() or 0) + 1)
+
+    with session_factory() as session:
+        start = case((Sequence.value < floor, floor), else_=Sequence.value)
+        stmt = update(Sequence).where(Sequence.name == TASK_ID_SEQUENCE).values(value=start + count).returning(Sequence.value)
+        end = session.execute(stmt).scalar()
+        if end is None:
+            session.add(Sequence(name=TASK_ID_SEQUENCE, value=floor + count))
+            try:
+                session.commit()
+            except IntegrityError:
+                # Another worker created it first
+                session.rollback()
+                return reserve_task_ids(session_factory, count, task_session_factories)
+            return range(floor, floor + count)
+        session.commit()
+    return range(end - count, end)
+
+
+class ShardRouter:
+    """Which shard holds a user's tasks, and sessions on every shard"""
+
+    def __init__(
+        self, session_factories: dict[str, sessionmaker], directory: sessionmaker,
+        async_session_factories: dict[str, Callable] | None = None, vnodes: int = SHARD_VNODES,
+    ):
+        self.session_factories = session_factories
+        self.async_session_factories = async_session_factories or {}
+        self.directory = directory
+        self.ring = HashRing(list(session_factories), vnodes)
+        # Users moved off their ring shard, as of the last refresh
+        self.placements: dict[int, str] = {}
+        self.task_ids = TaskIdBlocks(lambda count: reserve_task_ids(directory, count, list(session_factories.values())))
+
+    @property
+    def names(self) -> list[str]:
+        return list(self.session_factories)
+
+    def shard_of(self, user_id: int) -> str:
+        return self.placements.get(user_id) or self.ring.shard_of(user_id)
+
+    def session(self, name: str):
+        return self.session_factories[name]()
+
+    def async_session(self, name: str):
+        return self.async_session_factories[name]()
+
+    def refresh(self) -> None:
+        with self.directory() as session:
+            placements = dict(session.execute(select(ShardPlacement.user_id, ShardPlacement.shard)).all())
+        unknown = set(placements.values()) - set(self.session_factories)
+        if unknown:
+            logger.error("Shard placements name unknown shards %s; those users stay on their ring shard", sorted(unknown))
+        self.placements = {user_id: shard for user_id, shard in placements.items() if shard in self.session_factories}
+
+    async def keep_fresh(self, interval: float = SHARD_PLACEMENT_REFRESH_S):
+        """Reload the placements every `interval` seconds; runs for the app's lifetime"""
+        while True:
+            try:
+                await run_in_threadpool(self.refresh)
+            except Exception:
+                logger.exception("Could not refresh shard placements")
+            await asyncio.sleep(interval)
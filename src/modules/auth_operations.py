@@ -1,15 +1,31 @@
 # src/modules/auth_operations.py
 
+import os
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
 from fastapi import Request, Depends, HTTPException
+from itsdangerous import BadSignature, Signer
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select, or_
 from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
 from typing import Optional
 from src.common.models import User
-from src.common.db_storage import get_session
+from src.common.db_storage import get_session, DBStorageHandler, SessionLocal
+import src.common.rate_limit as rate_limiting
+from src.common.rate_limit import Rate, retry_after_header
 import src.common.schemes as schemes
 
+logger = logging.getLogger("simplist.auth")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# Hashes made with a different cost are upgraded on the next successful login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -19,54 +35,305 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+class PasswordPool:
+    """
+    Runs password hashing off the event loop on at most `workers` threads (or
+    processes). Once `queue_limit` calls are waiting for a worker, further
+    calls are rejected with 503 instead of queueing without bound.
+    """
+
+    def __init__(self, workers: int, queue_limit: int, kind: str = "thread"):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.kind = kind
+        self.pending = 0
+        self._executor: Executor | None = None
+
+    @property
+    def executor(self) -> Executor:
+        # Created on first use so importing this module never spawns workers
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                # Named, so profiles show hashing apart from the other pools
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password")
+        return self._executor
+
+    async def run(self, func, *args):
+        if self.pending >= self.workers + self.queue_limit:
+            raise HTTPException(status_code=503, detail="Server busy, please try again", headers={"Retry-After": "1"})
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.pending -= 1
+
+
+password_pool = PasswordPool(
+    workers=int(os.getenv("PASSWORD_WORKERS", str(os.cpu_count() or 1))),
+    queue_limit=int(os.getenv("PASSWORD_QUEUE_LIMIT", "32")),
+    kind=os.getenv("PASSWORD_POOL", "thread"),
+)
+
+
+async def hash_password_async(password: str) -> str:
+    return await password_pool.run(hash_password, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await password_pool.run(verify_password, plain_password, hashed_password)
+
+
+AUTH_SECRET = os.getenv("AUTH_SECRET", "super-secret-key")
+# Comma-separated ids of the users allowed on admin endpoints such as /debug/profile
+ADMIN_USER_IDS = {int(id) for id in os.getenv("ADMIN_USER_IDS", "").split(",") if id.strip()}
+# Seconds between reloads of the auth epochs other workers may have bumped
+AUTH_REVOCATION_REFRESH = float(os.getenv("AUTH_REVOCATION_REFRESH", "5"))
+
+token_signer = Signer(AUTH_SECRET, salt="simplist.auth", digest_method=hashlib.sha256)
+
+
+@dataclass(frozen=True)
+class Identity:
+    """What a session token vouches for; named like the User columns so it can stand in for one"""
+    id: int
+    username: str
+    auth_epoch: int = 0
+
+
+def issue_token(user: User) -> str:
+    return token_signer.sign(f"{user.id}.{user.auth_epoch}.{user.username}").decode()
+
+
+@lru_cache(maxsize=4096)
+def read_token(token: str) -> Identity | None:
+    try:
+        payload = token_signer.unsign(token).decode()
+    except BadSignature:
+        return None
+    id, auth_epoch, username = payload.split(".", 2)
+    return Identity(int(id), username, int(auth_epoch))
+
+
+class RevocationSet:
+    """
+    Latest auth epoch of every user who ever bumped theirs. Tokens carrying an
+    older epoch are revoked; the table is small because most users never do.
+    """
+
+    def __init__(self):
+        self.epochs: dict[int, int] = {}
+
+    def is_revoked(self, identity: Identity) -> bool:
+        return identity.auth_epoch < self.epochs.get(identity.id, 0)
+
+    def revoke(self, user_id: int, auth_epoch: int) -> None:
+        self.epochs[user_id] = max(auth_epoch, self.epochs.get(user_id, 0))
+
+    def refresh(self, db_session: Session) -> None:
+        self.epochs = dict(db_session.exec(select(User.id, User.auth_epoch).where(User.auth_epoch > 0)).all())
+
+    async def keep_fresh(self, interval: float = AUTH_REVOCATION_REFRESH):
+        """Reload from the database every `interval` seconds; runs for the app's lifetime"""
+        while True:
+            try:
+                await run_in_threadpool(self._refresh_from_db)
+            except Exception:
+                logger.exception("Could not refresh revoked sessions")
+            await asyncio.sleep(interval)
+
+    def _refresh_from_db(self):
+        with SessionLocal() as db_session:
+            self.refresh(db_session)
+
+
+revocations = RevocationSet()
+
+
+def session_identity(session: dict) -> Optional[Identity]:
+    token = session.get("auth")
+    identity = read_token(token) if token else None
+    if identity is None or revocations.is_revoked(identity):
+        return None
+    return identity
+
+
+def start_session(request: Request, user: User) -> None:
+    request.session.clear()
+    request.session["auth"] = issue_token(user)
+
+
+def revoke_sessions(db_session: Session, user_id: int) -> Optional[int]:
+    """
+    Bump the user's auth epoch, signing out every session at once. Also the
+    step to take after a password change. Returns the new epoch, None when
+    the user no longer exists
+    """
+    users = DBStorageHandler(db_session).update_where(User, {"auth_epoch": User.auth_epoch + 1}, User.id == user_id)
+    if not users:
+        return None
+    revocations.revoke(user_id, users[0].auth_epoch)
+    return users[0].auth_epoch
+
+
+def get_current_identity(request: Request) -> Optional[Identity]:
+    """
+    The logged-in user as vouched for by the signed session token, without
+    touching the database
+    """
+    return session_identity(request.session)
+
+
+def require_admin(request: Request) -> Identity:
+    """The logged-in user, if listed in ADMIN_USER_IDS; 403 for everyone else"""
+    identity = get_current_identity(request)
+    if identity is None or identity.id not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=403, detail="Admins only")
+    return identity
+
+
 def get_current_user(request: Request, db_session: Session = Depends(get_session)) -> Optional[User]:
     """ 
-    Get the currently logged-in user from the session 
+    Get the currently logged-in user's full row, for handlers that need more than get_current_identity
     """
 
-    user_id = request.session.get("user_id")
-    if not user_id:
+    identity = get_current_identity(request)
+    if identity is None:
         return None
     
-    user = db_session.get(User, user_id)
+    user = DBStorageHandler(db_session).find(User, identity.id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     return user
 
 
-def login_user(request: Request, db_session: Session, user_data: schemes.LoginForm) -> User:
+# Attempts per window ("limit/seconds") by client address and by username
+AUTH_RATES = {
+    "login": (Rate.parse(os.getenv("LOGIN_RATE_PER_IP", "20/60")), Rate.parse(os.getenv("LOGIN_RATE_PER_USERNAME", "5/60"))),
+    "register": (Rate.parse(os.getenv("REGISTER_RATE_PER_IP", "5/600")), Rate.parse(os.getenv("REGISTER_RATE_PER_USERNAME", "5/60"))),
+}
+
+
+async def check_rate_limits(request: Request, action: str, username: str) -> None:
     """
-    Fetch user by username or email
+    Count an attempt against the client address and the username, raising
+    429 when either is over its limit. Meant to run before any DB or bcrypt work.
     """
+    limiter = rate_limiting.rate_limiter
+    if limiter is None:
+        return
+
+    ip_rate, username_rate = AUTH_RATES[action]
+    client = request.client.host if request.client else "unknown"
+
+    def hit() -> list[float | None]:
+        return [
+            limiter.hit(f"{action}:ip:{client}", ip_rate),
+            limiter.hit(f"{action}:user:{username.strip().lower()}", username_rate),
+        ]
+
+    # A network backend's round trips would stall the event loop
+    waits = await run_in_threadpool(hit) if limiter.backend.blocking else hit()
+    wait = max((seconds for seconds in waits if seconds is not None), default=None)
+    if wait is not None:
+        raise HTTPException(status_code=429, detail="Too many attempts, please try again later", headers={"Retry-After": retry_after_header(wait)})
+
+
+def find_login_user(db_session: Session, login: str) -> Optional[User]:
+    """The user by username or email, detached, with the session's connection back in the pool"""
+    q = select(User).where(or_(User.email_normalized == normalize_email(login), User.username == login))
+    try:
+        user = db_session.exec(q).first()
+        if user is not None:
+            db_session.expunge(user)
+        return user
+    finally:
+        db_session.rollback()
+
+
+def save_password_hash(user_id: int, password_hash: str) -> None:
+    with SessionLocal() as db_session:
+        DBStorageHandler(db_session).update_where(User, {"password": password_hash}, User.id == user_id)
 
-    q = select(User).where(or_(User.email == user_data.username.strip().lower(), User.username == user_data.username))
-    user = db_session.exec(q).first()
 
-    if user is None or not verify_password(user_data.password, user.password):
+async def login_user(request: Request, db_session: Session, user_data: schemes.LoginForm) -> User:
+    """
+    Fetch user by username or email and check the password. The lookup gives
+    its connection back before bcrypt runs, so logins waiting on the password
+    pool don't hold the connection pool
+    """
+
+    user = await run_in_threadpool(find_login_user, db_session, user_data.username)
+
+    if user is None or not await verify_password_async(user_data.password, user.password):
         raise HTTPException(status_code=400, detail="Invalid username or password")
-    
+
+    if pwd_context.needs_update(user.password):
+        user.password = await hash_password_async(user_data.password)
+        await run_in_threadpool(save_password_hash, user.id, user.password)
+
     return user
 
 
-def register_user(request: Request, db_session: Session, user_data: schemes.RegisterForm) -> User:
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+async def register_user(request: Request, db_session: Session, user_data: schemes.RegisterForm) -> User:
     """
-    Register a new user
+    Register a new user with a single INSERT ... RETURNING; the unique
+    constraints decide duplicates, so concurrent signups can't both pass
     """
 
-    if db_session.exec(select(User).where(User.username == user_data.username)).first():
-        raise HTTPException(status_code=400, detail="Username already taken")
-    
-    if db_session.exec(select(User).where(User.email == user_data.email.strip().lower())).first():
-        raise HTTPException(status_code=400, detail="Email already registered")
-
     user = User(
         username=user_data.username,
-        email=user_data.email.strip().lower(),
-        password=hash_password(user_data.password)
+        email=user_data.email.strip(),
+        email_normalized=normalize_email(user_data.email),
+        password=await hash_password_async(user_data.password)
     )
-    db_session.add(user)
-    db_session.commit()
-    db_session.refresh(user)
 
-    return user
\ No newline at end of file
+    return await run_in_threadpool(insert_user, db_session, user)
+
+
+def insert_user(db_session: Session, user: User) -> User:
+    """INSERT the new user, turning a unique violation into the form error it stands for"""
+    try:
+        return DBStorageHandler(db_session).bulk_insert(User, [user.model_dump(exclude={"id"})])[0]
+    except IntegrityError as e:
+        db_session.rollback()
+        field = duplicate_field(e)
+        if field == "username":
+            raise HTTPException(status_code=400, detail="Username already taken") from e
+        if field == "email":
+            raise HTTPException(status_code=400, detail="Email already registered") from e
+        raise
+
+
+# The form field each unique column of user stands for
+DUPLICATE_FIELDS = {"username": "username", "email": "email", "email_normalized": "email"}
+# Postgres names of the constraints guarding them (create_all's <table>_<column>_key), and migration 4's index
+DUPLICATE_CONSTRAINTS = {
+    **{f"{User.__tablename__}_{column}_key": field for column, field in DUPLICATE_FIELDS.items()},
+    "ix_user_email_normalized": "email",
+}
+
+
+def duplicate_field(error: IntegrityError) -> Optional[str]:
+    """
+    The form field a unique violation on user is about: by the constraint's name
+    on Postgres, by the "table.column" list SQLite reports. Not by searching the
+    message, whose Postgres DETAIL quotes the values, and they may say anything
+    """
+    constraint = getattr(getattr(error.orig, "diag", None), "constraint_name", None)
+    if constraint:
+        return DUPLICATE_CONSTRAINTS.get(constraint)
+
+    failed, found, columns = str(error.orig).partition("UNIQUE constraint failed: ")
+    for column in columns.split(",") if found and not failed else []:
+        table, _, name = column.strip().partition(".")
+        if table == User.__tablename__ and name in DUPLICATE_FIELDS:
+            return DUPLICATE_FIELDS[name]
+    return None
\ No newline at end of file
@@ -0,0 +1,219 @@
+# src/modules/shard_rebalance.py
+
+"""
+Moves users' tasks between shards (see src/common/sharding.py) while the app
+keeps serving them:
+
+    python -m src.modules.shard_rebalance move USER_ID SHARD
+    python -m src.modules.shard_rebalance pin
+    python -m src.modules.shard_rebalance rebalance
+
+A move copies the user's tasks, summary row and change log to the target
+while the source keeps taking writes. It then fences the source
+(task_count.moved), so writes that reach it fail with ShardMoved, replays the
+changes logged since the copy, and records the new placement in the
+directory. Reads stay on the source until every worker has reloaded the
+placements, after which the source copy is deleted; only its fenced summary
+row stays behind. The user's writes fail for about SHARD_PLACEMENT_REFRESH_S.
+
+Changing DATABASE_SHARD_URLS gives some users a different ring shard. Before
+deploying a new list, run `pin` with it: that pins every user to the shard
+holding their tasks. Deploy, then run `rebalance`, which moves each user
+whose ring shard differs to that shard and drops the pins.
+"""
+
+import time
+import logging
+import argparse
+from dataclasses import dataclass
+from collections.abc import Callable
+
+from sqlalchemy import delete, insert, select, update
+from sqlmodel import Session
+
+from src.common.models import ShardPlacement, Task, TaskChange, TaskCount
+from src.common.sharding import SHARD_PLACEMENT_REFRESH_S, ShardRouter
+
+logger = logging.getLogger("simplist.shard_rebalance")
+
+# Seconds between recording new placements and deleting the moved copies; every worker must have reloaded by then
+SETTLE_S = 2 * SHARD_PLACEMENT_REFRESH_S
+
+
+@dataclass(frozen=True)
+class Move:
+    user_id: int
+    source: str
+    target: str
+
+
+def locate_users(router: ShardRouter) -> dict[int, str]:
+    """The shard holding each user's tasks: where their unfenced summary row is"""
+    located = {}
+    for name in router.names:
+        with router.session(name) as session:
+            for user_id in session.exec(select(TaskCount.user_id).where(TaskCount.moved == False)).scalars():  # noqa: E712
+                if user_id in located:
+                    logger.warning("User %s has tasks on shards %s and %s; keeping %s", user_id, located[user_id], name, located[user_id])
+                    continue
+                located[user_id] = name
+    return located
+
+
+def changes_after(user_id: int, since: int, until: int | None = None):
+    stmt = select(TaskChange).where(TaskChange.user_id == user_id, TaskChange.version > since)
+    if until is not None:
+        stmt = stmt.where(TaskChange.version <= until)
+    return stmt.order_by(TaskChange.version)
+
+
+def copy_user(source: Session, target: Session, user_id: int) -> int:
+    """
+    Replace the user's rows on the target with the source's, fenced, and return
+    the log version they are as of. The version is read first, so rows read
+    after it may be newer; replaying the changes after it is harmless for those
+    """
+    count = source.get(TaskCount, user_id).model_dump()
+    tasks = [dict(task) for task in source.exec(select(Task.id, Task.user_id, Task.content, Task.completed).where(Task.user_id == user_id)).mappings()]
+    changes = [change.model_dump() for change in source.exec(changes_after(user_id, 0, count["version"])).scalars()]
+    source.rollback()
+
+    for model_type in (Task, TaskChange, TaskCount):
+        target.exec(delete(model_type).where(model_type.user_id == user_id))
+    if tasks:
+        target.exec(insert(Task), params=tasks)
+    if changes:
+        target.exec(insert(TaskChange), params=changes)
+    target.add(TaskCount(**{**count, "moved": True}))
+    target.commit()
+    return count["version"]
+
+
+def fence(session: Session, user_id: int) -> None:
+    session.exec(update(TaskCount).where(TaskCount.user_id == user_id).values(moved=True))
+    session.commit()
+
+
+def catch_up(source: Session, target: Session, user_id: int, since: int) -> None:
+    """Apply the source's changes after `since` to the target and unfence it there; the source is fenced, so nothing moves under it"""
+    if source.get(TaskCount, user_id).first_version > since + 1:
+        # The log no longer reaches back to the copy (compacted, or restarted by an import)
+        since = copy_user(source, target, user_id)
+
+    count = source.get(TaskCount, user_id).model_dump()
+    changes = [TaskChange(**change.model_dump()) for change in source.exec(changes_after(user_id, since)).scalars()]
+    source.rollback()
+    for change in changes:
+        # Each change says how it left the task, so it applies over a copy that already has it
+        if change.action == "add":
+            target.merge(Task(id=change.task_id, user_id=user_id, content=change.content, completed=change.completed))
+        elif change.action == "update":
+            target.exec(update(Task).where(Task.id == change.task_id).values(completed=change.completed))
+        else:
+            target.exec(delete(Task).where(Task.id == change.task_id))
+        target.merge(change)
+    target.merge(TaskCount(**{**count, "moved": False}))
+    target.commit()
+
+
+def place(router: ShardRouter, user_id: int, shard: str) -> None:
+    """Record the user's shard in the directory, or drop the pin when the ring already picks it"""
+    with router.directory() as session:
+        if shard == router.ring.shard_of(user_id):
+            session.exec(delete(ShardPlacement).where(ShardPlacement.user_id == user_id))
+        else:
+            session.merge(ShardPlacement(user_id=user_id, shard=shard))
+        session.commit()
+    router.refresh()
+
+
+def clean_up(session: Session, user_id: int) -> None:
+    """Delete the source copy, keeping its fenced summary row with nothing left to count"""
+    session.exec(delete(Task).where(Task.user_id == user_id))
+    session.exec(delete(TaskChange).where(TaskChange.user_id == user_id))
+    session.exec(update(TaskCount).where(TaskCount.user_id == user_id).values(total=0, completed=0))
+    session.commit()
+
+
+def move_users(router: ShardRouter, moves: list[Move], settle: float = SETTLE_S, sleep: Callable[[float], None] = time.sleep) -> list[Move]:
+    """Move each user's tasks from `source` to `target`; returns the moves made"""
+    moved = []
+    for move in moves:
+        if move.source == move.target:
+            continue
+        with router.session(move.source) as source, router.session(move.target) as target:
+            version = copy_user(source, target, move.user_id)
+            fence(source, move.user_id)
+            catch_up(source, target, move.user_id, version)
+        place(router, move.user_id, move.target)
+        moved.append(move)
+        logger.info("Moved the tasks of user %s from %s to %s", move.user_id, move.source, move.target)
+
+    if moved:
+        # Workers still routing to the sources read from them until they reload placements
+        sleep(settle)
+    for move in moved:
+        with router.session(move.source) as source:
+            clean_up(source, move.user_id)
+    return moved
+
+
+def move_user(router: ShardRouter, user_id: int, target: str, **options) -> Move | None:
+    if target not in router.names:
+        raise ValueError(f"Unknown shard {target!r}")
+    source = locate_users(router).get(user_id)
+    if source is None:
+        # Nothing written yet; the pin alone decides where their first task goes
+        place(router, user_id, target)
+        return None
+    moved = move_users(router, [Move(user_id, source, target)], **options)
+    return moved[0] if moved else None
+
+
+def pin_users(router: ShardRouter) -> dict[int, str]:
+    """Pin every user not on their ring shard to the one holding their tasks"""
+    pinned = {user_id: shard for user_id, shard in locate_users(router).items() if shard != router.ring.shard_of(user_id)}
+    with router.directory() as session:
+        for user_id, shard in pinned.items():
+            session.merge(ShardPlacement(user_id=user_id, shard=shard))
+        session.commit()
+    router.refresh()
+    return pinned
+
+
+def rebalance(router: ShardRouter, **options) -> list[Move]:
+    """Move every user off a shard other than their ring shard, dropping their pins"""
+    moves = [
+        Move(user_id, shard, router.ring.shard_of(user_id))
+        for user_id, shard in sorted(locate_users(router).items())
+        if shard != router.ring.shard_of(user_id)
+    ]
+    return move_users(router, moves, **options)
+
+
+if __name__ == "__main__":
+    from src.common.db_storage import shard_router
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    move_parser = commands.add_parser("move", help="move one user's tasks to a shard")
+    move_parser.add_argument("user_id", type=int)
+    move_parser.add_argument("shard")
+    commands.add_parser("pin", help="pin every user to the shard holding their tasks")
+    commands.add_parser("rebalance", help="move every user to their ring shard")
+    args = parser.parse_args()
+
+    if shard_router is None:
+        parser.error("DATABASE_SHARD_URLS is not set")
+    logging.basicConfig(level=logging.INFO)
+    shard_router.refresh()
+
+    if args.command == "move":
+        move = move_user(shard_router, args.user_id, args.shard)
+        print(f"Moved user {args.user_id} from {move.source} to {move.target}" if move else f"Placed user {args.user_id} on {args.shard}")
+    elif args.command == "pin":
+        for user_id, shard in pin_users(shard_router).items():
+            print(f"Pinned user {user_id} to {shard}")
+    else:
+        for move in rebalance(shard_router):
+            print(f"Moved user {move.user_id} from {move.source} to {move.target}")
@@ -1,45 +1,614 @@
 # src/modules/task_operations.py
 
-from dataclasses import dataclass
-from typing import Annotated
+import os
+import asyncio
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field
+from itertools import groupby
+from typing import Annotated, Any
+from contextlib import asynccontextmanager
+from collections.abc import AsyncGenerator, AsyncIterator
 from fastapi import Depends
+from sqlmodel import case, func, not_, or_, select
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
 
-from src.common.db_storage import DBStorageHandler, StorageDep
-from src.common.models import Task
+from src.common.db_storage import (
+    DBStorageHandler, StorageDep, AsyncDBStorageHandler,
+    IS_ASYNC_DATABASE, open_storage, open_async_storage, page_stmt,
+)
+from src.common.models import Task, TaskChange, TaskCount
+from src.common.search import search_stmt, search_terms
+from src.common.sharding import ShardMoved, ShardRouter
+
+# Seconds between checks of the stored task counts against the tasks; 0 turns them off
+TASK_COUNT_RECONCILE_S = float(os.getenv("TASK_COUNT_RECONCILE_S", "900"))
+# Changes kept per user; a client further behind than this gets a snapshot instead
+TASK_LOG_KEEP = int(os.getenv("TASK_LOG_KEEP", "1000"))
+# Seconds between compactions of the change log; 0 keeps every change
+TASK_LOG_COMPACT_S = float(os.getenv("TASK_LOG_COMPACT_S", "300"))
+
+logger = logging.getLogger("simplist.task_operations")
 
 @dataclass
 class TaskOperations:
     db_storage: DBStorageHandler[Task]
+    # Changes written since the last commit; commit() logs them
+    _changes: list[dict] = field(default_factory=list, init=False, repr=False)
 
     def get(self, id: int) -> Task:
         """"Get a task by ID"""
         return self.db_storage.get_by_id(id, Task)
     
 
-    def get_user_tasks(self, user_id: int) -> list[Task]:
-        """Get all tasks for a specific user"""
-        return self.db_storage.get_all_where(Task, Task.user_id == user_id)
+    def get_user_tasks(self, user_id: int, after: int | None = None, limit: int | None = None) -> list[Task]:
+        """Get a user's tasks ordered by id; `after`/`limit` select a keyset page"""
+        return self.db_storage.shard(user_id).get_all_where(Task, Task.user_id == user_id, group=("user_id", user_id), after=after, limit=limit)
+
+
+    def get_user_tasks_version(self, user_id: int) -> str | None:
+        """Token that changes with every write to the user's tasks, or None when uncached"""
+        return self.db_storage.group_version(Task, ("user_id", user_id))
+
+
+    def get_counts(self, user_id: int) -> dict:
+        """The user's total, completed and open task counts, from their summary row"""
+        return counts_reply(self.db_storage.shard(user_id).find(TaskCount, user_id))
+
+
+    def get_completed(self, user_id: int, ids: list[int]) -> dict[int, bool]:
+        """Completion status of those of the given tasks that exist and are the user's"""
+        return dict(self.db_storage.shard(user_id).select(completed_stmt(user_id, ids)))
+
+
+    def get_version(self, user_id: int) -> int:
+        """Version of the user's latest change, 0 before their first"""
+        row = self.db_storage.shard(user_id).find(TaskCount, user_id)
+        return row.version if row else 0
+
+
+    def get_changes(self, user_id: int, since: int) -> tuple[int, list[TaskChange]] | None:
+        """
+        The user's version and their changes after `since`, oldest first, or None
+        when the log can't bring a client at `since` up to date
+        """
+        version, first_version = log_head(self.db_storage.shard(user_id).select(log_head_stmt(user_id)))
+        if not can_replay(since, version, first_version):
+            return None
+        return version, self.db_storage.shard(user_id).select(changes_stmt(user_id, since, version))
+
+
+    def get_page(self, user_id: int, limit: int) -> tuple[int, list[Task], dict]:
+        """
+        The user's version, first page of tasks and counts, all read where get_user_tasks
+        reads; the version first, so the page is at least as new
+        """
+        db_storage = self.db_storage.shard(user_id)
+        row = db_storage.find(TaskCount, user_id, replica=True)
+        tasks = db_storage.get_all_where(Task, Task.user_id == user_id, group=("user_id", user_id), limit=limit)
+        return (row.version if row else 0), tasks, counts_reply(row)
+
+
+    def get_snapshot(self, user_id: int, limit: int) -> tuple[int, list[Task]]:
+        """The user's version and the first page of their tasks, read after it so the page is at least as new"""
+        version, _ = log_head(self.db_storage.shard(user_id).select(log_head_stmt(user_id)))
+        return version, self.db_storage.shard(user_id).select(page_stmt(Task, [Task.user_id == user_id], limit=limit))
+
+
+    def search(self, user_id: int, query: str, completed: bool | None = None, limit: int = 50, offset: int = 0) -> list[Task]:
+        """The user's tasks matching every word of `query` as a prefix, best matches first"""
+        db_storage = self.db_storage.shard(user_id)
+        stmt = search_stmt(db_storage.dialect, user_id, search_terms(query), completed, limit, offset)
+        return db_storage.select(stmt)
 
     
     def add(self, task_data: dict) -> Task:
         """Create a new task"""
-        task = Task(**task_data)
-        return self.db_storage.create(task)
+        [task_data] = self.assign_ids([task_data])
+        task = self.db_storage.shard(task_data["user_id"]).create(Task(**task_data), commit=False)
+        self.record_changes(added=[task])
+        self.commit()
+        return task
     
     
-    def delete(self, id: int) -> None:
-        """Delete a task by ID"""
-        self.db_storage.delete(id, Task)
-        
-    
-    def change_status(self, id: int):
-        """Toggle the completion status of a task"""
-        task = self.get(id)
-        return self.db_storage.update(id, Task, {"completed": not task.completed})
+    def add_many(self, user_id: int, contents: list[str], commit: bool = True) -> list[Task]:
+        """Create several tasks with one multi-row insert"""
+        rows = self.assign_ids(new_task_rows(user_id, contents))
+        tasks = self.db_storage.shard(user_id).bulk_insert(Task, rows, commit=False)
+        self.record_changes(added=tasks)
+        if commit:
+            self.commit()
+        return tasks
+
+
+    def import_rows(self, user_id: int, rows: list[dict]) -> int:
+        """Insert validated {"content", "completed"} rows (and "id", if given) as the user's, in one transaction with their count"""
+        rows = self.assign_ids([{**row, "user_id": user_id} for row in rows])
+        db_storage = self.db_storage.shard(user_id)
+        try:
+            db_storage.insert_many(Task, rows, commit=False)
+            check_placement(db_storage.increment(TaskCount, user_id, imported_counts(rows), commit=False))
+            # Too many to log one by one; clients from before it take a snapshot
+            db_storage.update_where(TaskCount, RESTART_LOG, TaskCount.user_id == user_id, commit=False)
+            db_storage.delete_where(TaskChange, TaskChange.user_id == user_id, commit=False)
+            self.db_storage.commit()
+        except Exception:
+            self.db_storage.rollback()
+            raise
+        return len(rows)
+
+
+    def assign_ids(self, rows: list[dict]) -> list[dict]:
+        """assign_task_ids; reserving a block queries the shard directory, which the storage may keep off the event loop"""
+        return self.db_storage.call_blocking(assign_task_ids, self.db_storage.shards, rows) if self.db_storage.shards else rows
+
+
+    def delete(self, id: int, user_id: int, commit: bool = True) -> None:
+        """Delete a task by ID if it belongs to the user"""
+        tasks = self.db_storage.shard(user_id).delete_rows(Task, Task.id == id, Task.user_id == user_id, commit=False)
+        if not tasks:
+            raise ValueError(f"Task with id {id} not found")
+        self.record_changes(deleted=tasks)
+        if commit:
+            self.commit()
+
+
+    def clear_completed(self, user_id: int, commit: bool = True) -> list[Task]:
+        """Delete all of the user's completed tasks in one statement, returning them"""
+        tasks = self.db_storage.shard(user_id).delete_rows(Task, Task.user_id == user_id, Task.completed, commit=False)
+        self.record_changes(deleted=tasks)
+        if commit:
+            self.commit()
+        return tasks
+
+
+    def change_status(self, id: int, user_id: int, commit: bool = True) -> Task:
+        """Toggle the completion status of a task owned by the user in one statement"""
+        tasks = self.db_storage.shard(user_id).update_where(Task, TOGGLE_COMPLETED, Task.id == id, Task.user_id == user_id, commit=False)
+        if not tasks:
+            raise ValueError(f"Task with id {id} not found")
+        self.record_changes(toggled=tasks)
+        if commit:
+            self.commit()
+        return tasks[0]
+
+
+    def record_changes(self, added: list[Task] = (), deleted: list[Task] = (), toggled: list[Task] = ()) -> None:
+        """Queue tasks just written for the next commit() to log"""
+        self._changes += change_entries(added, deleted, toggled)
+
+
+    def commit(self) -> dict[int, range]:
+        """
+        Log the changes queued since the last commit, adjust each user's summary
+        row to match and commit it all as one transaction. Returns every user's
+        new versions, in the order their changes were made
+        """
+        changes, self._changes = self._changes, []
+        try:
+            versions = {}
+            for user_id, entries in entries_by_user(changes).items():
+                db_storage = self.db_storage.shard(user_id)
+                row = check_placement(db_storage.increment(TaskCount, user_id, entry_deltas(entries), commit=False))
+                versions[user_id] = range(row.version - len(entries) + 1, row.version + 1)
+                db_storage.insert_many(TaskChange, log_rows(entries, versions[user_id]), commit=False)
+            self.db_storage.commit()
+        except Exception:
+            self.db_storage.rollback()
+            raise
+        return versions
+
+
+    def rollback(self) -> None:
+        self._changes = []
+        self.db_storage.rollback()
+
+
+    def reconcile_counts(self) -> dict[int, tuple[dict, dict]]:
+        """
+        Compare every summary row with a count of the tasks, recount the users
+        whose rows still drift when repaired, and return {user_id: (stored, counted)} for them.
+        Each shard is checked and repaired in a transaction of its own
+        """
+        drifted = {}
+        for db_storage in self.db_storage.all_shards():
+            drifted |= reconcile_shard_counts(db_storage)
+        return drifted
+
+
+    def compact_log(self, keep: int = TASK_LOG_KEEP) -> int:
+        """Drop every user's changes but their latest `keep`, returning how many went"""
+        return sum(compact_shard_log(db_storage, keep) for db_storage in self.db_storage.all_shards())
+
+
+    def apply_batch(self, user_id: int, operations: list[dict]) -> list[dict]:
+        """Apply several task actions in one transaction, returning one result per operation"""
+        try:
+            results = []
+            for is_add, group in groupby(operations, key=is_add_operation):
+                if is_add:
+                    tasks = self.add_many(user_id, [operation.get("content") for operation in group], commit=False)
+                    results += [added_result(task) for task in tasks]
+                else:
+                    results += [self._apply(user_id, operation) for operation in group]
+        except Exception as e:
+            self.rollback()
+            return [batch_error(e) for _ in operations]
+        try:
+            versions = self.commit().get(user_id, range(0))
+        except Exception as e:
+            return [batch_error(e) for _ in operations]
+        return with_versions(results, versions)
+
+
+    def _apply(self, user_id: int, operation: dict) -> dict:
+        action, id = operation.get("action"), operation.get("id")
+        try:
+            if action == "delete":
+                self.delete(id, user_id, commit=False)
+            elif action == "clear_completed":
+                return cleared_result(self.clear_completed(user_id, commit=False))
+            elif action == "update":
+                task = self.change_status(id, user_id, commit=False)
+                return {"status": 1, "action": action, "id": id, "completed": task.completed}
+            else:
+                return batch_error(f"Unknown action: {action}")
+        except ValueError as e:
+            # Nothing matched, so nothing was written and the batch can go on
+            return batch_error(e)
+        return {"status": 1, "action": action, "id": id}
+
+
+TOGGLE_COMPLETED = {"completed": not_(Task.completed)}
+
+# Moves a user's log past changes it can't describe; every client from before takes a snapshot
+RESTART_LOG = {"version": TaskCount.version + 1, "first_version": TaskCount.version + 2}
+
+COUNT_TASKS = select(Task.user_id, func.count(), func.sum(case((Task.completed, 1), else_=0))).group_by(Task.user_id)
+
+
+def recount_values(user_id: int) -> dict:
+    return {
+        "total": select(func.count()).where(Task.user_id == user_id).scalar_subquery(),
+        "completed": select(func.count()).where(Task.user_id == user_id, Task.completed).scalar_subquery(),
+    }
+
+
+def completed_stmt(user_id: int, ids: list[int]):
+    return select(Task.id, Task.completed).where(Task.user_id == user_id, Task.id.in_(ids))
+
+
+def reconcile_shard_counts(db_storage: DBStorageHandler) -> dict[int, tuple[dict, dict]]:
+    counted = {user_id: counts_reply(None, total, completed) for user_id, total, completed in db_storage.select(COUNT_TASKS)}
+    stored = {row.user_id: counts_reply(row) for row in db_storage.select(select(TaskCount))}
+    drifted = {
+        user_id: (stored.get(user_id, counts_reply(None)), counted.get(user_id, counts_reply(None)))
+        for user_id in stored.keys() | counted.keys()
+        if stored.get(user_id, counts_reply(None)) != counted.get(user_id, counts_reply(None))
+    }
+    repaired = {}
+    try:
+        for user_id, (stored_counts, counts) in drifted.items():
+            if user_id in stored:
+                # Counted again in the statement, which locks the row: a write since the scan above
+                # may have evened the counts out, and then nothing changes. Those that still drift
+                # were changed around the log, which can't describe that, so it starts over
+                recount = recount_values(user_id)
+                still_drifted = or_(TaskCount.total != recount["total"], TaskCount.completed != recount["completed"])
+                rows = db_storage.update_where(TaskCount, {**recount, **RESTART_LOG}, TaskCount.user_id == user_id, still_drifted, commit=False)
+                if not rows:
+                    continue
+                counts = counts_reply(rows[0])
+            else:
+                db_storage.increment(TaskCount, user_id, {"total": counts["total"], "completed": counts["completed"]}, commit=False)
+            db_storage.delete_where(TaskChange, TaskChange.user_id == user_id, commit=False)
+            repaired[user_id] = (stored_counts, counts)
+        db_storage.commit()
+    except Exception:
+        db_storage.rollback()
+        raise
+    return repaired
+
+
+def compact_shard_log(db_storage: DBStorageHandler, keep: int) -> int:
+    try:
+        trimmed = db_storage.update_where(TaskCount, *compact_values(keep), commit=False)
+        removed = db_storage.delete_where(TaskChange, *compacted_changes([row.user_id for row in trimmed]), commit=False) if trimmed else 0
+        db_storage.commit()
+    except Exception:
+        db_storage.rollback()
+        raise
+    return removed
+
+
+def check_placement(row: TaskCount) -> TaskCount:
+    """The user's summary row just written, unless the user was moved off this shard"""
+    if row.moved:
+        raise ShardMoved(row.user_id)
+    return row
+
+
+def assign_task_ids(shards: ShardRouter | None, rows: list[dict]) -> list[dict]:
+    """
+    Rows given ids from the directory's blocks when tasks are sharded, since
+    each shard's own sequence would hand out ids another shard already used;
+    unsharded rows are numbered by the database
+    """
+    if not shards:
+        return rows
+    ids = iter(shards.task_ids.take(sum("id" not in row for row in rows)))
+    return [row if "id" in row else {"id": next(ids), **row} for row in rows]
+
+
+def log_head_stmt(user_id: int):
+    return select(TaskCount.version, TaskCount.first_version).where(TaskCount.user_id == user_id)
+
+
+def log_head(rows: list) -> tuple[int, int]:
+    """(version, first_version) from log_head_stmt; a user without a row hasn't changed anything yet"""
+    return tuple(rows[0]) if rows else (0, 1)
+
+
+def can_replay(since: int, version: int, first_version: int) -> bool:
+    # A client ahead of the log is out of step with it (a restored database, say)
+    return first_version - 1 <= since <= version and version - since <= TASK_LOG_KEEP
+
+
+def changes_stmt(user_id: int, since: int, version: int):
+    # Capped at `version`, as changes committed after it was read may show up
+    return (
+        select(TaskChange)
+        .where(TaskChange.user_id == user_id, TaskChange.version > since, TaskChange.version <= version)
+        .order_by(TaskChange.version)
+    )
+
+
+def compact_values(keep: int) -> tuple:
+    """update_where() arguments moving first_version up to each user's last `keep` changes"""
+    first_kept = TaskCount.version - keep + 1
+    return {"first_version": first_kept}, TaskCount.first_version < first_kept
+
+
+def compacted_changes(user_ids: list[int]) -> tuple:
+    """Conditions for the changes of these users that fell out of their log"""
+    first_version = select(TaskCount.first_version).where(TaskCount.user_id == TaskChange.user_id).scalar_subquery()
+    return TaskChange.user_id.in_(user_ids), TaskChange.version < first_version
+
+
+def change_entries(added: list[Task] = (), deleted: list[Task] = (), toggled: list[Task] = ()) -> list[dict]:
+    """Log entries for tasks just written; `toggled` tasks are as they are after the toggle"""
+    return [
+        *(change_entry("add", task, task.content) for task in added),
+        *(change_entry("delete", task) for task in deleted),
+        *(change_entry("update", task) for task in toggled),
+    ]
+
+
+def change_entry(action: str, task: Task, content: str | None = None) -> dict:
+    return {"user_id": task.user_id, "action": action, "task_id": task.id, "content": content, "completed": task.completed}
+
+
+def entries_by_user(entries: list[dict]) -> dict[int, list[dict]]:
+    by_user = defaultdict(list)
+    for entry in entries:
+        by_user[entry["user_id"]].append(entry)
+    return by_user
+
+
+def entry_deltas(entries: list[dict]) -> dict:
+    """What one user's entries add to their summary row: the counts, and a version each"""
+    total = completed = 0
+    for entry in entries:
+        if entry["action"] == "add":
+            total += 1
+            completed += entry["completed"]
+        elif entry["action"] == "delete":
+            total -= 1
+            completed -= entry["completed"]
+        else:
+            completed += 1 if entry["completed"] else -1
+    return {"total": total, "completed": completed, "version": len(entries)}
+
+
+def log_rows(entries: list[dict], versions: range) -> list[dict]:
+    return [{**entry, "version": version} for entry, version in zip(entries, versions)]
+
+
+def with_versions(results: list[dict], versions: range) -> list[dict]:
+    """
+    A batch's results with the version of each change that went through; they were logged in the same order.
+    A clear_completed logged one change per task it deleted, and gets the first ("since") and last of theirs
+    """
+    versions = iter(versions)
+    versioned = []
+    for result in results:
+        if result["status"] == 1 and result["action"] == "clear_completed":
+            logged = [next(versions) for _ in result["ids"]]
+            result = {**result, "since": logged[0], "version": logged[-1]} if logged else result
+        elif result["status"] == 1:
+            result = {**result, "version": next(versions)}
+        versioned.append(result)
+    return versioned
+
+
+def change_reply(change: TaskChange) -> dict:
+    """A logged change as the client applies it: the state it left the task in, so replaying it twice is harmless"""
+    reply = {"action": change.action, "id": change.task_id, "version": change.version}
+    if change.action == "add":
+        reply["content"] = change.content
+    if change.action != "delete":
+        reply["completed"] = change.completed
+    return reply
+
+
+def imported_counts(rows: list[dict]) -> dict:
+    return {"total": len(rows), "completed": sum(row["completed"] for row in rows)}
+
+
+def counts_reply(row: TaskCount | None, total: int = 0, completed: int = 0) -> dict:
+    if row is not None:
+        total, completed = row.total, row.completed
+    return {"total": total, "completed": completed, "open": total - completed}
+
+
+def new_task_rows(user_id: int, contents: list[str]) -> list[dict]:
+    return [{"content": content, "user_id": user_id, "completed": False} for content in contents]
+
+
+def is_add_operation(operation: dict) -> bool:
+    return operation.get("action") == "add"
+
+
+def added_result(task: Task) -> dict:
+    return {"status": 1, "action": "add", "id": task.id, "content": task.content}
+
+
+def cleared_result(tasks: list[Task]) -> dict:
+    return {"status": 1, "action": "clear_completed", "ids": [task.id for task in tasks]}
+
+
+def batch_error(error: Exception | str) -> dict:
+    return {"status": 0, "action": "error", "error": str(error)}
 
 
 def get_task_operations(db_storage: StorageDep) -> TaskOperations:
     """Dependency to get TaskOperations instance"""
     return TaskOperations(db_storage)
 
-TaskOperationsDep = Annotated[TaskOperations, Depends(get_task_operations)]
\ No newline at end of file
+TaskOperationsDep = Annotated[TaskOperations, Depends(get_task_operations)]
+
+
+class AsyncTaskOperations:
+    """
+    TaskOperations for async drivers: the same methods as coroutines, each run
+    through the AsyncDBStorageHandler's greenlet bridge, so the database waits
+    on the event loop rather than block it
+    """
+
+    def __init__(self, db_storage: AsyncDBStorageHandler[Task]):
+        self.db_storage = db_storage
+        self.task_operations = TaskOperations(db_storage)
+
+    def __getattr__(self, name: str) -> Any:
+        method = getattr(self.task_operations, name)
+
+        async def run(*args, **kwargs):
+            return await self.db_storage.run(method, *args, **kwargs)
+
+        return run
+
+
+class ThreadedTaskOperations:
+    """
+    Fallback for sync database URLs: exposes the TaskOperations API as coroutines
+    that run in the threadpool, so callers never block the event loop
+    """
+
+    def __init__(self, task_operations: TaskOperations):
+        self.task_operations = task_operations
+
+    def __getattr__(self, name: str) -> Any:
+        method = getattr(self.task_operations, name)
+
+        def call(*args, **kwargs):
+            # Each call is its own unit of work: hand the connection back to the
+            # pool instead of holding it while a websocket sits idle
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.task_operations.db_storage.close()
+
+        async def run(*args, **kwargs):
+            return await run_in_threadpool(call, *args, **kwargs)
+
+        return run
+
+
+@asynccontextmanager
+async def open_async_task_operations() -> AsyncIterator[AsyncTaskOperations]:
+    """AsyncTaskOperations on a session of their own (async engine or threadpool fallback), closed on exit"""
+    if IS_ASYNC_DATABASE:
+        db_storage = open_async_storage()
+        try:
+            yield AsyncTaskOperations(db_storage)
+        finally:
+            await db_storage.aclose()
+    else:
+        db_storage = open_storage()
+        try:
+            yield ThreadedTaskOperations(TaskOperations(db_storage))
+        finally:
+            await run_in_threadpool(db_storage.close)
+
+
+async def get_async_task_operations() -> AsyncGenerator[AsyncTaskOperations, None]:
+    """Dependency to get AsyncTaskOperations instance (async engine or threadpool fallback)"""
+    async with open_async_task_operations() as task_operations:
+        yield task_operations
+
+AsyncTaskOperationsDep = Annotated[AsyncTaskOperations, Depends(get_async_task_operations)]
+
+
+async def stream_user_tasks(user_id: int, batch_size: int = 500) -> AsyncGenerator[list[Task], None]:
+    """
+    Stream a user's tasks in chunks from a server-side cursor. Opens its own
+    session, since a streamed response outlives the request's dependencies
+    """
+    if IS_ASYNC_DATABASE:
+        db_storage = open_async_storage()
+        try:
+            async for chunk in db_storage.iterate(db_storage.shard(user_id).stream_where(Task, Task.user_id == user_id, batch_size=batch_size)):
+                yield chunk
+        finally:
+            await db_storage.aclose()
+    else:
+        def chunks():
+            db_storage = open_storage()
+            try:
+                yield from db_storage.shard(user_id).stream_where(Task, Task.user_id == user_id, batch_size=batch_size)
+            finally:
+                db_storage.close()
+
+        async for chunk in iterate_in_threadpool(chunks()):
+            yield chunk
+
+
+def reconcile_task_counts() -> dict[int, tuple[dict, dict]]:
+    """One reconcile pass on a fresh session, logging every repaired drift"""
+    db_storage = open_storage()
+    try:
+        drifted = TaskOperations(db_storage).reconcile_counts()
+    finally:
+        db_storage.close()
+    for user_id, (stored, counted) in drifted.items():
+        logger.warning("Repaired task counts of user %s: stored %s, counted %s", user_id, stored, counted)
+    return drifted
+
+
+async def keep_counts_reconciled(interval: float = TASK_COUNT_RECONCILE_S):
+    """Reconcile every `interval` seconds; runs for the app's lifetime"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(reconcile_task_counts)
+        except Exception:
+            logger.exception("Could not reconcile task counts")
+
+
+def compact_task_log() -> int:
+    """One compaction pass on a fresh session"""
+    db_storage = open_storage()
+    try:
+        return TaskOperations(db_storage).compact_log()
+    finally:
+        db_storage.close()
+
+
+async def keep_task_log_compacted(interval: float = TASK_LOG_COMPACT_S):
+    """Compact every `interval` seconds; runs for the app's lifetime"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(compact_task_log)
+        except Exception:
+            logger.exception("Could not compact the task change log")
@@ -0,0 +1,212 @@
+# src/modules/task_transfer.py
+
+"""
+Bulk import and export of a user's tasks, as CSV or NDJSON.
+
+Imports are parsed as the upload arrives and inserted IMPORT_CHUNK_SIZE rows
+at a time with one executemany each, so memory stays flat however large the
+file is. Each chunk commits on its own together with the user's counts: a
+file that breaks off halfway (bad encoding, an overlong line) keeps the rows
+before the break, and the report says how many that was. Rows that fail
+validation are skipped and reported by line number.
+
+CSV needs a header naming a "content" column; "completed" is optional and
+anything else (such as the "id" column of an export) is ignored. NDJSON
+takes one object per line with the same fields. Imported tasks always get
+new ids.
+"""
+
+import io
+import os
+import csv
+import codecs
+from dataclasses import dataclass, field
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+
+from pydantic import BaseModel, ConfigDict, ValidationError
+
+from src.common.protocol import JSON, TaskContent
+from src.modules.task_operations import stream_user_tasks
+
+# Rows per INSERT (and per transaction)
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+# Row errors listed in the report; any more are only counted
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "100"))
+# Longest line accepted, so a file without line breaks can't grow the buffer without bound
+IMPORT_MAX_LINE = int(os.getenv("IMPORT_MAX_LINE", str(64 * 1024)))
+
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+CSV_HEADER = ("id", "content", "completed")
+
+
+class TaskRow(BaseModel):
+    """An imported task, checked against the same limits as Task"""
+    model_config = ConfigDict(extra="ignore")
+
+    content: TaskContent
+    completed: bool = False
+
+
+@dataclass
+class ImportReport:
+    imported: int = 0
+    rejected: int = 0
+    errors: list[dict] = field(default_factory=list)
+    # Why the import stopped early, if it did
+    error: str | None = None
+
+    def reject(self, line: int, error: str) -> None:
+        self.rejected += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"line": line, "error": error})
+
+
+def upload_format(content_type: str | None) -> str | None:
+    """"csv" or "ndjson" from a Content-Type header, None when it's neither"""
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    return {"text/csv": "csv", "application/x-ndjson": "ndjson", "application/jsonl": "ndjson"}.get(media_type)
+
+
+async def text_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[list[str]]:
+    """Complete lines, with their line breaks, as each chunk of UTF-8 arrives"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    rest = ""
+    async for chunk in chunks:
+        lines = (rest + decoder.decode(chunk)).split("\n")
+        rest = lines.pop()
+        if len(rest) > IMPORT_MAX_LINE:
+            raise ValueError(f"A line is longer than {IMPORT_MAX_LINE} characters")
+        if lines:
+            yield [line + "\n" for line in lines]
+    rest += decoder.decode(b"", final=True)
+    if rest:
+        yield [rest]
+
+
+class CSVRecords:
+    """
+    Records from CSV lines fed as they arrive. Quotes come in pairs ("" is an
+    escaped one), so while a record's count is odd a quoted field runs on into
+    the next line.
+    """
+
+    def __init__(self):
+        self.header: list[str] | None = None
+        self.line = 0
+        self.pending: list[str] = []
+        self.quotes = 0
+        self.start = 0
+
+    def feed(self, lines: list[str]) -> Iterator[tuple[int, dict | str]]:
+        records = []
+        for line in lines:
+            self.line += 1
+            if not self.pending:
+                self.start = self.line
+            self.pending.append(line)
+            self.quotes += line.count('"')
+            if self.quotes % 2 == 0:
+                records.append((self.start, "".join(self.pending)))
+                self.pending, self.quotes = [], 0
+        yield from self.parse(records)
+
+    def finish(self) -> Iterator[tuple[int, dict | str]]:
+        if self.pending:
+            yield self.start, "Unterminated quoted field"
+
+    def parse(self, records: list[tuple[int, str]]) -> Iterator[tuple[int, dict | str]]:
+        try:
+            for (line, _), fields in zip(records, csv.reader(text for _, text in records)):
+                if not fields:
+                    continue
+                if self.header is None:
+                    self.header = [name.strip().lower() for name in fields]
+                    if "content" not in self.header:
+                        raise ValueError("The CSV header has no content column")
+                    continue
+                # An empty cell means the column's default
+                yield line, {name: value for name, value in zip(self.header, fields) if value != ""}
+        except csv.Error as e:
+            raise ValueError(f"Unreadable CSV: {e}")
+
+
+class NDJSONRecords:
+    def __init__(self):
+        self.line = 0
+
+    def feed(self, lines: list[str]) -> Iterator[tuple[int, dict | str]]:
+        for line in lines:
+            self.line += 1
+            if not line.strip():
+                continue
+            try:
+                record = JSON.decode(line)
+            except ValueError:
+                yield self.line, "Invalid JSON"
+                continue
+            yield self.line, record if isinstance(record, dict) else "Expected a JSON object"
+
+    def finish(self) -> Iterator[tuple[int, dict | str]]:
+        return iter(())
+
+
+PARSERS = {"csv": CSVRecords, "ndjson": NDJSONRecords}
+
+
+def validate_row(record: dict) -> dict:
+    try:
+        return TaskRow.model_validate(record).model_dump()
+    except ValidationError as e:
+        error = e.errors()[0]
+        raise ValueError(f"{'.'.join(map(str, error['loc']))}: {error['msg']}")
+
+
+async def import_tasks(
+    chunks: AsyncIterator[bytes], format: str, insert: Callable[[list[dict]], Awaitable[int]],
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+) -> ImportReport:
+    """Parse and validate an upload as it streams in, passing insert() chunks of valid rows"""
+    report = ImportReport()
+    parser = PARSERS[format]()
+    rows: list[dict] = []
+
+    async def take(records: Iterator[tuple[int, dict | str]]) -> None:
+        nonlocal rows
+        for line, record in records:
+            try:
+                if isinstance(record, str):
+                    raise ValueError(record)
+                rows.append(validate_row(record))
+            except ValueError as e:
+                report.reject(line, str(e))
+                continue
+            if len(rows) >= chunk_size:
+                report.imported += await insert(rows)
+                rows = []
+
+    try:
+        async for lines in text_lines(chunks):
+            await take(parser.feed(lines))
+        await take(parser.finish())
+    except (ValueError, UnicodeDecodeError) as e:
+        report.error = "The upload is not UTF-8" if isinstance(e, UnicodeDecodeError) else str(e)
+    if rows:
+        report.imported += await insert(rows)
+    return report
+
+
+async def export_tasks(user_id: int, format: str) -> AsyncIterator[str]:
+    """The user's tasks as CSV or NDJSON text, streamed from a server-side cursor"""
+    if format == "csv":
+        yield csv_text([CSV_HEADER])
+    async for chunk in stream_user_tasks(user_id):
+        if format == "csv":
+            yield csv_text((task.id, task.content, "true" if task.completed else "false") for task in chunk)
+        else:
+            yield "".join(task.model_dump_json() + "\n" for task in chunk)
+
+
+def csv_text(rows) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
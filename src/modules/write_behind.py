@@ -0,0 +1,725 @@
+# src/modules/write_behind.py
+
+"""
+Write-behind for websocket task actions.
+
+With WRITE_BEHIND_DIR set, add/update/delete are acknowledged as soon as they
+are appended (and fsynced) to a local journal, and a background task applies
+them to the database in one transaction every WRITE_BEHIND_FLUSH_MS. New
+tasks get their id from a block reserved up front, so an add can answer
+before its INSERT runs. Until a flush commits, reads in this process see the
+pending writes laid over what the database returns. clear_completed needs
+the database to say which tasks are completed, so it flushes first and then
+runs directly.
+
+Each worker holds (flock) its own slot in the directory. At startup every
+slot nobody holds is replayed; the flush transaction also records the last
+journal entry it applied, so entries committed just before a crash are
+skipped rather than applied twice.
+
+With task shards (see src/common/sharding.py), each flush commits one
+transaction per shard, and each shard records how far it applied the journal.
+A shard that fails keeps its changes pending while the others' go through.
+Changes the database rejects outright (a constraint they break) would fail
+every flush and replay after them, so they are retried one at a time, and
+the ones rejected again are appended to rejected.log in the directory
+instead of committed.
+
+Acknowledged actions carry no change log version (see TaskChange), since it
+is given out when they commit. After each flush, every affected user's sockets
+get a "synced" frame with the versions it logged, which they already have.
+
+Updates answer with the completed state they leave the task in, as they do
+without write-behind, so a batch with updates reads the stored state of the
+tasks it toggles; updating a task that doesn't exist, or isn't the user's, is
+rejected. Deletes are not checked against the database before they are
+acknowledged: deleting such a task is acknowledged and then matches nothing
+when flushed. Other task inserts must
+not run while this is enabled, since they would take ids from reserved blocks;
+imports go through WriteBehindTaskOperations.import_rows, which takes theirs
+from the blocks too.
+"""
+
+import os
+import json
+import fcntl
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, replace
+from itertools import groupby
+from pathlib import Path
+from typing import Annotated, Any, TypeVar
+from collections.abc import AsyncIterator, Awaitable, Callable
+
+from fastapi import Depends
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+from src.common.broadcast import broadcaster
+from src.common.db_storage import DBStorageHandler, SessionLocal, shard_router
+from src.common.models import Sequence, Task, TaskChange
+from src.common.protocol import TaskContent
+from src.common.sharding import ShardRouter, reserve_task_ids
+from src.modules.task_operations import (
+    AsyncTaskOperations, AsyncTaskOperationsDep, TaskOperations, TOGGLE_COMPLETED, added_result, batch_error, completed_stmt,
+    counts_reply, open_async_task_operations,
+)
+
+# Journal directory; unset leaves write-behind off and every action commits before its reply
+WRITE_BEHIND_DIR = os.getenv("WRITE_BEHIND_DIR")
+WRITE_BEHIND_FLUSH_MS = float(os.getenv("WRITE_BEHIND_FLUSH_MS", "50"))
+# Task ids reserved per round trip to the sequence table
+WRITE_BEHIND_ID_BLOCK = int(os.getenv("WRITE_BEHIND_ID_BLOCK", "1000"))
+# 0 acknowledges once the OS has the journal write, trading a crash window for latency
+WRITE_BEHIND_FSYNC = os.getenv("WRITE_BEHIND_FSYNC", "1") == "1"
+
+logger = logging.getLogger("simplist.write_behind")
+
+
+@dataclass(frozen=True)
+class PendingTask:
+    """Net effect of the unflushed actions on one task"""
+    user_id: int
+    content: str | None = None  # Set when the task itself is unflushed
+    toggled: bool = False
+    deleted: bool = False
+
+    @property
+    def added(self) -> bool:
+        return self.content is not None
+
+
+Pending = dict[int, PendingTask]
+
+R = TypeVar("R")
+
+
+class FlushFailed(Exception):
+    """Some shards didn't commit: `failed` holds their changes, `versions` what the others logged"""
+
+    def __init__(self, failed: Pending, versions: dict[int, range]):
+        super().__init__(f"{len(failed)} pending task changes did not commit")
+        self.failed = failed
+        self.versions = versions
+
+
+def apply_record(pending: Pending, record: dict) -> None:
+    """Fold one journal record into the pending state"""
+    action, id, user_id = record["action"], record["id"], record["user_id"]
+    if action == "add":
+        pending[id] = PendingTask(user_id, content=record["content"])
+        return
+
+    entry = pending.get(id, PendingTask(user_id))
+    if action == "update":
+        pending[id] = replace(entry, toggled=not entry.toggled)
+    elif entry.added:
+        # Added and deleted before a flush: the database never needs to hear of it
+        del pending[id]
+    else:
+        pending[id] = replace(entry, deleted=True)
+
+
+def merge(earlier: Pending, later: Pending) -> Pending:
+    """Pending state of `earlier`'s actions followed by `later`'s"""
+    merged = dict(earlier)
+    for id, entry in later.items():
+        before = merged.get(id)
+        if before is None:
+            merged[id] = entry
+        elif entry.deleted and before.added:
+            del merged[id]
+        else:
+            merged[id] = replace(before, toggled=before.toggled != entry.toggled, deleted=entry.deleted)
+    return merged
+
+
+def overlay(tasks: list[Task], changes: Pending, after: int | None, limit: int | None, complete: bool) -> list[Task]:
+    """
+    Lay a user's pending changes over a page of their tasks. `complete` says the
+    page reached the end of the list, so pending adds past its last row belong in it
+    """
+    rows = []
+    for task in tasks:
+        change = changes.get(task.id)
+        if change is None:
+            rows.append(task)
+        elif not change.deleted:
+            rows.append(Task(id=task.id, user_id=task.user_id, content=task.content, completed=task.completed != change.toggled))
+
+    last = tasks[-1].id if tasks and not complete else None
+    rows += [
+        Task(id=id, user_id=change.user_id, content=change.content, completed=change.toggled)
+        for id, change in changes.items()
+        if change.added and (after is None or id > after) and (last is None or id < last)
+    ]
+    rows.sort(key=lambda task: task.id)
+    return rows[:limit] if limit is not None else rows
+
+
+def overlay_counts(counts: dict, changes: Pending, completed: dict[int, bool]) -> dict:
+    """
+    Lay a user's pending changes over their stored counts. `completed` holds the
+    stored status of the tasks the changes touch; ones missing from it match
+    nothing when flushed, so they don't count
+    """
+    total, done = counts["total"], counts["completed"]
+    for id, change in changes.items():
+        if change.added:
+            total += 1
+            done += change.toggled
+        elif id in completed:
+            if change.deleted:
+                total -= 1
+                done -= completed[id]
+            elif change.toggled:
+                done += -1 if completed[id] else 1
+    return counts_reply(None, total, done)
+
+
+class Journal:
+    """
+    One worker's slot in the journal directory: a lock file held with flock,
+    plus JSON-lines segments named {slot}-{first seq}.log. Appends go to the
+    newest segment; a flush rotates to a fresh one and deletes the old ones
+    once their entries are committed.
+    """
+
+    def __init__(self, directory: Path, slot: int, lock_file):
+        self.directory = directory
+        self.slot = slot
+        self.lock_file = lock_file
+        self.path: Path | None = None
+        self.file = None
+
+    @classmethod
+    def claim(cls, directory: Path, slot: int) -> "Journal | None":
+        lock_file = open(directory / f"{slot}.lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        return cls(directory, slot, lock_file)
+
+    @property
+    def name(self) -> str:
+        """Its row in the sequence table, holding the last seq committed"""
+        return f"journal:{self.slot}"
+
+    def segments(self) -> list[Path]:
+        return sorted(self.directory.glob(f"{self.slot}-*.log"))
+
+    def read(self) -> list[dict]:
+        records = []
+        for segment in self.segments():
+            for line in segment.read_bytes().splitlines():
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # A write torn by the crash; it was never acknowledged
+                    logger.warning("Skipping a partial record in %s", segment)
+        return records
+
+    def rotate(self, first_seq: int):
+        """
+        Start a new segment; returns the previous segment's file, still open, or
+        None when nothing was written since the last rotation
+        """
+        path = self.directory / f"{self.slot}-{first_seq:012d}.log"
+        if path == self.path:
+            return None
+        previous, self.path = self.file, path
+        self.file = open(path, "ab")
+        return previous
+
+    def closed_segments(self) -> list[Path]:
+        return [segment for segment in self.segments() if segment != self.path]
+
+    def append(self, records: list[dict]) -> int:
+        """Write records to the current segment, returning its descriptor for fsync"""
+        self.file.write(b"".join(json.dumps(record, separators=(",", ":")).encode() + b"\n" for record in records))
+        self.file.flush()
+        return self.file.fileno()
+
+    def remove(self, segments: list[Path]) -> None:
+        for segment in segments:
+            segment.unlink(missing_ok=True)
+
+    def release(self) -> None:
+        if self.file:
+            self.file.close()
+        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.lock_file.close()
+
+
+class WriteBehind:
+    def __init__(
+        self, directory: Path, flush_interval: float = WRITE_BEHIND_FLUSH_MS / 1000,
+        id_block: int = WRITE_BEHIND_ID_BLOCK, fsync: bool = WRITE_BEHIND_FSYNC,
+        session_factory: sessionmaker = SessionLocal, shards: ShardRouter | None = shard_router,
+    ):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.id_block = id_block
+        self.fsync = fsync
+        # The directory, which reserves task ids; tasks go to `shards`, or here too when unsharded
+        self.session_factory = session_factory
+        self.shards = shards
+
+        self.journal: Journal | None = None
+        self.seq = 0
+        self.pending: Pending = {}
+        self.flushing: Pending = {}
+        self._ids = range(0)
+        self._ids_lock = asyncio.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._syncs: set[asyncio.Future] = set()
+        # Odd while a flush is committing; reads retry if it moved under them
+        self.generation = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    # --- Lifecycle ---
+
+    def start(self) -> None:
+        """Claim a journal slot and replay every unheld one, this worker's included"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        slot = 0
+        while (journal := Journal.claim(self.directory, slot)) is None:
+            slot += 1
+        self.journal = journal
+
+        for lock_path in self.directory.glob("*.lock"):
+            other = int(lock_path.stem)
+            if other != slot and (orphan := Journal.claim(self.directory, other)):
+                try:
+                    self.replay(orphan)
+                finally:
+                    orphan.release()
+
+        self.seq = self.replay(journal)
+        journal.rotate(self.seq + 1)
+
+    async def run(self) -> None:
+        """Flush on an interval until cancelled"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Write-behind flush failed; retrying with the next one")
+
+    async def close(self) -> None:
+        try:
+            await self.flush()
+        finally:
+            self.journal.release()
+
+    def replay(self, journal: Journal) -> int:
+        """Commit a journal's uncommitted records and empty it; returns its last seq"""
+        applied = {shard: self.applied_seq(shard, journal.name) for shard in self.shard_sessions()}
+        records = journal.read()
+        last = max([*applied.values()] + [record["seq"] for record in records])
+
+        pending: Pending = {}
+        replayed = [record for record in records if record["seq"] > applied[self.shard_of(record["user_id"])]]
+        for record in replayed:
+            apply_record(pending, record)
+        if pending:
+            self.commit(pending, journal.name, last)
+        if replayed:
+            logger.info("Replayed %d write-behind records from %s", len(replayed), journal.name)
+        journal.remove(journal.segments())
+        return last
+
+    # --- Writes ---
+
+    async def apply_batch(self, user_id: int, operations: list[dict]) -> list[dict]:
+        """Journal the actions and acknowledge them, one result per operation, without touching the database"""
+        if user_id is None:
+            # Journaled, it could never commit
+            raise ValueError("Write-behind actions need a user")
+        ids = iter(await self.take_ids(sum(operation.get("action") == "add" for operation in operations)))
+        toggled_ids = update_ids(operations)
+
+        async def fetch_completed(changes: Pending) -> dict[int, bool]:
+            stored = [id for id in toggled_ids if not (id in changes and changes[id].added)]
+            return await run_in_threadpool(self.stored_completed, user_id, stored) if stored else {}
+
+        # No await from here to the journal append, so a flush can't commit between this read and the acks
+        completed = (await self.snapshot(user_id, fetch_completed))[1] if toggled_ids else {}
+        results, records = [], []
+        for operation in operations:
+            action = operation.get("action")
+            try:
+                if action == "add":
+                    record = {"action": "add", "id": next(ids), "content": task_content(operation.get("content"))}
+                elif action == "update":
+                    record = {"action": action, "id": self.owned_task_id(user_id, operation.get("id"))}
+                    entry = self.pending_entry(record["id"])
+                    if not (entry and entry.added) and record["id"] not in completed:
+                        raise ValueError(f"Task with id {operation.get('id')} not found")
+                elif action == "delete":
+                    record = {"action": action, "id": self.owned_task_id(user_id, operation.get("id"))}
+                else:
+                    results.append(batch_error(f"Unknown action: {action}"))
+                    continue
+            except ValueError as e:
+                results.append(batch_error(e))
+                continue
+
+            self.seq += 1
+            record = {"seq": self.seq, "user_id": user_id, **record}
+            apply_record(self.pending, record)
+            records.append(record)
+            if action == "add":
+                results.append(added_result(Task(id=record["id"], user_id=user_id, content=record["content"])))
+            elif action == "update":
+                entry = self.pending_entry(record["id"])
+                toggled = entry.toggled if entry.added else completed[record["id"]] != entry.toggled
+                results.append({"status": 1, "action": action, "id": operation.get("id"), "completed": toggled})
+            else:
+                results.append({"status": 1, "action": action, "id": operation.get("id")})
+
+        if records:
+            await self.append(records)
+        return results
+
+    def owned_task_id(self, user_id: int, id: Any) -> int:
+        """The action's task id, unless the pending state already says it's gone or someone else's"""
+        try:
+            task_id = int(id)
+        except (TypeError, ValueError):
+            raise ValueError(f"Task with id {id} not found")
+        entry = self.pending.get(task_id) or self.flushing.get(task_id)
+        if entry and (entry.user_id != user_id or entry.deleted):
+            raise ValueError(f"Task with id {id} not found")
+        return task_id
+
+    def pending_entry(self, task_id: int) -> PendingTask | None:
+        """What the acknowledged actions on a task add up to, those being flushed included"""
+        flushing, pending = self.flushing.get(task_id), self.pending.get(task_id)
+        return merge({task_id: flushing} if flushing else {}, {task_id: pending} if pending else {}).get(task_id)
+
+    def stored_completed(self, user_id: int, ids: list[int]) -> dict[int, bool]:
+        """Completion status of those of the given tasks that are stored and the user's"""
+        with self.shard_sessions()[self.shard_of(user_id)]() as session:
+            return dict(session.exec(completed_stmt(user_id, ids)).all())
+
+    async def append(self, records: list[dict]) -> None:
+        fd = self.journal.append(records)
+        if self.fsync:
+            sync = asyncio.ensure_future(run_in_threadpool(os.fsync, fd))
+            self._syncs.add(sync)
+            sync.add_done_callback(self._syncs.discard)
+            # A client going away mustn't cancel a flush of the segment other replies wait on
+            await asyncio.shield(sync)
+
+    async def take_ids(self, count: int) -> range:
+        if not count:
+            return range(0)
+        async with self._ids_lock:
+            if len(self._ids) < count:
+                self._ids = await run_in_threadpool(self.reserve_ids, max(self.id_block, count))
+            ids, self._ids = self._ids[:count], self._ids[count:]
+        return ids
+
+    async def flush(self) -> None:
+        """Commit everything acknowledged so far in one transaction"""
+        async with self._flush_lock:
+            if not self.pending:
+                return
+            self.flushing, self.pending = self.pending, {}
+            seq = self.seq
+            previous = self.journal.rotate(seq + 1)
+            segments = self.journal.closed_segments()
+            if previous:
+                # fsyncs still running on the old segment finish before its file is closed
+                await asyncio.gather(*self._syncs)
+                previous.close()
+
+            self.generation += 1
+            self._idle.clear()
+            try:
+                versions = await run_in_threadpool(self.commit, self.flushing, self.journal.name, seq)
+            except FlushFailed as e:
+                # Back in front of what arrived meanwhile; their segments stay until a flush succeeds
+                self.pending = merge(e.failed, self.pending)
+                failed = e
+            except Exception:
+                self.pending = merge(self.flushing, self.pending)
+                raise
+            else:
+                failed = None
+                self.journal.remove(segments)
+            finally:
+                self.flushing = {}
+                self.generation += 1
+                self._idle.set()
+            for user_id, logged in (failed.versions if failed else versions).items():
+                await broadcaster.publish(user_id, {"status": 1, "action": "synced", "since": logged.start, "version": logged[-1]})
+            if failed:
+                raise failed
+
+    # --- Reads ---
+
+    def has_pending(self, user_id: int) -> bool:
+        return any(entry.user_id == user_id for entry in (*self.pending.values(), *self.flushing.values()))
+
+    async def snapshot(self, user_id: int, fetch: Callable[[Pending], Awaitable[R]]) -> tuple[Pending, R]:
+        """This user's pending changes, and fetch(changes) from the database as of the same flush"""
+        while True:
+            await self._idle.wait()
+            generation = self.generation
+            changes = merge(
+                {id: entry for id, entry in self.flushing.items() if entry.user_id == user_id},
+                {id: entry for id, entry in self.pending.items() if entry.user_id == user_id},
+            )
+            fetched = await fetch(changes)
+            # A flush committing meanwhile may or may not be in what came back
+            if generation == self.generation:
+                return changes, fetched
+
+    async def read(
+        self, user_id: int, fetch: Callable[[int | None, int | None], Awaitable[list[Task]]],
+        after: int | None = None, limit: int | None = None,
+    ) -> list[Task]:
+        """fetch(after, limit) from the database, with this user's pending changes laid over it"""
+        async def fetch_page(changes: Pending) -> tuple[int | None, list[Task]]:
+            # Fetch enough to fill the page after pending deletes drop rows from it
+            extra = sum(entry.deleted for entry in changes.values())
+            fetch_limit = None if limit is None else limit + extra
+            return fetch_limit, await fetch(after, fetch_limit)
+
+        changes, (fetch_limit, tasks) = await self.snapshot(user_id, fetch_page)
+        complete = fetch_limit is None or len(tasks) < fetch_limit
+        return overlay(tasks, changes, after, limit, complete)
+
+    async def counts(
+        self, user_id: int, fetch_counts: Callable[[], Awaitable[dict]],
+        fetch_completed: Callable[[list[int]], Awaitable[dict[int, bool]]],
+    ) -> dict:
+        """The user's stored counts with their pending changes applied"""
+        async def fetch(changes: Pending) -> tuple[dict, dict[int, bool]]:
+            stored = [id for id, change in changes.items() if not change.added]
+            return await fetch_counts(), await fetch_completed(stored) if stored else {}
+
+        changes, (counts, completed) = await self.snapshot(user_id, fetch)
+        return overlay_counts(counts, changes, completed)
+
+    # --- Database ---
+
+    def shard_sessions(self) -> dict[str | None, sessionmaker]:
+        return self.shards.session_factories if self.shards else {None: self.session_factory}
+
+    def shard_of(self, user_id: int) -> str | None:
+        return self.shards.shard_of(user_id) if self.shards else None
+
+    def reserve_ids(self, count: int) -> range:
+        """Move the task id sequence past `count` ids (and past every existing task) and return them"""
+        return reserve_task_ids(self.session_factory, count, list(self.shard_sessions().values()))
+
+    def applied_seq(self, shard: str | None, journal_name: str) -> int:
+        with self.shard_sessions()[shard]() as session:
+            sequence = session.get(Sequence, journal_name)
+            return sequence.value if sequence else 0
+
+    def commit(self, pending: Pending, journal_name: str, seq: int) -> dict[int, range]:
+        """
+        Apply the net pending changes and record `seq` as applied, in one transaction
+        per shard; returns the versions logged per user. Raises FlushFailed with
+        the changes of the shards that didn't commit
+        """
+        by_shard: dict[str | None, Pending] = {}
+        for id, entry in pending.items():
+            by_shard.setdefault(self.shard_of(entry.user_id), {})[id] = entry
+
+        versions, failed, error = {}, {}, None
+        for shard, changes in by_shard.items():
+            try:
+                try:
+                    versions |= self.commit_shard(shard, changes, journal_name, seq)
+                except (IntegrityError, DataError) as e:
+                    logger.warning("Write-behind flush to shard %s was rejected (%s); retrying its changes one at a time", shard, e)
+                    versions |= self.commit_shard(shard, changes, journal_name, seq, one_at_a_time=True)
+            except Exception as e:
+                logger.warning("Write-behind flush to shard %s failed: %s", shard, e)
+                failed |= changes
+                error = e
+        if failed:
+            raise FlushFailed(failed, versions) from error
+        return versions
+
+    def commit_shard(
+        self, shard: str | None, pending: Pending, journal_name: str, seq: int, one_at_a_time: bool = False,
+    ) -> dict[int, range]:
+        """
+        Commit one shard's changes. `one_at_a_time` applies each under its own
+        savepoint and sets aside those the database rejects, still in the one transaction
+        """
+        db_storage = DBStorageHandler(self.shard_sessions()[shard]())
+        try:
+            if not one_at_a_time:
+                added, deleted, toggled = apply_changes(db_storage, pending)
+            else:
+                added, deleted, toggled, rejected = [], [], [], []
+                for id, entry in pending.items():
+                    try:
+                        with db_storage.session.begin_nested():
+                            applied = apply_changes(db_storage, {id: entry})
+                    except (IntegrityError, DataError) as e:
+                        rejected.append({"id": id, "user_id": entry.user_id, "content": entry.content,
+                                         "toggled": entry.toggled, "deleted": entry.deleted, "error": str(e.orig)})
+                        continue
+                    for rows, more in zip((added, deleted, toggled), applied):
+                        rows += more
+                self.set_aside(rejected)
+
+            task_operations = TaskOperations(db_storage)
+            task_operations.record_changes(added, deleted, toggled)
+            db_storage.session.merge(Sequence(name=journal_name, value=seq))
+            return task_operations.commit()
+        except Exception:
+            db_storage.rollback()
+            raise
+        finally:
+            db_storage.close()
+
+    def set_aside(self, rejected: list[dict]) -> None:
+        if not rejected:
+            return
+        logger.error("Setting aside %d write-behind changes the database rejects, in %s", len(rejected), self.directory / "rejected.log")
+        with open(self.directory / "rejected.log", "a") as file:
+            file.writelines(json.dumps(change) + "\n" for change in rejected)
+
+
+def apply_changes(db_storage: DBStorageHandler, pending: Pending) -> tuple[list[Task], list[Task], list[Task]]:
+    """Run the net pending changes without committing; returns the tasks added, deleted and toggled"""
+    rows = [
+        {"id": id, "user_id": entry.user_id, "content": entry.content, "completed": entry.toggled}
+        for id, entry in pending.items() if entry.added
+    ]
+    added = db_storage.bulk_insert(Task, rows, commit=False)
+    deleted, toggled = [], []
+
+    by_user = sorted((entry.user_id, id, entry) for id, entry in pending.items() if not entry.added)
+    for user_id, group in groupby(by_user, key=lambda item: item[0]):
+        group = list(group)
+        deleted_ids = [id for _, id, entry in group if entry.deleted]
+        toggled_ids = [id for _, id, entry in group if entry.toggled and not entry.deleted]
+        if deleted_ids:
+            deleted += db_storage.delete_rows(Task, Task.user_id == user_id, Task.id.in_(deleted_ids), commit=False)
+        if toggled_ids:
+            toggled += db_storage.update_where(Task, TOGGLE_COMPLETED, Task.user_id == user_id, Task.id.in_(toggled_ids), commit=False)
+    return added, deleted, toggled
+
+
+task_content_adapter = TypeAdapter(TaskContent)
+
+
+def update_ids(operations: list[dict]) -> list[int]:
+    ids = set()
+    for operation in operations:
+        if operation.get("action") == "update":
+            try:
+                ids.add(int(operation.get("id")))
+            except (TypeError, ValueError):
+                pass
+    return sorted(ids)
+
+
+def task_content(content: Any) -> str:
+    # Checked now, against the limits the protocol holds every add to, as a row the database rejects would fail every flush after it
+    try:
+        return task_content_adapter.validate_python(content, strict=True)
+    except ValidationError:
+        raise ValueError("Invalid task content")
+
+
+class WriteBehindTaskOperations:
+    """AsyncTaskOperations whose batches go through the write-behind queue, and whose reads see it"""
+
+    def __init__(self, task_operations: AsyncTaskOperations, write_behind: WriteBehind):
+        self.task_operations = task_operations
+        self.write_behind = write_behind
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.task_operations, name)
+
+    async def apply_batch(self, user_id: int, operations: list[dict]) -> list[dict]:
+        results = []
+        for is_clear, group in groupby(operations, key=lambda operation: operation.get("action") == "clear_completed"):
+            if is_clear:
+                # Which tasks are completed is up to the database once everything acknowledged before is in it
+                await self.write_behind.flush()
+                results += await self.task_operations.apply_batch(user_id, list(group))
+            else:
+                results += await self.write_behind.apply_batch(user_id, list(group))
+        return results
+
+    async def get_user_tasks(self, user_id: int, after: int | None = None, limit: int | None = None) -> list[Task]:
+        async def fetch(after: int | None, limit: int | None) -> list[Task]:
+            return await self.task_operations.get_user_tasks(user_id, after=after, limit=limit)
+
+        return await self.write_behind.read(user_id, fetch, after=after, limit=limit)
+
+    async def import_rows(self, user_id: int, rows: list[dict]) -> int:
+        # Ids from the reserved blocks, or a later flush would collide with them
+        ids = await self.write_behind.take_ids(len(rows))
+        return await self.task_operations.import_rows(user_id, [{**row, "id": id} for row, id in zip(rows, ids)])
+
+    async def get_counts(self, user_id: int) -> dict:
+        async def fetch_completed(ids: list[int]) -> dict[int, bool]:
+            return await self.task_operations.get_completed(user_id, ids)
+
+        return await self.write_behind.counts(user_id, lambda: self.task_operations.get_counts(user_id), fetch_completed)
+
+    async def get_changes(self, user_id: int, since: int) -> tuple[int, list[TaskChange]] | None:
+        # Pending actions aren't logged until they commit
+        if self.write_behind.has_pending(user_id):
+            await self.write_behind.flush()
+        return await self.task_operations.get_changes(user_id, since)
+
+    async def get_page(self, user_id: int, limit: int) -> tuple[int, list[Task], dict]:
+        # Read together with the version, which pending actions don't have yet
+        if self.write_behind.has_pending(user_id):
+            await self.write_behind.flush()
+        return await self.task_operations.get_page(user_id, limit)
+
+    async def get_snapshot(self, user_id: int, limit: int) -> tuple[int, list[Task]]:
+        if self.write_behind.has_pending(user_id):
+            await self.write_behind.flush()
+        return await self.task_operations.get_snapshot(user_id, limit)
+
+    async def get_user_tasks_version(self, user_id: int) -> str | None:
+        # The version moves when a flush commits; until then the page differs from it
+        if self.write_behind.has_pending(user_id):
+            return None
+        return await self.task_operations.get_user_tasks_version(user_id)
+
+
+write_behind = WriteBehind(Path(WRITE_BEHIND_DIR)) if WRITE_BEHIND_DIR else None
+
+
+def with_write_behind(task_operations: AsyncTaskOperations) -> AsyncTaskOperations:
+    if write_behind is None:
+        return task_operations
+    return WriteBehindTaskOperations(task_operations, write_behind)
+
+
+def get_task_operations(task_operations: AsyncTaskOperationsDep) -> AsyncTaskOperations:
+    """AsyncTaskOperationsDep, through the write-behind queue when it is enabled"""
+    return with_write_behind(task_operations)
+
+
+@asynccontextmanager
+async def open_task_operations() -> AsyncIterator[AsyncTaskOperations]:
+    """A unit of work outside a request's dependencies, such as one round of websocket messages"""
+    async with open_async_task_operations() as task_operations:
+        yield with_write_behind(task_operations)
+
+WriteBehindTaskOperationsDep = Annotated[AsyncTaskOperations, Depends(get_task_operations)]
@@ -0,0 +1,40 @@
+# src/server/app.py
+
+"""
+App factory for uvicorn:
+
+    uvicorn --factory src.server.app:create_app
+
+(`uvicorn src.server.server:app`, from before, still works: that module
+builds one with create_app the first time `app` is looked up.)
+
+Importing this module loads none of the app, so create_app times the import
+of src.server.server, most of a worker's start (the database engines are
+created as the storage module loads), as the first startup phase. Each call
+builds a new app from the routers, middleware and static files; the phases
+are logged once startup finishes and served at /stats/startup.
+"""
+
+from typing import TYPE_CHECKING
+
+from src.common.profiling import startup_times
+
+if TYPE_CHECKING:
+    from fastapi import FastAPI
+
+
+def create_app() -> "FastAPI":
+    with startup_times.phase("import"):
+        from fastapi import FastAPI
+        from starlette.middleware.sessions import SessionMiddleware
+        from src.common.instrumentation import InstrumentationMiddleware
+        from src.server import assets, server
+        from src.server.routers import auth
+
+    app = FastAPI(lifespan=server.lifespan)
+    app.include_router(auth.router)
+    app.add_middleware(SessionMiddleware, secret_key="super-secret-key")
+    app.add_middleware(InstrumentationMiddleware)
+    app.mount("/static", assets.AssetFiles(directory=assets.ASSETS_DIR, check_dir=False), name="static")
+    app.include_router(server.router)
+    return app
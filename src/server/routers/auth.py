@@ -2,47 +2,51 @@
 
 from fastapi import APIRouter, Request, Depends
 from fastapi.responses import RedirectResponse
-from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 from sqlmodel import Session
 from typing import Annotated
 from src.common.db_storage import get_session
 from src.common.schemes import LoginForm, RegisterForm
-from src.modules.auth_operations import login_user, register_user, get_current_user
+from src.modules.auth_operations import (
+    Identity, login_user, register_user, get_current_identity, start_session, revoke_sessions, check_rate_limits,
+)
+from src.server.templating import templates
 
 
-templates = Jinja2Templates(directory="templates")
 router = APIRouter()
 
 DBSession = Annotated[Session, Depends(get_session)]
+CurrentIdentity = Annotated[Identity | None, Depends(get_current_identity)]
 
 @router.get("/login")
-async def login_get(request: Request, db_session=Depends(get_session)):
-    if get_current_user(request, db_session):
+async def login_get(request: Request, identity: CurrentIdentity):
+    if identity:
         return RedirectResponse(url="/tasks", status_code=302)
     return templates.TemplateResponse("login.html", {"request": request})
 
 @router.post("/login")
 async def login_post(request: Request, db_session: DBSession, form: LoginForm):
-    user = login_user(request, db_session, form)
+    await check_rate_limits(request, "login", form.username)
+    user = await login_user(request, db_session, form)
 
     if not user:
         return templates.TemplateResponse("login.html", {"request": request, "error": "Invalid username or password"}, status_code=400)
 
-    request.session.clear()
-    request.session["user_id"] = user.id
+    start_session(request, user)
     return RedirectResponse(url="/tasks", status_code=302)
 
 
 
 @router.get("/register")
-async def register_get(request: Request, db_session=Depends(get_session)):
-    if get_current_user(request, db_session):
+async def register_get(request: Request, identity: CurrentIdentity):
+    if identity:
         return RedirectResponse(url="/", status_code=302)
     return templates.TemplateResponse("register.html", {"request": request})
 
 @router.post("/register")
 async def register_post(request: Request, db_session: DBSession, form: RegisterForm):
-    register_user(request, db_session, form)
+    await check_rate_limits(request, "register", form.username)
+    await register_user(request, db_session, form)
     return RedirectResponse(url="/login", status_code=302)
 
 
@@ -50,4 +54,11 @@ async def register_post(request: Request, db_session: DBSession, form: RegisterF
 @router.get("/logout")
 async def logout(request: Request):
     request.session.clear()
+    return RedirectResponse(url="/login", status_code=302)
+
+@router.post("/logout/all")
+async def logout_all(request: Request, db_session: DBSession, identity: CurrentIdentity):
+    if identity:
+        await run_in_threadpool(revoke_sessions, db_session, identity.id)
+    request.session.clear()
     return RedirectResponse(url="/login", status_code=302)
\ No newline at end of file
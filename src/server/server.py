@@ -1,69 +1,378 @@
 import os
+import asyncio
+import logging
+from dataclasses import asdict
+from itertools import groupby
 from contextlib import asynccontextmanager
-from starlette.middleware.sessions import SessionMiddleware
-from fastapi import FastAPI, Request, Depends, WebSocket
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import RedirectResponse
-
-from src.common.db_storage import create_db_and_tables
-from src.common.models import Task, User
-from src.modules.task_operations import TaskOperationsDep
-from src.modules.auth_operations import get_current_user, hash_password
-from src.server.routers import auth
+from typing import Annotated, Literal
+from fastapi import APIRouter, FastAPI, Request, Depends, HTTPException, Query, WebSocket
+from starlette.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse, PlainTextResponse, Response
+
+from src.common.migrations import MIGRATE_ON_STARTUP, run_all_migrations
+import src.common.cache as caching
+from src.common.instrumentation import metrics, request_scope
+from src.common.profiling import PROFILE_MAX_S, PROFILER_ENABLED, ProfilerBusy, profiler, startup_times
+from src.common.broadcast import Connection, broadcaster
+from src.common.db_storage import shard_router
+from src.common.protocol import (
+    BatchMessage, JSONCodec, Message, MessagePackCodec, PageMessage, ProtocolError, SearchQuery, SyncMessage, WriteMessage,
+    negotiate, parse_frame,
+)
+from src.common.models import Task
+from src.modules.task_operations import (
+    AsyncTaskOperations, TASK_COUNT_RECONCILE_S, TASK_LOG_COMPACT_S, batch_error, change_reply, keep_counts_reconciled,
+    keep_task_log_compacted,
+)
+from src.modules.task_transfer import MEDIA_TYPES, export_tasks, import_tasks, upload_format
+from src.modules.write_behind import WriteBehindTaskOperationsDep, open_task_operations, write_behind
+from src.modules.auth_operations import Identity, get_current_identity, require_admin, revocations, session_identity, hash_password
+from src.server import assets, templating
+
+logger = logging.getLogger("simplist.server")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    create_db_and_tables()
+    if MIGRATE_ON_STARTUP:
+        with startup_times.phase("migrations"):
+            run_all_migrations()
+    with startup_times.phase("assets"):
+        assets.ensure_built()
+    with startup_times.phase("templates"):
+        templating.precompile()
+    revocation_refresh = asyncio.create_task(revocations.keep_fresh())
+    if shard_router:
+        # Before the write-behind replay, which routes by them
+        with startup_times.phase("shard placements"):
+            shard_router.refresh()
+        placement_refresh = asyncio.create_task(shard_router.keep_fresh())
+    if TASK_COUNT_RECONCILE_S:
+        reconciler = asyncio.create_task(keep_counts_reconciled())
+    if TASK_LOG_COMPACT_S:
+        compactor = asyncio.create_task(keep_task_log_compacted())
+    if write_behind:
+        with startup_times.phase("write-behind replay"):
+            write_behind.start()
+        flusher = asyncio.create_task(write_behind.run())
+    logger.info("Started in %s", startup_times.report())
     yield
+    revocation_refresh.cancel()
+    if shard_router:
+        placement_refresh.cancel()
+    if TASK_COUNT_RECONCILE_S:
+        reconciler.cancel()
+    if TASK_LOG_COMPACT_S:
+        compactor.cancel()
+    if write_behind:
+        flusher.cancel()
+        await write_behind.close()
+    await broadcaster.close()
 
 
-app = FastAPI(lifespan=lifespan)
-app.include_router(auth.router)
-app.add_middleware(SessionMiddleware, secret_key="super-secret-key")
-
-# BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname((os.path.abspath(__file__)))))
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
+# The app's own routes; src.server.app:create_app puts them together with the auth routes, middleware and static files
+router = APIRouter()
 
-@app.get("/")
-async def root(request: Request, user: User=Depends(get_current_user)):
+@router.get("/")
+async def root(request: Request, user: Identity=Depends(get_current_identity)):
     if user:
         return RedirectResponse(url="/tasks", status_code=302)
     return RedirectResponse(url="/login", status_code=302)
 
-@app.get("/tasks")
-async def tasks(request: Request, task_operations: TaskOperationsDep, user: User=Depends(get_current_user)):
+@router.get("/tasks")
+async def tasks(request: Request, task_operations: WriteBehindTaskOperationsDep, user: Identity=Depends(get_current_identity)):
     if not user:
         return RedirectResponse(url="/login", status_code=302)
-    tasks = task_operations.get_user_tasks(user.id)
 
-    return templates.TemplateResponse(
-        request=request, name="index.html", context={"tasks":tasks, "user": user}
-    )
+    # Taken before the query, so a write racing it changes the version after
+    version = await task_operations.get_user_tasks_version(user.id)
+    headers = {"Cache-Control": "private, no-cache"}
+    if version:
+        headers["ETag"] = f'"{user.id}-{version}-{templating.fingerprint}"'
+        if headers["ETag"] in if_none_match(request):
+            return Response(status_code=304, headers=headers)
+
+    # Read from one session, the log version first: the page may be newer than it says, which the client's sync replays harmlessly
+    log_version, tasks, counts = await task_operations.get_page(user.id, TASKS_PAGE_SIZE)
+    context = {
+        "request": request, "tasks": tasks, "counts": counts, "user": user,
+        "next_cursor": next_cursor(tasks, TASKS_PAGE_SIZE), "log_version": log_version,
+    }
+    return StreamingResponse(templating.stream_template("index.html", context), media_type="text/html", headers=headers)
+
+@router.get("/tasks.ndjson")
+async def tasks_ndjson(user: Identity=Depends(get_current_identity)):
+    return await export_response(user, "ndjson")
+
+@router.get("/tasks.csv")
+async def tasks_csv(user: Identity=Depends(get_current_identity)):
+    return await export_response(user, "csv")
+
+async def export_response(user: Identity | None, format: str) -> Response:
+    if not user:
+        return RedirectResponse(url="/login", status_code=302)
+
+    if write_behind and write_behind.has_pending(user.id):
+        # Streamed straight from the database, so commit what it hasn't seen yet
+        await write_behind.flush()
+
+    headers = {"Content-Disposition": f'attachment; filename="tasks.{format}"'}
+    return StreamingResponse(export_tasks(user.id, format), media_type=MEDIA_TYPES[format], headers=headers)
+
+
+@router.post("/tasks/import")
+async def tasks_import(
+    request: Request, task_operations: WriteBehindTaskOperationsDep,
+    format: Literal["csv", "ndjson"] | None = None, user: Identity=Depends(get_current_identity),
+):
+    """Upload a CSV or NDJSON body (Content-Type text/csv or application/x-ndjson, or ?format=)"""
+    if not user:
+        return RedirectResponse(url="/login", status_code=302)
+
+    format = format or upload_format(request.headers.get("content-type"))
+    if format is None:
+        return JSONResponse({"detail": "Send text/csv or application/x-ndjson"}, status_code=415)
+
+    async def insert(rows: list[dict]) -> int:
+        return await task_operations.import_rows(user.id, rows)
+
+    report = await import_tasks(request.stream(), format, insert)
+    if report.imported:
+        # Not in the change log, so the user's open tabs sync and get a snapshot
+        counts = await task_operations.get_counts(user.id)
+        await broadcaster.publish(user.id, {"status": 1, "action": "stale", "counts": counts})
+    return JSONResponse(asdict(report), status_code=400 if report.error else 200)
+
+
+@router.get("/tasks/search")
+async def tasks_search(
+    task_operations: WriteBehindTaskOperationsDep, query: Annotated[SearchQuery, Query()],
+    user: Identity=Depends(get_current_identity),
+):
+    if not user:
+        return RedirectResponse(url="/login", status_code=302)
+    return await search_reply(task_operations, user.id, query)
 
     
-@app.websocket("/ws")
-async def ws_task_actions(websocket: WebSocket, task_operations: TaskOperationsDep):
-    await websocket.accept()
+@router.get("/stats/cache")
+async def cache_stats():
+    if not caching.default_cache:
+        return {"enabled": False}
+    return {"enabled": True, **asdict(caching.default_cache.stats)}
+
+
+@router.get("/stats/startup")
+async def startup_stats():
+    return {"seconds": startup_times.total, "phases": startup_times.phases}
+
+
+def profiler_enabled():
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
+@router.get("/debug/profile", dependencies=[Depends(profiler_enabled)])
+async def debug_profile(
+    seconds: Annotated[float, Query(gt=0, le=PROFILE_MAX_S)] = 10, idle: bool = False,
+    admin: Identity = Depends(require_admin),
+):
+    """
+    Sample every thread for `seconds` and return the stacks collapsed, for
+    flamegraph.pl or speedscope; `idle` keeps threads waiting for work
+    """
+    try:
+        profile = await run_in_threadpool(profiler.capture, seconds, idle)
+    except ProfilerBusy as e:
+        return JSONResponse({"detail": str(e)}, status_code=409)
+    logger.info("User %s profiled the worker for %gs (%d samples)", admin.id, seconds, profile.samples)
+    return PlainTextResponse(profile.collapsed(), headers={"X-Profile-Samples": str(profile.samples)})
+
+
+@router.get("/metrics")
+async def prometheus_metrics():
+    cache_stats = asdict(caching.default_cache.stats) if caching.default_cache else {}
+    extra = {f"simplist_cache_{name}_total": value for name, value in cache_stats.items()}
+    return PlainTextResponse(metrics.render(extra), media_type="text/plain; version=0.0.4")
+
+
+# Tasks rendered with /tasks and returned per "page" request; the rest load on scroll
+TASKS_PAGE_SIZE = int(os.getenv("TASKS_PAGE_SIZE", "100"))
+
+def next_cursor(tasks: list[Task], limit: int) -> int | None:
+    return tasks[-1].id if len(tasks) == limit else None
+
+
+def if_none_match(request: Request) -> list[str]:
+    return [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+
+
+# Messages already queued (or arriving within the window) are applied as one transaction
+WS_COALESCE_WINDOW = float(os.getenv("WS_COALESCE_WINDOW_MS", "0")) / 1000
+WS_MAX_COALESCED = int(os.getenv("WS_MAX_COALESCED", "500"))
+
+@router.websocket("/ws")
+async def ws_task_actions(websocket: WebSocket):
+    """
+    Task actions and reads for one socket. Each round of messages gets its own
+    session, so idle sockets hold no database connection
+    """
+    codec, subprotocol = negotiate(websocket.scope.get("subprotocols", []))
+    await websocket.accept(subprotocol=subprotocol)
+    identity = session_identity(websocket.session)
+    if identity is None:
+        # Signed out, or the session was revoked: 1008 tells the client to log in again rather than reconnect
+        await websocket.close(code=1008)
+        return
+    user_id = identity.id
+    connection = Connection(websocket, codec=codec)
+    connection.start()
+    inbox: asyncio.Queue = asyncio.Queue()
+    reader = asyncio.create_task(read_frames(websocket, codec, inbox))
     try:
-        while True:
-            data = await websocket.receive_json()
-            action = data.get("action")
+        await broadcaster.join(user_id, connection)
+        while (messages := await next_messages(inbox)) is not None:
+            async with open_task_operations() as task_operations:
+                for is_write, group in groupby(messages, key=lambda message: isinstance(message, WriteMessage)):
+                    if is_write:
+                        group = list(group)
+                        with request_scope(ws_tag(group)):
+                            await apply_messages(connection, task_operations, user_id, group)
+                    else:
+                        for message in group:
+                            await connection.send(await read_reply(task_operations, user_id, message))
+    except ConnectionError:
+        # Dropped as a slow consumer; the client reconnects and syncs
+        pass
+    except Exception:
+        logger.exception("Websocket handler failed")
+    finally:
+        reader.cancel()
+        connection.stop()
+        await broadcaster.leave(user_id, connection)
+
+
+def ws_tag(messages: list[WriteMessage]) -> str:
+    actions = {message.action for message in messages}
+    return f"ws:{actions.pop()}" if len(actions) == 1 else "ws:batch"
+
+
+async def apply_messages(connection: Connection, task_operations: AsyncTaskOperations, user_id: int, messages: list[WriteMessage]):
+    operations = [operation.model_dump() for message in messages for operation in message_operations(message)]
+    results = await task_operations.apply_batch(user_id, operations)
+    # Every reply carries the counts as of the whole round, read from the user's summary row
+    counts = await task_operations.get_counts(user_id)
+
+    replies = iter(results)
+    for message in messages:
+        if isinstance(message, BatchMessage):
+            batch = [next(replies) for _ in message_operations(message)]
+            await connection.send({"status": 1, "action": "batch", "results": batch, "counts": counts})
+        else:
+            await connection.send({**next(replies), "counts": counts})
+
+    # The user's other tabs, in this worker or another, apply what went through
+    changes = [result for result in results if result["status"] == 1]
+    if changes:
+        await broadcaster.publish(user_id, {"status": 1, "action": "changes", "results": changes, "counts": counts}, origin=connection)
+
+
+async def read_reply(task_operations: AsyncTaskOperations, user_id: int, message: Message | ProtocolError) -> dict:
+    if isinstance(message, ProtocolError):
+        return batch_error(message)
+    with request_scope(f"ws:{message.action}"):
+        reply = await READ_REPLIES[message.action](task_operations, user_id, message)
+        reply["counts"] = await task_operations.get_counts(user_id)
+    return reply
+
+
+async def page_reply(task_operations: AsyncTaskOperations, user_id: int, message: PageMessage) -> dict:
+    limit = min(message.limit or TASKS_PAGE_SIZE, TASKS_PAGE_SIZE)
+    tasks = await task_operations.get_user_tasks(user_id, after=message.after, limit=limit)
+    return {
+        "status": 1,
+        "action": "page",
+        "tasks": [task.model_dump(include={"id", "content", "completed"}) for task in tasks],
+        "next": next_cursor(tasks, limit),
+    }
+
+
+async def search_reply(task_operations: AsyncTaskOperations, user_id: int, query: SearchQuery) -> dict:
+    limit = min(query.limit or TASKS_PAGE_SIZE, TASKS_PAGE_SIZE)
+    tasks = await task_operations.search(user_id, query.q, query.completed, limit, query.offset)
+    return {
+        "status": 1,
+        "action": "search",
+        "q": query.q,
+        "offset": query.offset,
+        "tasks": [task.model_dump(include={"id", "content", "completed"}) for task in tasks],
+        "next": query.offset + limit if len(tasks) == limit else None,
+    }
+
+
+async def sync_reply(task_operations: AsyncTaskOperations, user_id: int, message: SyncMessage) -> dict:
+    """The changes after the client's version, or the first page to start over from when the log no longer has them"""
+    log = await task_operations.get_changes(user_id, message.version)
+    if log is not None:
+        version, changes = log
+        return {"status": 1, "action": "sync", "version": version, "changes": [change_reply(change) for change in changes]}
+
+    version, tasks = await task_operations.get_snapshot(user_id, TASKS_PAGE_SIZE)
+    return {
+        "status": 1,
+        "action": "snapshot",
+        "version": version,
+        "tasks": [task.model_dump(include={"id", "content", "completed"}) for task in tasks],
+        "next": next_cursor(tasks, TASKS_PAGE_SIZE),
+    }
+
+
+# Websocket actions answered with a read, rather than applied as writes
+READ_REPLIES = {"page": page_reply, "search": search_reply, "sync": sync_reply}
+
+
+async def read_frames(websocket: WebSocket, codec: JSONCodec | MessagePackCodec, inbox: asyncio.Queue):
+    """Validate each frame as it arrives; ones that don't parse queue their error, to be answered in turn"""
+    try:
+        while (message := await websocket.receive())["type"] != "websocket.disconnect":
+            frame = message["text"] if message.get("text") is not None else message["bytes"]
             try:
-                if action == "add":
-                    task: Task = task_operations.add({"content": data.get("content"), "user_id": websocket.session.get("user_id")})
-                    await websocket.send_json({"status": 1, "action": "add", "id": task.id})
-                elif action == "delete":
-                    task_operations.delete(data.get("id"))
-                    await websocket.send_json({"status": 1, "action": "delete", "id": data.get("id")})
-                elif action == "update":
-                    task_operations.change_status(data.get("id"))
-                    await websocket.send_json({"status": 1, "action": "update", "id": data.get("id")})
-                else:
-                    await websocket.send_json({"status": 0, "error": f"Unknown action: {action}"})
-            except Exception as e:
-                await websocket.send_json({"status": 0, "action": "error", "error": str(e)})
-    except:
-        print("Client disconnected")
-    
\ No newline at end of file
+                inbox.put_nowait(parse_frame(codec, frame))
+            except ProtocolError as e:
+                inbox.put_nowait(e)
+    finally:
+        inbox.put_nowait(None)
+
+
+async def next_messages(inbox: asyncio.Queue) -> list[Message | ProtocolError] | None:
+    """Wait for a message, then take whatever else has queued up behind it"""
+    message = await inbox.get()
+    if message is None:
+        return None
+    if WS_COALESCE_WINDOW:
+        await asyncio.sleep(WS_COALESCE_WINDOW)
+
+    messages = [message]
+    while len(messages) < WS_MAX_COALESCED and not inbox.empty():
+        message = inbox.get_nowait()
+        if message is None:
+            # Finish this round, the reader is gone so the next one stops
+            inbox.put_nowait(None)
+            break
+        messages.append(message)
+    return messages
+
+
+def message_operations(message: WriteMessage) -> list[WriteMessage]:
+    if isinstance(message, BatchMessage):
+        return message.operations
+    return [message]
+
+
+def __getattr__(name: str):
+    # src.server.server:app, the entry point from before create_app; built on first use, so that
+    # importing this module (create_app does) builds nothing
+    if name == "app":
+        global app
+        from src.server.app import create_app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
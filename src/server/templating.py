@@ -0,0 +1,64 @@
+# src/server/templating.py
+
+import os
+import hashlib
+from collections.abc import AsyncIterator
+
+import jinja2
+from fastapi.templating import Jinja2Templates
+
+from src.server import assets
+
+# Re-read templates whose files changed; off by default, as they're compiled once at startup
+TEMPLATES_AUTO_RELOAD = os.getenv("TEMPLATES_AUTO_RELOAD", "0") == "1"
+# Rendered HTML gathered before a streamed chunk goes out
+TEMPLATE_CHUNK_SIZE = int(os.getenv("TEMPLATE_CHUNK_SIZE", str(16 * 1024)))
+
+templates = Jinja2Templates(env=jinja2.Environment(
+    loader=jinja2.FileSystemLoader("templates"),
+    autoescape=True,
+    auto_reload=TEMPLATES_AUTO_RELOAD,
+))
+
+
+@jinja2.pass_context
+def url_for(context: dict, name: str, /, **path_params) -> str:
+    """Starlette's url_for, sending static paths to their fingerprinted names"""
+    if name == "static" and "path" in path_params:
+        path_params["path"] = assets.asset_path(path_params["path"])
+    return context["request"].url_for(name, **path_params)
+
+templates.env.globals["url_for"] = url_for
+
+# Same loader and globals, compiled for generate_async. Its own cache, since
+# copying the sync one would hand it templates compiled for the wrong mode.
+async_env = templates.env.overlay(enable_async=True, cache_size=400)
+
+# Hash of the template sources and asset build, part of page ETags so new markup isn't answered with 304
+fingerprint = ""
+
+
+def precompile() -> str:
+    """Compile every template for both environments and fingerprint their sources"""
+    global fingerprint
+    digest = hashlib.sha256(assets.manifest["source"].encode())
+    for name in templates.env.list_templates():
+        source, _, _ = templates.env.loader.get_source(templates.env, name)
+        digest.update(source.encode())
+        templates.env.get_template(name)
+        async_env.get_template(name)
+    fingerprint = digest.hexdigest()[:12]
+    return fingerprint
+
+
+async def stream_template(name: str, context: dict, chunk_size: int = TEMPLATE_CHUNK_SIZE) -> AsyncIterator[str]:
+    """Render with generate_async, yielding roughly chunk_size characters at a time"""
+    buffer, size = [], 0
+    async for piece in async_env.get_template(name).generate_async(context):
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
@@ -2,8 +2,35 @@ const tasksContainer = document.getElementById("list-tasks");
 const addTaskButton = document.getElementById('add-task-btn');
 const taskContentInput = document.getElementById('task-content');
 const noTasksMessage = document.getElementById("no-tasks-msg");
+const countOpen = document.getElementById("count-open");
+const countCompleted = document.getElementById("count-completed");
 
-const socket = new WebSocket("ws://" + window.location.host + "/ws");
+const clearCompletedButton = document.getElementById("clear-completed-btn");
+const listEnd = document.getElementById("list-end");
+
+const searchInput = document.getElementById("search-query");
+const searchResults = document.getElementById("search-results");
+const searchEnd = document.getElementById("search-end");
+
+let socket = null;
+let reconnectDelay = 500;
+const MAX_RECONNECT_DELAY = 10000;
+
+// Change log version the list is at; sent on (re)connecting to get what happened since
+let version = Number(tasksContainer.dataset.version || 0);
+let syncRequested = false;
+
+// Operations queued during the current tick (or while disconnected), sent together as one batch
+let pendingOperations = [];
+
+// Id of the last task rendered so far; empty once the whole list is loaded
+let nextCursor = tasksContainer.dataset.nextCursor;
+let pageRequested = false;
+
+// Offset of the next page of search results; null once they're all shown
+let searchNext = null;
+let searchRequested = false;
+let searchTimer = null;
 
 // Add event to button for adding a task
 addTaskButton.addEventListener('click', function(){
@@ -14,6 +41,25 @@ addTaskButton.addEventListener('click', function(){
 }, false);
 
 
+// Pasting several lines adds one task per line in a single batch
+taskContentInput.addEventListener("paste", function(event) {
+    const lines = event.clipboardData.getData("text").split(/\r?\n/)
+        .map(line => line.trim())
+        .filter(line => line.length >= 3);
+
+    if (lines.length > 1) {
+        event.preventDefault();
+        lines.forEach(line => ws_addTask(line));
+    }
+});
+
+
+// Remove every completed task, including those on pages not loaded yet
+clearCompletedButton.addEventListener("click", function() {
+    queueOperation({action: "clear_completed"});
+});
+
+
 // Add event to input for adding a task on Enter key press
 taskContentInput.addEventListener("keyup", function(event) {
     event.preventDefault();
@@ -23,10 +69,61 @@ taskContentInput.addEventListener("keyup", function(event) {
 });
 
 
+// Load the next page when the end of the list scrolls into view
+const listEndObserver = new IntersectionObserver(function(entries) {
+    if (entries[0].isIntersecting) {
+        ws_requestPage();
+    }
+});
+
+// Search as the user types, once they pause
+searchInput.addEventListener("input", function() {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => ws_search(0), 200);
+});
+
+const searchEndObserver = new IntersectionObserver(function(entries) {
+    if (entries[0].isIntersecting && searchNext !== null && !searchRequested) {
+        ws_search(searchNext);
+    }
+});
+
+function connect() {
+    socket = new WebSocket("ws://" + window.location.host + "/ws");
+
+    socket.addEventListener("open", function() {
+        reconnectDelay = 500;
+        syncRequested = pageRequested = searchRequested = false;
+        ws_sync();
+        flushOperations();
+        listEndObserver.observe(listEnd);
+        searchEndObserver.observe(searchEnd);
+    });
+
+    // Dropped (for falling behind on updates, say) or the server went away: reconnect and sync
+    socket.addEventListener("close", function(event) {
+        // 1008: the session is gone, so reconnecting would only be refused again
+        if (event.code === 1008) {
+            window.location.href = "/login";
+            return;
+        }
+        setTimeout(connect, reconnectDelay);
+        reconnectDelay = Math.min(reconnectDelay * 2, MAX_RECONNECT_DELAY);
+    });
+
+    socket.addEventListener("message", handleMessage);
+}
+
+connect();
+
+
 // Create task element
-function createTask(content) {
+function createTask(content, completed = false) {
     const taskDiv = document.createElement("div");
     taskDiv.classList.add("task");
+    if (completed) {
+        taskDiv.classList.add("task-completed");
+    }
     taskDiv.addEventListener("click", function() {
         ws_updateTask(this);
     });
@@ -40,7 +137,7 @@ function createTask(content) {
     });
     const img = document.createElement("img");
     img.classList.add("icon");
-    img.src = "/static/icons/trash.png";
+    img.src = tasksContainer.dataset.trashIcon;
     img.alt = "delete task";
 
     button.appendChild(img);
@@ -50,6 +147,67 @@ function createTask(content) {
     return taskDiv;
 }
 
+// Queue an operation; everything queued in the same tick goes out in one frame
+function queueOperation(operation) {
+    pendingOperations.push(operation);
+    if (pendingOperations.length === 1) {
+        setTimeout(flushOperations, 0);
+    }
+}
+
+function flushOperations() {
+    if (socket.readyState !== WebSocket.OPEN) {
+        // Sent once the socket reconnects
+        return;
+    }
+    const operations = pendingOperations;
+    pendingOperations = [];
+
+    if (operations.length === 1) {
+        socket.send(JSON.stringify(operations[0]));
+    } else if (operations.length > 1) {
+        socket.send(JSON.stringify({action: "batch", operations: operations}));
+    }
+}
+
+// Ask for the tasks after the last one rendered
+function ws_requestPage() {
+    if (!nextCursor || pageRequested || socket.readyState !== WebSocket.OPEN) {
+        return;
+    }
+    pageRequested = true;
+
+    socket.send(JSON.stringify({action: "page", after: Number(nextCursor)}));
+}
+
+// Search the user's tasks; the full list is hidden while there's a query
+function ws_search(offset) {
+    const query = searchInput.value.trim();
+    const searching = query.length > 0;
+    tasksContainer.style.display = searching ? "none" : "";
+    searchResults.style.display = searching ? "" : "none";
+
+    if (!searching) {
+        searchResults.replaceChildren();
+        searchNext = null;
+        return;
+    }
+    if (socket.readyState !== WebSocket.OPEN) {
+        return;
+    }
+    searchRequested = true;
+    socket.send(JSON.stringify({action: "search", q: query, offset: offset}));
+}
+
+// Ask for the changes after `version`; answered with "sync", or "snapshot" when the server's log no longer has them
+function ws_sync() {
+    if (syncRequested || socket.readyState !== WebSocket.OPEN) {
+        return;
+    }
+    syncRequested = true;
+    socket.send(JSON.stringify({action: "sync", version: version}));
+}
+
 // Function to send task content to the server
 function ws_addTask(taskContent) {
     const data = {
@@ -57,7 +215,7 @@ function ws_addTask(taskContent) {
         content: taskContent,
     };
 
-    socket.send(JSON.stringify(data));
+    queueOperation(data);
 }
 
 // Function to handle task deletion from the server
@@ -67,7 +225,7 @@ function ws_deleteTask(element){
         id: element.parentNode.getAttribute("id"),
     };
 
-    socket.send(JSON.stringify(data));
+    queueOperation(data);
 }
 
 // Function to handle task status update on the server
@@ -77,66 +235,176 @@ function ws_updateTask(element) {
         id: element.getAttribute("id"),
     };
 
-    socket.send(JSON.stringify(data));
+    queueOperation(data);
 }
 
 // Websocket message handler
-socket.onmessage = function(event) {
+function handleMessage(event) {
     const parsedData = JSON.parse(event.data);
 
-    if (!parsedData.status === 0) {
+    if (parsedData.action === "batch") {
+        parsedData.results.forEach(handleResult);
+    } else if (parsedData.action === "changes") {
+        // Made in another tab; apply without touching this tab's input
+        parsedData.results.forEach(result => handleResult(result, true));
+    } else if (parsedData.action === "sync") {
+        handleSync(parsedData);
+    } else if (parsedData.action === "snapshot") {
+        handleSnapshot(parsedData);
+    } else if (parsedData.action === "synced") {
+        // Changes this tab already applied were committed under these versions
+        advanceVersion(parsedData.since, parsedData.version);
+    } else if (parsedData.action === "stale") {
+        // Changed in a way the log can't replay (an import)
+        ws_sync();
+    } else {
+        handleResult(parsedData);
+    }
+
+    if (parsedData.counts) {
+        showCounts(parsedData.counts);
+    }
+}
+
+// Versions come one per change; one that skips ahead means a change never arrived
+function advanceVersion(since, upTo) {
+    if (since > version + 1) {
+        ws_sync();
+    } else {
+        version = Math.max(version, upTo);
+    }
+}
+
+function handleResult(parsedData, remote = false) {
+    if (parsedData.status === 0) {
         console.error("Error from server:", parsedData.error);
         return;
     }
 
     switch (parsedData.action) {
         case "add":
-            handleAddTask(parsedData);
+            handleAddTask(parsedData, remote);
             break;
         case "delete":
             handleDeleteTask(parsedData);
             break;
+        case "clear_completed":
+            parsedData.ids.forEach(id => handleDeleteTask({id: id}));
+            break;
         case "update":
             handleUpdateTask(parsedData);
             break;
+        case "page":
+            handlePage(parsedData);
+            break;
+        case "search":
+            handleSearch(parsedData);
+            break;
         case "error":
             break;
         default:
             console.error("Unknown action:", parsedData.action);
     }
+
+    if (parsedData.version !== undefined) {
+        // A clear_completed logged one version per task, from "since" on
+        advanceVersion(parsedData.since !== undefined ? parsedData.since : parsedData.version, parsedData.version);
+    }
 }
 
-function handleAddTask(data) {
-    tasksContainer.appendChild(
-        createTask(taskContentInput.value)
-    );
-    tasksContainer.lastChild.setAttribute("id", data.id);
+function handleAddTask(data, remote = false) {
+    // Replayed by a sync after it arrived live
+    if (!document.getElementById(data.id)) {
+        tasksContainer.appendChild(
+            createTask(data.content, data.completed)
+        );
+        tasksContainer.lastChild.setAttribute("id", data.id);
+    }
 
     // Reset input
-    taskContentInput.value = '';
-
-    // Hide "No tasks available" message
-    noTasksMessage.style.display = "none";
+    if (!remote) {
+        taskContentInput.value = '';
+    }
 }
 
 function handleDeleteTask(data) {
     let taskDiv = document.getElementById(data.id);
     if (taskDiv) {
         taskDiv.remove();
-
-        // If no tasks left, show "No tasks available" message
-        if (tasksContainer.querySelectorAll(".task").length === 0) {
-            noTasksMessage.style.display = "block";
-        }
     }
 }
 
+// Counts come with every reply, so the list never has to be counted here
+function showCounts(counts) {
+    countOpen.textContent = counts.open;
+    countCompleted.textContent = counts.completed;
+    noTasksMessage.style.display = counts.total === 0 ? "block" : "none";
+}
+
 function handleUpdateTask(data) {
     let taskDiv = document.getElementById(data.id);
     if (taskDiv) {
-        if (taskDiv.className === "task")
-            taskDiv.className += " task-completed";
-        else
-            taskDiv.className = "task";
+        // Logged changes say how they left the task; write-behind replies only that it was toggled
+        const completed = data.completed !== undefined ? data.completed : taskDiv.className === "task";
+        taskDiv.className = completed ? "task task-completed" : "task";
+    }
+}
+
+function handleSync(data) {
+    syncRequested = false;
+    // Some may already be on screen; each leaves its task in a set state, so applying it again is harmless
+    data.changes.forEach(change => handleResult({status: 1, ...change}, true));
+    version = data.version;
+}
+
+// Too far behind for the log: start over from the first page
+function handleSnapshot(data) {
+    syncRequested = false;
+    // Keeps the empty-list message, which is a child of the container too
+    tasksContainer.replaceChildren(noTasksMessage);
+    version = data.version;
+    handlePage(data);
+}
+
+function handlePage(data) {
+    data.tasks.forEach(task => {
+        // Tasks added in this tab are already on screen
+        if (!document.getElementById(task.id)) {
+            const taskDiv = createTask(task.content, task.completed);
+            taskDiv.setAttribute("id", task.id);
+            tasksContainer.appendChild(taskDiv);
+        }
+    });
+
+    nextCursor = data.next;
+    pageRequested = false;
+
+    // Keep loading while the end of the list is still visible
+    if (nextCursor && listEnd.getBoundingClientRect().top < window.innerHeight) {
+        ws_requestPage();
+    }
+}
+
+function handleSearch(data) {
+    searchRequested = false;
+    // Answer to a query the user has since changed
+    if (data.q !== searchInput.value.trim()) {
+        return;
+    }
+    if (data.offset === 0) {
+        searchResults.replaceChildren();
     }
+
+    data.tasks.forEach(task => {
+        const resultDiv = document.createElement("div");
+        resultDiv.classList.add("task");
+        if (task.completed) {
+            resultDiv.classList.add("task-completed");
+        }
+        const span = document.createElement("span");
+        span.textContent = task.content;
+        resultDiv.appendChild(span);
+        searchResults.appendChild(resultDiv);
+    });
+    searchNext = data.next;
 }
\ No newline at end of file
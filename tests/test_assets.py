@@ -0,0 +1,82 @@
+import gzip
+import json
+import pytest
+from pathlib import Path
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.testclient import TestClient
+from src.server import assets
+
+
+# --- Fixtures ---
+
+@pytest.fixture
+def source(tmp_path):
+    root = tmp_path / "static"
+    (root / "css").mkdir(parents=True)
+    (root / "icons").mkdir()
+    (root / "icons" / "trash.png").write_bytes(b"\x89PNG not really")
+    (root / "css" / "style.css").write_text("body { background: url('../icons/trash.png'); }\n" * 20)
+    return root
+
+@pytest.fixture
+def built(source, tmp_path, monkeypatch):
+    output = tmp_path / "build"
+    monkeypatch.setattr(assets, "manifest", assets.manifest)
+    monkeypatch.setattr(assets, "hashed_paths", assets.hashed_paths)
+    return output, assets.ensure_built(source, output)
+
+@pytest.fixture
+def client(built):
+    output, _ = built
+    return TestClient(Starlette(routes=[Mount("/static", assets.AssetFiles(directory=output), name="static")]))
+
+
+# --- Tests for the build ---
+
+def test_build_hashes_names_and_rewrites_css(built):
+    output, manifest = built
+    icon, css = manifest["assets"]["icons/trash.png"], manifest["assets"]["css/style.css"]
+
+    assert icon != "icons/trash.png" and icon.startswith("icons/trash.")
+    assert f"url(../{icon})" in (output / css).read_text()
+    assert gzip.decompress((output / f"{css}.gz").read_bytes()) == (output / css).read_bytes()
+    assert "gzip" in manifest["encodings"][css]
+
+
+def test_ensure_built_skips_unchanged_sources(built, source):
+    output, manifest = built
+    (output / "manifest.json").write_text(json.dumps({**manifest, "assets": {"marker": "kept"}}))
+    assert assets.ensure_built(source, output)["assets"] == {"marker": "kept"}
+
+    (source / "css" / "style.css").write_text("body { color: red; }")
+    assert "css/style.css" in assets.ensure_built(source, output)["assets"]
+
+
+def test_subset_font_keeps_only_latin():
+    pytest.importorskip("fontTools")
+    font = Path("static/fonts/Lato-Regular.ttf")
+    assert len(assets.subset_font(font)) < font.stat().st_size
+
+
+# --- Tests for serving ---
+
+def test_hashed_assets_are_immutable_and_negotiated(client, built):
+    _, manifest = built
+    css = manifest["assets"]["css/style.css"]
+
+    response = client.get(f"/static/{css}", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["cache-control"] == assets.IMMUTABLE
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["content-type"].startswith("text/css")
+    assert response.text.startswith("body")
+
+    plain = client.get(f"/static/{css}", headers={"Accept-Encoding": "gzip;q=0"})
+    assert "content-encoding" not in plain.headers
+
+
+def test_original_names_still_revalidate(client):
+    response = client.get("/static/css/style.css")
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "no-cache"
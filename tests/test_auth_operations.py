@@ -1,6 +1,13 @@
+import asyncio
+import time
 import pytest
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import MagicMock
 from fastapi import HTTPException, Request
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import SQLModel, Session, create_engine, select
+from src.common import cache as caching
 from src.modules import auth_operations as auth
 from src.common.models import User
 
@@ -40,8 +47,8 @@ def test_get_current_user_no_session(fake_request, mock_db_session):
 
 
 def test_get_current_user_found(fake_request, mock_db_session):
-    fake_request.session["user_id"] = 1
     user = User(id=1, username="u", email="e", password="p")
+    fake_request.session["auth"] = auth.issue_token(user)
     mock_db_session.get.return_value = user
 
     result = auth.get_current_user(fake_request, mock_db_session)
@@ -50,7 +57,7 @@ def test_get_current_user_found(fake_request, mock_db_session):
 
 
 def test_get_current_user_not_found(fake_request, mock_db_session):
-    fake_request.session["user_id"] = 99
+    fake_request.session["auth"] = auth.issue_token(User(id=99, username="gone", email="e", password="p"))
     mock_db_session.get.return_value = None
 
     with pytest.raises(HTTPException) as exc:
@@ -60,6 +67,64 @@ def test_get_current_user_not_found(fake_request, mock_db_session):
     assert "User not found" in exc.value.detail
 
 
+def test_require_admin_only_lets_listed_users_in(fake_request, monkeypatch):
+    monkeypatch.setattr(auth, "ADMIN_USER_IDS", {1})
+    with pytest.raises(HTTPException) as exc:
+        auth.require_admin(fake_request)
+    assert exc.value.status_code == 403
+
+    fake_request.session["auth"] = auth.issue_token(User(id=2, username="u", email="e", password="p"))
+    with pytest.raises(HTTPException):
+        auth.require_admin(fake_request)
+
+    fake_request.session["auth"] = auth.issue_token(User(id=1, username="admin", email="e", password="p"))
+    assert auth.require_admin(fake_request) == auth.Identity(1, "admin")
+
+
+# --- Tests for session tokens ---
+
+def test_identity_comes_from_token_without_db(fake_request):
+    fake_request.session["auth"] = auth.issue_token(User(id=7, username="a.b", email="e", password="p", auth_epoch=2))
+    assert auth.get_current_identity(fake_request) == auth.Identity(7, "a.b", 2)
+
+
+def test_tampered_token_is_rejected(fake_request):
+    token = auth.issue_token(User(id=7, username="user", email="e", password="p"))
+    fake_request.session["auth"] = token.replace("7.", "8.", 1)
+    assert auth.get_current_identity(fake_request) is None
+
+
+def test_bumped_epoch_revokes_older_tokens(fake_request, monkeypatch):
+    monkeypatch.setattr(auth, "revocations", auth.RevocationSet())
+    user = User(id=7, username="user", email="e", password="p")
+    fake_request.session["auth"] = auth.issue_token(user)
+
+    auth.revocations.revoke(7, 1)
+    assert auth.get_current_identity(fake_request) is None
+
+    user.auth_epoch = 1
+    fake_request.session["auth"] = auth.issue_token(user)
+    assert auth.get_current_identity(fake_request).id == 7
+
+
+def test_revocations_refresh_from_db(mock_db_session):
+    revocations = auth.RevocationSet()
+    mock_db_session.exec.return_value.all.return_value = [(7, 3)]
+
+    revocations.refresh(mock_db_session)
+    assert revocations.is_revoked(auth.Identity(7, "user", 2))
+    assert not revocations.is_revoked(auth.Identity(8, "other", 0))
+
+
+
+def test_revoke_sessions_bumps_the_epoch_of_existing_users_only(user_db, monkeypatch):
+    monkeypatch.setattr(auth, "revocations", auth.RevocationSet())
+    register(user_db, "newuser", "new@example.com")
+    with Session(user_db) as session:
+        assert auth.revoke_sessions(session, 1) == 1
+        assert auth.revoke_sessions(session, 2) is None
+    assert auth.revocations.is_revoked(auth.Identity(1, "newuser", 0))
+
 # --- Tests for login_user ---
 
 class DummyLoginForm:
@@ -76,7 +141,7 @@ def test_login_user_success(fake_request, mock_db_session):
     mock_query.first.return_value = user
     mock_db_session.exec.return_value = mock_query
 
-    result = auth.login_user(fake_request, mock_db_session, form)
+    result = asyncio.run(auth.login_user(fake_request, mock_db_session, form))
 
     assert result == user
     mock_db_session.exec.assert_called_once()
@@ -91,7 +156,7 @@ def test_login_user_invalid(fake_request, mock_db_session):
     mock_db_session.exec.return_value = mock_query
 
     with pytest.raises(HTTPException) as exc:
-        auth.login_user(fake_request, mock_db_session, form)
+        asyncio.run(auth.login_user(fake_request, mock_db_session, form))
 
     assert exc.value.status_code == 400
     assert "Invalid username or password" in exc.value.detail
@@ -105,7 +170,7 @@ def test_login_user_not_found(fake_request, mock_db_session):
     mock_db_session.exec.return_value = mock_query
 
     with pytest.raises(HTTPException) as exc:
-        auth.login_user(fake_request, mock_db_session, form)
+        asyncio.run(auth.login_user(fake_request, mock_db_session, form))
 
     assert exc.value.status_code == 400
     assert "Invalid username or password" in exc.value.detail
@@ -120,50 +185,115 @@ class DummyRegisterForm:
         self.password = password
 
 
-def test_register_user_success(fake_request, mock_db_session):
-    form = DummyRegisterForm("newuser", "new@example.com", "pass")
+@pytest.fixture
+def user_db(tmp_path, monkeypatch):
+    # A file, so each thread in the concurrency test gets its own connection
+    engine = create_engine(f"sqlite:///{tmp_path / 'users.db'}", connect_args={"check_same_thread": False})
+    SQLModel.metadata.create_all(engine)
+    monkeypatch.setattr(auth, "pwd_context", auth.pwd_context.copy(bcrypt__rounds=4))
+    monkeypatch.setattr(caching, "default_cache", None)
+    return engine
 
-    # first queries return None → no duplicates
-    mock_query = MagicMock()
-    mock_query.first.side_effect = [None, None]
-    mock_db_session.exec.return_value = mock_query
 
-    mock_db_session.add.return_value = None
-    mock_db_session.commit.return_value = None
-    mock_db_session.refresh.side_effect = lambda u: setattr(u, "id", 1)
+def register(engine, username, email):
+    with Session(engine) as session:
+        return asyncio.run(auth.register_user(None, session, DummyRegisterForm(username, email, "pass")))
+
 
-    result = auth.register_user(fake_request, mock_db_session, form)
+def test_register_user_success(user_db):
+    result = register(user_db, "newuser", " New@Example.com ")
 
     assert isinstance(result, User)
+    assert result.id is not None
     assert result.username == "newuser"
-    assert result.email == "new@example.com"
+    assert result.email == "New@Example.com"
+    assert result.email_normalized == "new@example.com"
     assert auth.verify_password("pass", result.password)
 
 
-def test_register_user_username_taken(fake_request, mock_db_session):
-    form = DummyRegisterForm("exists", "new@example.com", "pass")
-
-    mock_query = MagicMock()
-    mock_query.first.side_effect = [User(id=1, username="exists", email="e", password="p")]
-    mock_db_session.exec.return_value = mock_query
+def test_register_user_username_taken(user_db):
+    register(user_db, "exists", "old@example.com")
 
     with pytest.raises(HTTPException) as exc:
-        auth.register_user(fake_request, mock_db_session, form)
+        register(user_db, "exists", "new@example.com")
 
     assert exc.value.status_code == 400
     assert "Username already taken" in exc.value.detail
 
 
-def test_register_user_email_taken(fake_request, mock_db_session):
-    form = DummyRegisterForm("newuser", "exists@example.com", "pass")
-
-    mock_query = MagicMock()
-    # username → None, email → already exists
-    mock_query.first.side_effect = [None, User(id=1, username="u", email="exists@example.com", password="p")]
-    mock_db_session.exec.return_value = mock_query
+def test_register_user_email_taken_ignores_case(user_db):
+    register(user_db, "first", "exists@example.com")
 
     with pytest.raises(HTTPException) as exc:
-        auth.register_user(fake_request, mock_db_session, form)
+        register(user_db, "second", "Exists@Example.COM")
 
     assert exc.value.status_code == 400
     assert "Email already registered" in exc.value.detail
+
+
+def test_concurrent_duplicate_signups_register_once(user_db):
+    def attempt(i):
+        try:
+            return register(user_db, "racer", f"racer{i}@example.com")
+        except HTTPException as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(attempt, range(8)))
+
+    assert sum(isinstance(r, User) for r in results) == 1
+    assert all(r.detail == "Username already taken" for r in results if isinstance(r, HTTPException))
+    with Session(user_db) as session:
+        assert len(session.exec(select(User)).all()) == 1
+
+
+
+def test_duplicates_are_told_apart_by_constraint_not_message():
+    class PostgresError(Exception):
+        def __init__(self, constraint_name):
+            super().__init__(f'duplicate key value violates unique constraint "{constraint_name}"\nDETAIL:  Key (email)=(username@x.io) already exists.')
+            self.diag = MagicMock(constraint_name=constraint_name)
+
+    def error(orig):
+        return IntegrityError("INSERT INTO user ...", {}, orig)
+
+    assert auth.duplicate_field(error(PostgresError("user_email_key"))) == "email"
+    assert auth.duplicate_field(error(PostgresError("ix_user_email_normalized"))) == "email"
+    assert auth.duplicate_field(error(PostgresError("user_username_key"))) == "username"
+    assert auth.duplicate_field(error(Exception("UNIQUE constraint failed: user.email_normalized"))) == "email"
+    assert auth.duplicate_field(error(Exception("NOT NULL constraint failed: user.username"))) is None
+
+# --- Tests for the password pool ---
+
+def test_password_pool_rejects_when_saturated():
+    pool = auth.PasswordPool(workers=1, queue_limit=1)
+
+    async def burst():
+        return await asyncio.gather(*(pool.run(time.sleep, 0.05) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(burst())
+
+    rejected = [r for r in results if isinstance(r, HTTPException)]
+    assert len(rejected) == 1
+    assert rejected[0].status_code == 503
+    assert rejected[0].headers["Retry-After"] == "1"
+    assert pool.pending == 0
+
+
+def test_login_rehashes_outdated_cost(fake_request, user_db, monkeypatch):
+    monkeypatch.setattr(auth, "SessionLocal", sessionmaker(bind=user_db, class_=Session, expire_on_commit=False))
+    old_hash = auth.pwd_context.copy(bcrypt__rounds=4).hash("pass")
+    monkeypatch.setattr(auth, "pwd_context", auth.pwd_context.copy(bcrypt__rounds=5))
+    with Session(user_db) as session:
+        session.add(User(id=1, username="user", email="e", email_normalized="e", password=old_hash))
+        session.commit()
+
+    with Session(user_db) as session:
+        user = asyncio.run(auth.login_user(fake_request, session, DummyLoginForm("user", "pass")))
+        # The lookup ended its transaction before bcrypt ran
+        assert not session.in_transaction()
+
+    assert user.password != old_hash
+    assert not auth.pwd_context.needs_update(user.password)
+    with Session(user_db) as session:
+        assert session.get(User, 1).password == user.password
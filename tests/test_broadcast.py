@@ -0,0 +1,221 @@
+import asyncio
+import socketserver
+import threading
+import pytest
+from src.common.broadcast import (
+    Broadcaster, Connection, MemoryBroadcastBackend, RedisBroadcastBackend, SLOW_CONSUMER_CLOSE_CODE, create_broadcaster,
+)
+from src.common.protocol import MSGPACK
+
+
+# --- Fixtures ---
+
+class FakeWebSocket:
+    def __init__(self, blocked: bool = False):
+        self.sent: list[str] = []
+        self.closed_with: int | None = None
+        self.unblocked = asyncio.Event()
+        if not blocked:
+            self.unblocked.set()
+
+    async def send_text(self, text: str):
+        await self.unblocked.wait()
+        self.sent.append(text)
+
+    async def send_bytes(self, data: bytes):
+        await self.unblocked.wait()
+        self.sent.append(data)
+
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+
+def open_connection(**kwargs) -> Connection:
+    websocket = FakeWebSocket(**{k: v for k, v in kwargs.items() if k == "blocked"})
+    connection = Connection(websocket, kwargs.get("max_queued", 16), **{k: v for k, v in kwargs.items() if k == "codec"})
+    connection.start()
+    return connection
+
+
+async def settle(condition, timeout: float = 2):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met")
+
+
+class PubSubHandler(socketserver.StreamRequestHandler):
+    """Stand-in for a Redis server: SUBSCRIBE, UNSUBSCRIBE and PUBLISH"""
+
+    def handle(self):
+        server = self.server
+        channels = set()
+        try:
+            while line := self.rfile.readline():
+                args = []
+                for _ in range(int(line[1:])):
+                    length = int(self.rfile.readline()[1:])
+                    args.append(self.rfile.read(length + 2)[:-2])
+
+                command = args[0].upper()
+                with server.lock:
+                    if command == b"SUBSCRIBE":
+                        for name in args[1:]:
+                            channels.add(name)
+                            server.subscribers.setdefault(name, set()).add(self)
+                            self.push(b"subscribe", name, len(channels))
+                    elif command == b"UNSUBSCRIBE":
+                        for name in args[1:]:
+                            channels.discard(name)
+                            server.subscribers.get(name, set()).discard(self)
+                            self.push(b"unsubscribe", name, len(channels))
+                    elif command == b"PUBLISH":
+                        receivers = server.subscribers.get(args[1], set())
+                        for handler in receivers:
+                            handler.push(b"message", args[1], args[2])
+                        self.wfile.write(b":%d\r\n" % len(receivers))
+        finally:
+            with server.lock:
+                for name in channels:
+                    server.subscribers[name].discard(self)
+
+    def push(self, kind: bytes, channel: bytes, value):
+        last = b":%d\r\n" % value if isinstance(value, int) else b"$%d\r\n%s\r\n" % (len(value), value)
+        self.wfile.write(b"*3\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n%s" % (len(kind), kind, len(channel), channel, last))
+
+@pytest.fixture
+def pubsub_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), PubSubHandler)
+    server.daemon_threads = True
+    server.subscribers = {}
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+# --- Tests for Connection ---
+
+def test_full_queue_drops_slow_consumer():
+    async def run():
+        connection = open_connection(blocked=True, max_queued=2)
+        results = [connection.offer(f"frame {i}") for i in range(4)]
+        await settle(lambda: connection.closed)
+        await asyncio.sleep(0)
+        return connection, results
+
+    connection, results = asyncio.run(run())
+    assert results == [True, True, False, False]
+    assert connection.websocket.closed_with == SLOW_CONSUMER_CLOSE_CODE
+
+
+def test_send_after_drop_fails_instead_of_waiting():
+    async def run():
+        connection = open_connection(blocked=True, max_queued=1)
+        connection.offer("a")
+        connection.offer("b")
+        await settle(lambda: connection.closed)
+        with pytest.raises(ConnectionError):
+            await connection.send({"status": 1})
+
+    asyncio.run(run())
+
+
+# --- Tests for Broadcaster ---
+
+def test_memory_fan_out_skips_origin_and_other_users():
+    async def run():
+        broadcaster = Broadcaster(MemoryBroadcastBackend())
+        origin, other_tab, other_user = open_connection(), open_connection(), open_connection()
+        await broadcaster.join(1, origin)
+        await broadcaster.join(1, other_tab)
+        await broadcaster.join(2, other_user)
+
+        await broadcaster.publish(1, {"status": 1, "action": "delete", "id": 5}, origin=origin)
+        await settle(lambda: other_tab.websocket.sent)
+        return origin, other_tab, other_user
+
+    origin, other_tab, other_user = asyncio.run(run())
+    assert other_tab.websocket.sent == ['{"status":1,"action":"delete","id":5}']
+    assert origin.websocket.sent == []
+    assert other_user.websocket.sent == []
+
+
+def test_fan_out_reencodes_for_binary_connections():
+    pytest.importorskip("msgpack")
+
+    async def run():
+        broadcaster = Broadcaster(MemoryBroadcastBackend())
+        text_tab, binary_tab = open_connection(), open_connection(codec=MSGPACK)
+        await broadcaster.join(1, text_tab)
+        await broadcaster.join(1, binary_tab)
+
+        await broadcaster.publish(1, {"status": 1, "action": "delete", "id": 5})
+        await settle(lambda: text_tab.websocket.sent and binary_tab.websocket.sent)
+        return text_tab, binary_tab
+
+    text_tab, binary_tab = asyncio.run(run())
+    assert text_tab.websocket.sent == ['{"status":1,"action":"delete","id":5}']
+    assert [MSGPACK.decode(frame) for frame in binary_tab.websocket.sent] == [{"status": 1, "action": "delete", "id": 5}]
+
+
+def test_leave_unsubscribes_last_connection():
+    async def run():
+        backend = MemoryBroadcastBackend()
+        broadcaster = Broadcaster(backend)
+        first, second = open_connection(), open_connection()
+        await broadcaster.join(1, first)
+        await broadcaster.join(1, second)
+        await broadcaster.leave(1, first)
+        subscribed = "tasks:1" in backend._channels
+        await broadcaster.leave(1, second)
+        return subscribed, "tasks:1" in backend._channels, broadcaster.connections
+
+    assert asyncio.run(run()) == (True, False, {})
+
+
+def test_redis_fan_out_reaches_other_workers(pubsub_server):
+    host, port = pubsub_server.server_address
+
+    async def run():
+        worker_a = Broadcaster(RedisBroadcastBackend(host, port))
+        worker_b = Broadcaster(RedisBroadcastBackend(host, port))
+        sender, receiver = open_connection(), open_connection()
+        await worker_a.join(1, sender)
+        await worker_b.join(1, receiver)
+        await settle(lambda: len(pubsub_server.subscribers.get(b"tasks:1", ())) == 2)
+
+        await worker_a.publish(1, {"status": 1, "action": "add", "id": 1, "content": "abc"}, origin=sender)
+        await settle(lambda: receiver.websocket.sent)
+        await worker_a.close()
+        await worker_b.close()
+        return sender, receiver
+
+    sender, receiver = asyncio.run(run())
+    assert receiver.websocket.sent == ['{"status":1,"action":"add","id":1,"content":"abc"}']
+    assert sender.websocket.sent == []
+
+
+def test_redis_publish_gives_up_on_a_stalled_server():
+    async def run():
+        # Accepts the connection, then never answers
+        server = await asyncio.start_server(lambda reader, writer: None, "127.0.0.1", 0)
+        host, port = server.sockets[0].getsockname()[:2]
+        backend = RedisBroadcastBackend(host, port, timeout=0.1)
+        try:
+            await asyncio.wait_for(backend.publish("tasks:1", "{}"), 2)
+            return backend._publisher
+        finally:
+            await backend.close()
+            server.close()
+
+    assert asyncio.run(run()) is None
+
+
+def test_create_broadcaster_from_url():
+    assert isinstance(create_broadcaster("memory://").backend, MemoryBroadcastBackend)
+    assert isinstance(create_broadcaster("redis://localhost:6380").backend, RedisBroadcastBackend)
+    with pytest.raises(ValueError):
+        create_broadcaster("kafka://localhost")
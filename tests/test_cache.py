@@ -0,0 +1,209 @@
+import asyncio
+import json
+import socketserver
+import threading
+import time
+import pytest
+from sqlmodel import SQLModel, Session, create_engine
+from sqlalchemy.pool import StaticPool
+from src.common.cache import Cache, MemoryCacheBackend, RedisCacheBackend, create_cache
+from src.common.db_storage import DBStorageHandler
+from src.common.models import Task, User
+
+
+# --- Fixtures ---
+
+@pytest.fixture
+def cache():
+    return Cache(MemoryCacheBackend(max_entries=100), ttl=60)
+
+@pytest.fixture
+def db_session():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine, expire_on_commit=False) as session:
+        session.add(User(id=1, username="user", email="e@x.io", password="secret"))
+        session.commit()
+        yield session
+
+@pytest.fixture
+def storage(db_session, cache):
+    return DBStorageHandler(db_session, cache)
+
+
+class RESPHandler(socketserver.StreamRequestHandler):
+    """Stand-in for a Redis server: GET, SET (PX ignored) and DEL"""
+
+    def handle(self):
+        store = self.server.store
+        while line := self.rfile.readline():
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+
+            command = args[0].upper()
+            if command == b"GET":
+                value = store.get(args[1])
+                self.wfile.write(b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value))
+            elif command == b"SET":
+                store[args[1]] = args[2]
+                self.wfile.write(b"+OK\r\n")
+            elif command == b"DEL":
+                removed = sum(store.pop(key, None) is not None for key in args[1:])
+                self.wfile.write(b":%d\r\n" % removed)
+
+@pytest.fixture
+def resp_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), RESPHandler)
+    server.daemon_threads = True
+    server.store = {}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+# --- Tests for backends ---
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryCacheBackend(max_entries=2)
+    backend.set("a", b"1", 60)
+    backend.set("b", b"2", 60)
+    backend.get("a")
+    backend.set("c", b"3", 60)
+
+    assert backend.get("a") == b"1"
+    assert backend.get("b") is None
+    assert backend.get("c") == b"3"
+
+
+def test_memory_backend_expires_entries():
+    backend = MemoryCacheBackend()
+    backend.set("a", b"1", 0.01)
+    time.sleep(0.02)
+    assert backend.get("a") is None
+
+
+def test_redis_backend_round_trip(resp_server):
+    backend = RedisCacheBackend(*resp_server.server_address)
+    backend.set("a", b"\r\nbinary\r\n", 60)
+
+    assert backend.get("a") == b"\r\nbinary\r\n"
+    backend.delete("a")
+    assert backend.get("a") is None
+
+
+def test_unreachable_backend_counts_as_miss():
+    cache = Cache(RedisCacheBackend("127.0.0.1", 1, timeout=0.05))
+
+    assert cache.get_model("user:1", User) is None
+    assert cache.stats.misses == 1
+    assert cache.stats.errors == 1
+
+
+def test_network_backends_are_called_off_the_event_loop():
+    class RecordingBackend(MemoryCacheBackend):
+        def get(self, key):
+            threads.add(threading.get_ident())
+            return super().get(key)
+
+    async def lookup(cache) -> int:
+        await cache.run(cache.get_model, "user:1", User)
+        return threading.get_ident()
+
+    threads = set()
+    assert threads == {asyncio.run(lookup(Cache(RecordingBackend())))}
+
+    threads = set()
+    RecordingBackend.blocking = True
+    loop_thread = asyncio.run(lookup(Cache(RecordingBackend())))
+    assert threads and loop_thread not in threads
+
+
+def test_create_cache_from_url():
+    assert isinstance(create_cache("memory://?max_entries=5&ttl=2").backend, MemoryCacheBackend)
+    assert isinstance(create_cache("redis://localhost:6380/1").backend, RedisCacheBackend)
+    assert create_cache("none") is None
+
+
+# --- Tests for DBStorageHandler caching ---
+
+def test_find_reads_through(storage, cache):
+    assert storage.find(User, 1).username == "user"
+    assert storage.find(User, 1).username == "user"
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+
+
+def test_cached_rows_are_json_and_validated_on_read(storage, cache):
+    user = storage.find(User, 1)
+    key = next(iter(cache.backend._entries))
+    assert json.loads(cache.backend.get(key))["username"] == "user"
+    assert storage.find(User, 1).created_at == user.created_at
+
+    cache.backend.set(key, b'{"id": 1, "username": "u"}', 60)
+    assert storage.find(User, 1).username == "user"
+    assert cache.stats.errors == 1
+
+
+def test_replica_reads_are_not_cached(db_session, cache):
+    storage = DBStorageHandler(db_session, cache, read_session=Session(db_session.get_bind()))
+    storage.create(Task(content="first", user_id=1))
+    assert len(storage.get_all_where(Task, Task.user_id == 1, group=("user_id", 1))) == 1
+    assert storage.find(User, 1, replica=True).username == "user"
+    assert (cache.stats.hits, cache.stats.misses) == (0, 0)
+
+    storage.find(User, 1)
+    assert storage.find(User, 1).username == "user"
+    assert cache.stats.hits == 1
+
+
+def test_user_task_list_is_cached_and_invalidated(storage, cache):
+    group = ("user_id", 1)
+    storage.create(Task(content="first", user_id=1))
+    assert len(storage.get_all_where(Task, Task.user_id == 1, group=group)) == 1
+    assert len(storage.get_all_where(Task, Task.user_id == 1, group=group)) == 1
+    assert cache.stats.hits == 1
+
+    task = storage.create(Task(content="second", user_id=1))
+    assert len(storage.get_all_where(Task, Task.user_id == 1, group=group)) == 2
+
+    storage.update(task.id, Task, {"completed": True})
+    assert [t.completed for t in storage.get_all_where(Task, Task.user_id == 1, group=group)] == [False, True]
+
+    storage.delete(task.id, Task)
+    assert len(storage.get_all_where(Task, Task.user_id == 1, group=group)) == 1
+
+
+def test_uncommitted_writes_invalidate_on_commit(storage, cache):
+    group = ("user_id", 1)
+    storage.get_all_where(Task, Task.user_id == 1, group=group)
+
+    storage.create(Task(content="pending", user_id=1), commit=False)
+    assert storage.get_all_where(Task, Task.user_id == 1, group=group) == []
+
+    storage.commit()
+    assert len(storage.get_all_where(Task, Task.user_id == 1, group=group)) == 1
+
+
+def test_cached_first_page_answers_only_what_it_covers(storage, cache):
+    group = ("user_id", 1)
+    storage.bulk_insert(Task, [{"content": f"task {i}", "user_id": 1, "completed": False} for i in range(3)])
+
+    assert len(storage.get_all_where(Task, Task.user_id == 1, group=group, limit=2)) == 2
+    assert len(storage.get_all_where(Task, Task.user_id == 1, group=group, limit=1)) == 1
+    assert cache.stats.hits == 1
+
+    # A full read can't be served from a truncated first page
+    assert len(storage.get_all_where(Task, Task.user_id == 1, group=group)) == 3
+    assert cache.stats.hits == 1
+
+
+def test_group_version_changes_only_on_write(storage, cache):
+    group = ("user_id", 1)
+    version = storage.group_version(Task, group)
+    storage.get_all_where(Task, Task.user_id == 1, group=group)
+    assert storage.group_version(Task, group) == version
+
+    storage.create(Task(content="new", user_id=1))
+    assert storage.group_version(Task, group) not in (None, version)
@@ -0,0 +1,133 @@
+import pytest
+from sqlmodel import Session, create_engine, select
+from sqlalchemy.pool import StaticPool
+from src.common import cache as caching
+from src.common.cache import Cache, MemoryCacheBackend
+from src.common.db_storage import DBStorageHandler
+from src.common.migrations import run_migrations
+from src.common.models import Task, TaskChange, User
+from src.modules.task_operations import TaskOperations, change_reply
+
+
+# --- Fixtures ---
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(caching, "default_cache", None)
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    run_migrations(engine)
+    session = Session(engine, expire_on_commit=False)
+    session.add_all([User(id=1, username="one", email="one@x.io", password="p"), User(id=2, username="two", email="two@x.io", password="p")])
+    session.commit()
+    yield session
+    session.close()
+
+@pytest.fixture
+def task_operations(session):
+    return TaskOperations(DBStorageHandler(session))
+
+
+def replies(task_operations, user_id: int, since: int) -> tuple[int, list[dict]] | None:
+    log = task_operations.get_changes(user_id, since)
+    return log and (log[0], [change_reply(change) for change in log[1]])
+
+
+# --- Tests for writing the log ---
+
+def test_every_write_is_logged_with_the_next_version(task_operations):
+    first, second = task_operations.add_many(1, ["one", "two"])
+    task_operations.change_status(first.id, 1)
+    task_operations.delete(second.id, 1)
+    task_operations.add({"user_id": 2, "content": "theirs"})
+
+    assert replies(task_operations, 1, 0) == (4, [
+        {"action": "add", "id": first.id, "version": 1, "content": "one", "completed": False},
+        {"action": "add", "id": second.id, "version": 2, "content": "two", "completed": False},
+        {"action": "update", "id": first.id, "version": 3, "completed": True},
+        {"action": "delete", "id": second.id, "version": 4},
+    ])
+    assert replies(task_operations, 1, 3) == (4, [{"action": "delete", "id": second.id, "version": 4}])
+    assert replies(task_operations, 2, 0)[0] == 1
+    assert task_operations.get_version(1) == 4
+
+
+def test_batch_results_carry_their_versions(task_operations, session):
+    [task] = task_operations.add_many(1, ["kept"])
+
+    results = task_operations.apply_batch(1, [
+        {"action": "update", "id": task.id}, {"action": "delete", "id": 99}, {"action": "add", "content": "new"},
+    ])
+
+    assert [result.get("version") for result in results] == [2, None, 3]
+    assert results[0]["completed"] is True
+
+    # A batch that fails logs nothing, and its versions go to the next one
+    task_operations.apply_batch(1, [{"action": "delete", "id": task.id}, {"action": "add", "content": None}])
+    assert session.exec(select(Task).where(Task.id == task.id)).one()
+    assert task_operations.apply_batch(1, [{"action": "delete", "id": task.id}])[0]["version"] == 4
+
+
+
+def test_clear_completed_deletes_and_logs_every_completed_task(task_operations, session):
+    first, second, third = task_operations.add_many(1, ["one", "two", "three"])
+    [theirs] = task_operations.add_many(2, ["theirs"])
+    for task in (first, third, theirs):
+        task_operations.change_status(task.id, task.user_id)
+
+    [result] = task_operations.apply_batch(1, [{"action": "clear_completed"}])
+
+    assert result == {"status": 1, "action": "clear_completed", "ids": [first.id, third.id], "since": 6, "version": 7}
+    assert [task.id for task in session.exec(select(Task).order_by(Task.id))] == [second.id, theirs.id]
+    assert replies(task_operations, 1, 5)[1] == [{"action": "delete", "id": first.id, "version": 6}, {"action": "delete", "id": third.id, "version": 7}]
+    assert task_operations.get_counts(1) == {"total": 1, "completed": 0, "open": 1}
+    # Nothing left to clear, so nothing logged
+    assert task_operations.apply_batch(1, [{"action": "clear_completed"}]) == [{"status": 1, "action": "clear_completed", "ids": []}]
+
+# --- Tests for catching up ---
+
+def test_clients_outside_the_log_need_a_snapshot(task_operations):
+    task_operations.add_many(1, ["one", "two", "three"])
+
+    assert replies(task_operations, 1, 3) == (3, [])
+    # Ahead of the log, as after a database restore
+    assert replies(task_operations, 1, 7) is None
+
+    version, tasks = task_operations.get_snapshot(1, limit=2)
+    assert version == 3
+    assert [task.content for task in tasks] == ["one", "two"]
+
+
+def test_compaction_keeps_the_latest_changes(task_operations, session):
+    task_operations.add_many(1, [f"task {i}" for i in range(5)])
+    task_operations.add_many(2, ["theirs"])
+
+    assert task_operations.compact_log(keep=2) == 3
+
+    assert session.exec(select(TaskChange.user_id, TaskChange.version).order_by(TaskChange.user_id, TaskChange.version)).all() == [(1, 4), (1, 5), (2, 1)]
+    assert replies(task_operations, 1, 2) is None
+    assert [change["version"] for change in replies(task_operations, 1, 3)[1]] == [4, 5]
+    assert task_operations.compact_log(keep=2) == 0
+
+
+def test_imports_restart_the_log(task_operations, session):
+    task_operations.add_many(1, ["before"])
+
+    task_operations.import_rows(1, [{"content": "imported", "completed": False}])
+    assert session.exec(select(TaskChange).where(TaskChange.user_id == 1)).all() == []
+
+    assert replies(task_operations, 1, 1) is None
+    assert replies(task_operations, 1, 2) == (2, [])
+    task_operations.add_many(1, ["after"])
+    assert [change["version"] for change in replies(task_operations, 1, 2)[1]] == [3]
+
+
+def test_compaction_and_imports_with_a_cache(session):
+    # TaskChange rows (keyed by user_id + version) come back from these deletes and are marked stale
+    task_operations = TaskOperations(DBStorageHandler(session, cache=Cache(MemoryCacheBackend(), ttl=60)))
+    task_operations.add_many(1, [f"task {i}" for i in range(3)])
+    assert task_operations.get_counts(1)["total"] == 3
+
+    assert task_operations.compact_log(keep=1) == 2
+    assert task_operations.import_rows(1, [{"content": "imported", "completed": False}]) == 1
+    assert task_operations.get_counts(1)["total"] == 4
+    assert session.exec(select(TaskChange).where(TaskChange.user_id == 1)).all() == []
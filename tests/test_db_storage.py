@@ -0,0 +1,68 @@
+import pytest
+from sqlmodel import SQLModel, Session, create_engine, not_
+from sqlalchemy.pool import StaticPool
+from src.common.db_storage import DBStorageHandler
+from src.common.models import Task
+
+
+# --- Fixtures ---
+
+@pytest.fixture
+def db_session():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine, expire_on_commit=False) as session:
+        yield session
+
+@pytest.fixture
+def storage(db_session):
+    return DBStorageHandler(db_session)
+
+@pytest.fixture
+def tasks(storage):
+    return storage.bulk_insert(Task, [
+        {"content": "first", "user_id": 1, "completed": False},
+        {"content": "second", "user_id": 1, "completed": False},
+        {"content": "other", "user_id": 2, "completed": False},
+    ])
+
+
+# --- Tests for set-based operations ---
+
+def test_bulk_insert_returns_ids_in_order(tasks):
+    assert [task.content for task in tasks] == ["first", "second", "other"]
+    assert tasks[0].id < tasks[1].id < tasks[2].id
+
+
+def test_update_where_toggles_in_one_statement(storage, db_session, tasks):
+    updated = storage.update_where(Task, {"completed": not_(Task.completed)}, Task.id == tasks[0].id, Task.user_id == 1)
+
+    assert [task.completed for task in updated] == [True]
+    assert len(db_session.identity_map) == 0
+    assert storage.get_all_where(Task, Task.completed == True)[0].id == tasks[0].id
+
+
+def test_update_where_respects_ownership(storage, tasks):
+    assert storage.update_where(Task, {"completed": True}, Task.id == tasks[2].id, Task.user_id == 1) == []
+
+
+def test_delete_where(storage, tasks):
+    assert storage.delete_where(Task, Task.id == tasks[2].id, Task.user_id == 1) == 0
+    assert storage.delete_where(Task, Task.user_id == 1) == 2
+    assert [task.id for task in storage.get_all(Task)] == [tasks[2].id]
+
+
+# --- Tests for keyset pagination and streaming ---
+
+def test_get_all_where_pages_by_id(storage, tasks):
+    first = storage.get_all_where(Task, Task.user_id == 1, limit=1)
+    second = storage.get_all_where(Task, Task.user_id == 1, after=first[-1].id, limit=1)
+    rest = storage.get_all_where(Task, Task.user_id == 1, after=second[-1].id, limit=1)
+
+    assert [t.content for t in first + second] == ["first", "second"]
+    assert rest == []
+
+
+def test_stream_where_yields_chunks(storage, tasks):
+    chunks = list(storage.stream_where(Task, Task.user_id == 1, batch_size=1))
+    assert [[t.content for t in chunk] for chunk in chunks] == [["first"], ["second"]]
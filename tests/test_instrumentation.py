@@ -0,0 +1,130 @@
+import asyncio
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlmodel import Session, create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
+import src.common.instrumentation as instrumentation
+from src.common.instrumentation import InstrumentationMiddleware, Metrics, instrument_engine, request_scope
+
+
+# --- Fixtures ---
+
+@pytest.fixture(autouse=True)
+def fresh_metrics(monkeypatch):
+    monkeypatch.setattr(instrumentation, "metrics", Metrics())
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+    return engine
+
+
+# --- Tests for query accounting ---
+
+def test_scope_counts_queries_and_time(engine):
+    with request_scope("GET /tasks") as stats, Session(engine) as session:
+        session.exec(text("SELECT 1"))
+        session.exec(text("SELECT 2"))
+
+    assert stats.queries == 2
+    assert stats.db_time > 0
+    assert instrumentation.metrics.queries["GET /tasks"] == 2
+    assert instrumentation.metrics.requests["GET /tasks"] == 1
+
+
+def test_queries_outside_a_scope_are_ignored(engine):
+    with Session(engine) as session:
+        session.exec(text("SELECT 1"))
+    assert not instrumentation.metrics.queries
+
+
+def test_slow_queries_leave_out_their_parameters(engine, monkeypatch, caplog):
+    monkeypatch.setattr(instrumentation, "SLOW_QUERY_MS", 0)
+    with request_scope("ws:add"), Session(engine) as session:
+        session.exec(text("SELECT :value, :email"), params={"value": 42, "email": "e@x.io"})
+
+    slow = instrumentation.metrics.recent_slow[-1]
+    assert (slow.tag, slow.parameters) == ("ws:add", None)
+    assert instrumentation.metrics.slow_queries["ws:add"] == 1
+    assert "SELECT ?, ?" in caplog.text and "e@x.io" not in caplog.text
+
+
+def test_slow_query_parameters_are_redacted_when_kept(engine, monkeypatch, caplog):
+    monkeypatch.setattr(instrumentation, "SLOW_QUERY_MS", 0)
+    monkeypatch.setattr(instrumentation, "SLOW_QUERY_PARAMS", True)
+    with request_scope("ws:add"), Session(engine) as session:
+        session.exec(text("SELECT :value, :email"), params={"value": 42, "email": "e@x.io"})
+
+    assert instrumentation.metrics.recent_slow[-1].parameters == (42, "<str of 6>")
+    assert "e@x.io" not in caplog.text
+    assert instrumentation.redact(list(range(25)))[-1] == "... 15 more"
+
+
+def test_failed_statements_leave_no_start_time(engine):
+    with request_scope("ws:add") as stats, engine.connect() as conn:
+        with pytest.raises(Exception):
+            conn.execute(text("SELECT * FROM missing"))
+        assert conn.info["query_started"] == []
+        conn.execute(text("SELECT 1"))
+    assert stats.queries == 1
+
+
+def test_async_engine_queries_are_counted():
+    async_engine = create_async_engine("sqlite+aiosqlite://")
+    instrument_engine(async_engine.sync_engine)
+
+    async def run():
+        with request_scope("ws:page") as stats:
+            async with async_engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+        await async_engine.dispose()
+        return stats
+
+    assert asyncio.run(run()).queries == 1
+
+
+def test_render_prometheus_text(engine):
+    with request_scope("GET /tasks"), Session(engine) as session:
+        session.exec(text("SELECT 1"))
+
+    body = instrumentation.metrics.render({"simplist_cache_hits_total": 3})
+    assert 'simplist_db_queries_total{endpoint="GET /tasks"} 1' in body
+    assert "simplist_cache_hits_total 3" in body
+
+
+# --- Tests for the middleware ---
+
+def test_middleware_tags_route_and_sets_server_timing(engine):
+    app = FastAPI()
+    app.add_middleware(InstrumentationMiddleware)
+
+    @app.get("/items/{item_id}")
+    def read_item(item_id: int):
+        with Session(engine) as session:
+            session.exec(text("SELECT 1"))
+        return {"id": item_id}
+
+    response = TestClient(app).get("/items/7")
+
+    assert response.headers["server-timing"].endswith('desc="1 queries"')
+    assert instrumentation.metrics.queries["GET /items/{item_id}"] == 1
+
+
+def test_middleware_tags_failing_requests_by_route(engine):
+    app = FastAPI()
+    app.add_middleware(InstrumentationMiddleware)
+
+    @app.post("/items/{item_id}")
+    def fail(item_id: int):
+        with Session(engine) as session:
+            session.exec(text("SELECT 1"))
+        raise RuntimeError("boom")
+
+    response = TestClient(app, raise_server_exceptions=False).post("/items/7")
+
+    assert response.status_code == 500
+    assert instrumentation.metrics.queries["POST /items/{item_id}"] == 1
+    assert "POST" not in instrumentation.metrics.queries
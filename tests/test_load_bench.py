@@ -0,0 +1,39 @@
+from benchmarks.load import compare, histogram, summarize
+
+
+def results(**scenarios):
+    return {"meta": {"revision": "abc1234"}, "scenarios": scenarios}
+
+
+# --- Tests for the statistics ---
+
+def test_summarize_reports_percentiles_and_histogram():
+    samples = [i / 1000 for i in range(1, 101)]  # 1..100 ms
+    summary = summarize(samples, errors=2, elapsed=2.0)
+
+    assert summary["requests"] == 100 and summary["errors"] == 2
+    assert summary["rps"] == 50.0
+    assert summary["p50_ms"] == 51.0 and summary["p99_ms"] == 99.0
+    assert sum(summary["histogram"].values()) == 100
+    assert summary["histogram"]["le_1ms"] == 1 and summary["histogram"]["le_100ms"] == 50
+
+
+def test_histogram_puts_slow_samples_in_last_bucket():
+    assert histogram([10.0])["inf"] == 1
+
+
+# --- Tests for regression checks ---
+
+def test_compare_flags_p95_and_rps_beyond_threshold():
+    baseline = results(tasks={"requests": 10, "p95_ms": 10.0, "rps": 100.0}, ws={"requests": 10, "p95_ms": 5.0, "rps": 500.0})
+    current = results(tasks={"requests": 10, "p95_ms": 10.5, "rps": 95.0}, ws={"requests": 10, "p95_ms": 6.0, "rps": 400.0})
+
+    regressions = compare(baseline, current, threshold=0.1)
+
+    assert len(regressions) == 2
+    assert all(regression.startswith("ws:") for regression in regressions)
+
+
+def test_compare_skips_scenarios_missing_from_baseline():
+    current = results(login={"requests": 10, "p95_ms": 900.0, "rps": 4.0})
+    assert compare(results(), current, threshold=0.1) == []
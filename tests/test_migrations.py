@@ -0,0 +1,86 @@
+import pytest
+from sqlmodel import create_engine, select, or_
+from sqlalchemy import inspect, text
+from sqlalchemy.pool import StaticPool
+from src.common.db_storage import page_stmt
+from src.common.migrations import MIGRATIONS, applied_version, run_migrations
+from src.common.models import Task, User
+
+
+# --- Fixtures ---
+
+@pytest.fixture
+def engine():
+    return create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+
+
+def query_plan(engine, stmt) -> str:
+    compiled = stmt.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as conn:
+        return " | ".join(row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}")))
+
+
+# --- Tests for run_migrations ---
+
+def test_fresh_database_runs_every_migration(engine):
+    assert run_migrations(engine) == sorted(MIGRATIONS)
+    assert run_migrations(engine) == []
+    assert {"user", "task"} <= set(inspect(engine).get_table_names())
+
+
+def test_existing_database_gets_indexes(engine):
+    # Schema as create_db_and_tables() built it before migrations existed
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE user (id INTEGER PRIMARY KEY, username VARCHAR(50) UNIQUE, email VARCHAR(100) UNIQUE, password VARCHAR, created_at DATETIME)"))
+        conn.execute(text("CREATE TABLE task (id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES user (id), content VARCHAR(128), completed BOOLEAN)"))
+        conn.execute(text("INSERT INTO user (username, email, password) VALUES ('old', ' Old@Example.com', 'p')"))
+        conn.execute(text("INSERT INTO task (user_id, content, completed) VALUES (1, 'kept', 0)"))
+
+    run_migrations(engine)
+
+    indexes = {index["name"] for index in inspect(engine).get_indexes("task")}
+    assert {"ix_task_user_id_id", "ix_task_user_id_completed_id"} <= indexes
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT content FROM task")).scalar() == "kept"
+        assert conn.execute(text("SELECT email_normalized FROM user")).scalar() == "old@example.com"
+        assert conn.execute(text("SELECT user_id, total, completed FROM task_count")).all() == [(1, 1, 0)]
+        assert conn.execute(text("SELECT version, first_version FROM task_count")).all() == [(0, 1)]
+        assert conn.execute(text("SELECT moved FROM task_count")).all() == [(0,)]
+    assert {"task_change", "shard_placement"} <= set(inspect(engine).get_table_names())
+
+
+def test_current_schema_is_left_alone(engine):
+    finished = []
+    assert applied_version(engine) is None
+    assert run_migrations(engine, finish=finished.append) == sorted(MIGRATIONS)
+    # Runs inside each migration's transaction
+    assert len(finished) == len(MIGRATIONS)
+
+    assert applied_version(engine) == max(MIGRATIONS)
+    assert run_migrations(engine, finish=finished.append) == []
+    assert len(finished) == len(MIGRATIONS)
+
+
+# --- Tests for index usage ---
+
+def test_user_task_page_uses_index(engine):
+    run_migrations(engine)
+    plan = query_plan(engine, page_stmt(Task, [Task.user_id == 1], after=10, limit=100))
+
+    assert "USING INDEX ix_task_user_id_id" in plan or "USING COVERING INDEX ix_task_user_id_id" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_completed_filter_uses_index(engine):
+    run_migrations(engine)
+    plan = query_plan(engine, page_stmt(Task, [Task.user_id == 1, Task.completed == False]))
+
+    assert "ix_task_user_id_completed_id" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_login_lookup_uses_unique_indexes(engine):
+    run_migrations(engine)
+    plan = query_plan(engine, select(User).where(or_(User.email_normalized == "a@b.io", User.username == "a@b.io")))
+
+    assert "SCAN" not in plan.replace("MULTI-INDEX OR", "")
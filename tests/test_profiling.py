@@ -0,0 +1,98 @@
+import threading
+import time
+import pytest
+from src.common.profiling import ProfilerBusy, SamplingProfiler, StartupTimes, thread_label
+
+
+# --- Fixtures ---
+
+def spin(seconds: float):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+@pytest.fixture
+def busy_thread():
+    thread = threading.Thread(target=spin, args=(0.5,), name="busy_1")
+    thread.start()
+    yield thread
+    thread.join()
+
+@pytest.fixture
+def idle_thread():
+    stop = threading.Event()
+    thread = threading.Thread(target=stop.wait, name="idle")
+    thread.start()
+    yield thread
+    stop.set()
+    thread.join()
+
+
+# --- Tests for startup times ---
+
+def test_startup_phases_add_up():
+    times = StartupTimes()
+    with times.phase("import"):
+        time.sleep(0.01)
+    with times.phase("assets"):
+        pass
+
+    assert list(times.phases) == ["import", "assets"]
+    assert times.total == sum(times.phases.values()) >= 0.01
+    assert times.report().startswith(f"{times.total:.3f}s (import 0.0")
+
+
+
+def test_create_app_builds_a_new_app_each_call():
+    from src.server.app import create_app
+
+    first, second = create_app(), create_app()
+    assert first is not second
+    paths = {route.path for route in first.routes}
+    assert {"/tasks", "/ws", "/login", "/logout/all", "/static", "/stats/startup"} <= paths
+
+
+def test_old_entry_point_still_serves_an_app():
+    from fastapi import FastAPI
+    from src.server import server
+
+    assert isinstance(server.app, FastAPI)
+    assert server.app is server.app
+
+# --- Tests for the sampling profiler ---
+
+def test_capture_collapses_stacks_per_thread(busy_thread, idle_thread):
+    profile = SamplingProfiler(interval=0.005).capture(0.2)
+
+    assert profile.samples >= 10
+    lines = profile.collapsed().splitlines()
+    busy = [line for line in lines if line.startswith("busy;")]
+    assert busy and all(" (tests/test_profiling.py:" in line for line in busy)
+    assert any(";spin (tests/test_profiling.py:" in line for line in busy)
+    # Waiting threads are left out, and so is the capturing one
+    assert not [line for line in lines if line.startswith(("idle;", "MainThread;"))]
+    assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in lines)
+
+
+def test_idle_threads_are_kept_on_request(idle_thread):
+    profile = SamplingProfiler(interval=0.005).capture(0.05, idle=True)
+    assert any(line.startswith("idle;") for line in profile.collapsed().splitlines())
+
+
+def test_one_capture_at_a_time(busy_thread):
+    profiler = SamplingProfiler(interval=0.005)
+    capture = threading.Thread(target=profiler.capture, args=(0.2,))
+    capture.start()
+    while not profiler.running:
+        time.sleep(0.001)
+
+    with pytest.raises(ProfilerBusy):
+        profiler.capture(0.01)
+    capture.join()
+    assert not profiler.running
+
+
+def test_pool_threads_share_a_root():
+    assert thread_label("password_3") == "password"
+    assert thread_label("ThreadPoolExecutor-0_12") == "ThreadPoolExecutor"
+    assert thread_label("AnyIO worker thread") == "AnyIO worker thread"
@@ -0,0 +1,50 @@
+import json
+import pytest
+from src.common import protocol
+from src.common.protocol import (
+    JSON, MSGPACK, AddMessage, BatchMessage, ClearCompletedMessage, DeleteMessage, PageMessage, ProtocolError, UpdateMessage,
+    negotiate, parse_frame,
+)
+
+
+# --- Tests for parse_frame ---
+
+def test_frames_become_typed_messages():
+    assert parse_frame(JSON, '{"action":"add","content":"buy milk"}') == AddMessage(action="add", content="buy milk")
+    # The client sends ids as read from the DOM
+    assert parse_frame(JSON, '{"action":"update","id":"12"}') == UpdateMessage(action="update", id=12)
+    assert parse_frame(JSON, '{"action":"page"}') == PageMessage(action="page")
+    assert parse_frame(JSON, '{"action":"clear_completed"}') == ClearCompletedMessage(action="clear_completed")
+
+    batch = parse_frame(JSON, b'{"action":"batch","operations":[{"action":"add","content":"abc"},{"action":"delete","id":3}]}')
+    assert batch == BatchMessage(action="batch", operations=[AddMessage(action="add", content="abc"), DeleteMessage(action="delete", id=3)])
+
+
+@pytest.mark.parametrize("frame, error", [
+    ("not json", "Malformed frame"),
+    ('{"content":"abc"}', "Missing action"),
+    ('{"action":"nope"}', "Unknown action: nope"),
+    ('{"action":"add","content":"ab"}', "content: String should have at least 3 characters"),
+    ('{"action":"batch","operations":[{"action":"delete","id":1},{"action":"update","id":"x"}]}', "operations.1.id: Input should be a valid integer"),
+    ('{"action":"search","q":"milk","offset":-1}', "offset: Input should be greater than or equal to 0"),
+])
+def test_bad_frames_say_what_is_wrong(frame, error):
+    with pytest.raises(ProtocolError) as raised:
+        parse_frame(JSON, frame)
+    assert str(raised.value).startswith(error)
+
+
+# --- Tests for the codecs ---
+
+def test_json_without_orjson_encodes_the_same(monkeypatch):
+    message = {"status": 1, "action": "add", "id": 1, "content": "café"}
+    fast = JSON.encode(message)
+    monkeypatch.setattr(protocol, "orjson", None)
+    assert JSON.encode(message) == fast == json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def test_msgpack_is_negotiated_when_offered():
+    pytest.importorskip("msgpack")
+    assert negotiate(["simplist.msgpack", "simplist.json"]) == (MSGPACK, "simplist.msgpack")
+    assert negotiate(["chat"]) == (JSON, None)
+    assert parse_frame(MSGPACK, MSGPACK.encode({"action": "delete", "id": 4})) == DeleteMessage(action="delete", id=4)
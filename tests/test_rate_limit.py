@@ -0,0 +1,182 @@
+import asyncio
+import socketserver
+import threading
+import time
+import pytest
+from fastapi import HTTPException
+from src.common import rate_limit
+from src.common.rate_limit import MemoryRateLimitBackend, Rate, RateLimiter, RedisRateLimitBackend, create_rate_limiter
+from src.modules import auth_operations as auth
+
+
+# --- Fixtures ---
+
+class CounterHandler(socketserver.StreamRequestHandler):
+    """Stand-in for a Redis server: MULTI/EXEC, SET NX (PX ignored), INCR and GET"""
+
+    def handle(self):
+        store, queued = self.server.store, None
+        while line := self.rfile.readline():
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+
+            command = args[0].upper()
+            self.server.commands.append(command)
+            if command == b"MULTI":
+                queued = []
+                self.wfile.write(b"+OK\r\n")
+            elif command == b"EXEC":
+                with self.server.lock:
+                    replies = [self.reply(store, queued_args) for queued_args in queued]
+                self.wfile.write(b"*%d\r\n%s" % (len(replies), b"".join(replies)))
+                queued = None
+            elif queued is not None:
+                queued.append(args)
+                self.wfile.write(b"+QUEUED\r\n")
+            else:
+                with self.server.lock:
+                    self.wfile.write(self.reply(store, args))
+
+    def reply(self, store, args) -> bytes:
+        command = args[0].upper()
+        if command == b"SET":
+            if b"NX" in args[3:] and args[1] in store:
+                return b"$-1\r\n"
+            store[args[1]] = int(args[2])
+            return b"+OK\r\n"
+        if command == b"INCR":
+            store[args[1]] = int(store.get(args[1], 0)) + 1
+            return b":%d\r\n" % store[args[1]]
+        value = store.get(args[1])
+        value = None if value is None else str(value).encode()
+        return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+
+@pytest.fixture
+def counter_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), CounterHandler)
+    server.daemon_threads = True
+    server.store, server.lock, server.commands = {}, threading.Lock(), []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+class DummyClient:
+    host = "10.0.0.1"
+
+class DummyRequest:
+    client = DummyClient()
+
+
+# --- Tests for the sliding window ---
+
+def test_limit_applies_within_window():
+    limiter = RateLimiter(MemoryRateLimitBackend())
+    rate = Rate(3, 60)
+
+    assert [limiter.hit("ip", rate, now=600 + i) for i in range(3)] == [None, None, None]
+    assert limiter.hit("ip", rate, now=603) > 0
+    assert limiter.hit("other", rate, now=603) is None
+
+
+def test_previous_window_fades_out():
+    limiter = RateLimiter(MemoryRateLimitBackend())
+    rate = Rate(4, 60)
+    for _ in range(4):
+        limiter.hit("ip", rate, now=659)
+
+    # A quarter into the next window, three quarters of the previous 4 still count
+    assert limiter.hit("ip", rate, now=675) is None
+    assert limiter.hit("ip", rate, now=675) is not None
+    # Two full windows later nothing is left
+    assert limiter.hit("ip", rate, now=800) is None
+
+
+def test_retry_after_reaches_under_limit():
+    limiter = RateLimiter(MemoryRateLimitBackend())
+    rate = Rate(2, 10)
+    for _ in range(2):
+        limiter.hit("ip", rate, now=100)
+    wait = limiter.hit("ip", rate, now=100)
+
+    assert wait > 10
+    assert limiter.hit("ip", rate, now=100 + wait + 0.01) is None
+
+
+def test_memory_backend_evicts_idle_and_excess_keys():
+    backend = MemoryRateLimitBackend(max_keys=2)
+    backend.hit("a", 10, now=0)
+    backend.hit("b", 10, now=0)
+    backend.hit("c", 10, now=0)
+    assert len(backend) == 2
+
+    backend.hit("d", 10, now=25)
+    assert len(backend) == 1
+
+
+def test_redis_backend_counts_across_limiters(counter_server):
+    rate = Rate(2, 60)
+    first = RateLimiter(RedisRateLimitBackend(*counter_server.server_address))
+    second = RateLimiter(RedisRateLimitBackend(*counter_server.server_address))
+
+    assert first.hit("user:alice", rate, now=600) is None
+    assert second.hit("user:alice", rate, now=601) is None
+    assert first.hit("user:alice", rate, now=602) is not None
+    # The expiry is set in the same transaction as the count
+    assert set(counter_server.commands) == {b"MULTI", b"SET", b"INCR", b"GET", b"EXEC"}
+
+
+def test_unreachable_backend_lets_requests_through():
+    limiter = RateLimiter(RedisRateLimitBackend("127.0.0.1", 1, timeout=0.05))
+    assert limiter.hit("ip", Rate(1, 60)) is None
+
+
+def test_create_rate_limiter_from_url():
+    assert isinstance(create_rate_limiter("memory://?max_keys=5").backend, MemoryRateLimitBackend)
+    assert isinstance(create_rate_limiter("redis://localhost:6380/1").backend, RedisRateLimitBackend)
+    assert create_rate_limiter("none") is None
+
+
+# --- Tests for login throttling ---
+
+def test_login_attempts_get_429_with_retry_after(monkeypatch):
+    monkeypatch.setattr(rate_limit, "rate_limiter", RateLimiter(MemoryRateLimitBackend()))
+    monkeypatch.setitem(auth.AUTH_RATES, "login", (Rate(100, 60), Rate(2, 60)))
+
+    asyncio.run(auth.check_rate_limits(DummyRequest(), "login", "alice"))
+    asyncio.run(auth.check_rate_limits(DummyRequest(), "login", " Alice "))
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(auth.check_rate_limits(DummyRequest(), "login", "alice"))
+
+    assert exc.value.status_code == 429
+    assert int(exc.value.headers["Retry-After"]) >= 1
+    asyncio.run(auth.check_rate_limits(DummyRequest(), "login", "bob"))
+
+
+def test_network_backends_are_hit_off_the_event_loop(monkeypatch):
+    class SlowBackend(MemoryRateLimitBackend):
+        blocking = True
+
+        def hit(self, key, window, now):
+            time.sleep(0.1)
+            return super().hit(key, window, now)
+
+    monkeypatch.setattr(rate_limit, "rate_limiter", RateLimiter(SlowBackend()))
+
+    async def scenario():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        await auth.check_rate_limits(DummyRequest(), "login", "alice")
+        ticker.cancel()
+        return ticks
+
+    assert asyncio.run(scenario()) >= 5
@@ -0,0 +1,77 @@
+import pytest
+from sqlmodel import Session, create_engine
+from sqlalchemy.pool import StaticPool
+from src.common import cache as caching
+from src.common.db_storage import DBStorageHandler
+from src.common.migrations import run_migrations
+from src.common.models import Task, User
+from src.common.search import search_stmt, search_terms
+from src.modules.task_operations import TaskOperations
+
+
+# --- Fixtures ---
+
+@pytest.fixture
+def task_operations(monkeypatch):
+    monkeypatch.setattr(caching, "default_cache", None)
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    run_migrations(engine)
+    session = Session(engine, expire_on_commit=False)
+    session.add_all([User(id=1, username="one", email="one@x.io", password="p"), User(id=2, username="two", email="two@x.io", password="p")])
+    session.add_all([
+        Task(id=1, user_id=1, content="Buy milk and bread"),
+        Task(id=2, user_id=1, content="Call the plumber", completed=True),
+        Task(id=3, user_id=1, content="milk milk milk"),
+        Task(id=4, user_id=1, content="Café reservation"),
+        Task(id=5, user_id=2, content="Buy milk too"),
+    ])
+    session.commit()
+    yield TaskOperations(DBStorageHandler(session))
+    session.close()
+
+
+def ids(tasks: list[Task]) -> list[int]:
+    return [task.id for task in tasks]
+
+
+# --- Tests for search ---
+
+def test_prefix_matches_are_ranked_and_scoped_to_the_user(task_operations):
+    assert ids(task_operations.search(1, "mil")) == [3, 1]
+    assert ids(task_operations.search(1, "bu MILK")) == [1]
+    assert ids(task_operations.search(1, "cafe")) == [4]
+
+
+def test_filters_by_completed_and_pages(task_operations):
+    assert ids(task_operations.search(1, "", completed=True)) == [2]
+    assert ids(task_operations.search(1, "", completed=False, limit=2, offset=1)) == [3, 4]
+
+
+def test_index_follows_updates_and_deletes(task_operations):
+    storage = task_operations.db_storage
+    storage.update_where(Task, {"content": "Buy oat milk"}, Task.id == 3)
+    task_operations.delete(1, 1)
+
+    assert ids(task_operations.search(1, "oat")) == [3]
+    assert ids(task_operations.search(1, "bread")) == []
+
+
+def test_query_syntax_is_not_passed_through(task_operations):
+    assert search_terms('milk" OR user_id:2 *') == ["milk", "or", "user_id", "2"]
+    assert ids(task_operations.search(1, '"milk')) == [3, 1]
+
+
+def test_other_databases_fall_back_to_like():
+    sql = str(search_stmt("mysql", 1, ["milk"]))
+    assert "LIKE" in sql.upper() and "task_fts" not in sql
+
+
+def test_like_fallback_matches_underscores_literally(task_operations):
+    session = task_operations.db_storage.session
+    session.add_all([Task(id=6, user_id=1, content="foo_bar"), Task(id=7, user_id=1, content="fooXbar"), Task(id=8, user_id=1, content="100% done")])
+    session.commit()
+
+    assert ids(session.exec(search_stmt("mysql", 1, search_terms("foo_bar")))) == [6]
+    assert ids(session.exec(search_stmt("mysql", 1, ["100%"]))) == [8]
+    assert ids(session.exec(search_stmt("mysql", 1, ["0%"]))) == [8]
+    assert ids(session.exec(search_stmt("mysql", 1, ["1%0"]))) == []
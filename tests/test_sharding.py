@@ -0,0 +1,218 @@
+import asyncio
+import pytest
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import Session, create_engine, select
+from src.common import cache as caching
+from src.common import db_storage
+from src.common.db_storage import DBStorageHandler
+from src.common.migrations import prepare_shard, run_migrations
+from src.common.models import Sequence, ShardPlacement, Task, TaskChange, TaskCount, User
+from src.common.sharding import HashRing, ShardMoved, ShardRouter, parse_shard_urls
+from src.modules.shard_rebalance import Move, catch_up, copy_user, fence, move_users, pin_users, rebalance
+from src.modules.task_operations import TaskOperations
+from src.modules.write_behind import WriteBehind
+
+
+# --- Fixtures ---
+
+def sessions(path) -> sessionmaker:
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    return sessionmaker(bind=engine, class_=Session, expire_on_commit=False)
+
+@pytest.fixture
+def databases(tmp_path, monkeypatch):
+    monkeypatch.setattr(caching, "default_cache", None)
+    directory = sessions(tmp_path / "directory.db")
+    run_migrations(directory.kw["bind"])
+    with directory() as session:
+        session.add_all([User(id=id, username=f"user{id}", email=f"{id}@x.io", password="p") for id in range(1, 41)])
+        session.commit()
+
+    shards = {}
+    for name in ("a", "b", "c"):
+        shards[name] = sessions(tmp_path / f"{name}.db")
+        prepare_shard(shards[name].kw["bind"])
+    return directory, shards
+
+@pytest.fixture
+def router(databases):
+    directory, shards = databases
+    return ShardRouter({"a": shards["a"], "b": shards["b"]}, directory)
+
+
+def task_operations(router: ShardRouter) -> TaskOperations:
+    return TaskOperations(DBStorageHandler(router.directory(), shards=router))
+
+
+def shard_tasks(router: ShardRouter, name: str) -> dict[int, Task]:
+    with router.session(name) as session:
+        return {task.id: task for task in session.exec(select(Task))}
+
+
+def users_on(router: ShardRouter, name: str, count: int = 2) -> list[int]:
+    return [user_id for user_id in range(1, 41) if router.shard_of(user_id) == name][:count]
+
+
+# --- Tests for the ring ---
+
+def test_shard_urls_are_named():
+    assert parse_shard_urls(" a=sqlite:///a.db , b=postgresql://h/db?x=1 ") == {"a": "sqlite:///a.db", "b": "postgresql://h/db?x=1"}
+    with pytest.raises(ValueError):
+        parse_shard_urls("sqlite:///a.db")
+
+
+def test_adding_a_shard_moves_only_its_share_of_users():
+    before, after = HashRing(["a", "b", "c"]), HashRing(["a", "b", "c", "d"])
+    users = range(10000)
+
+    assert {before.shard_of(user_id) for user_id in users} == {"a", "b", "c"}
+    moved = [user_id for user_id in users if before.shard_of(user_id) != after.shard_of(user_id)]
+    assert {after.shard_of(user_id) for user_id in moved} == {"d"}
+    assert 0.15 < len(moved) / len(users) < 0.35
+
+
+# --- Tests for routing ---
+
+def test_tasks_go_to_their_users_shard_with_unique_ids(router):
+    [on_a] = users_on(router, "a", 1)
+    [on_b] = users_on(router, "b", 1)
+    operations = task_operations(router)
+
+    mine = operations.add_many(on_a, ["one", "two"])
+    theirs = operations.add_many(on_b, ["three"])
+    operations.change_status(mine[0].id, on_a)
+
+    assert {task.user_id for task in shard_tasks(router, "a").values()} == {on_a}
+    assert {task.user_id for task in shard_tasks(router, "b").values()} == {on_b}
+    assert len({task.id for task in mine + theirs}) == 3
+    assert [task.content for task in operations.get_user_tasks(on_a)] == ["one", "two"]
+    assert operations.get_counts(on_a) == {"total": 2, "completed": 1, "open": 1}
+    assert operations.get_changes(on_b, 0)[0] == 1
+    # Ids come from the directory, in blocks
+    with router.directory() as session:
+        assert session.get(Sequence, "task.id").value > max(task.id for task in mine + theirs)
+
+
+def test_pinned_users_go_to_their_pinned_shard(router):
+    [user_id] = users_on(router, "a", 1)
+    with router.directory() as session:
+        session.add(ShardPlacement(user_id=user_id, shard="b"))
+        session.commit()
+    router.refresh()
+
+    task_operations(router).add_many(user_id, ["pinned"])
+
+    assert [task.content for task in shard_tasks(router, "b").values()] == ["pinned"]
+    assert shard_tasks(router, "a") == {}
+
+
+def test_maintenance_covers_every_shard(router):
+    operations = task_operations(router)
+    for name in ("a", "b"):
+        [user_id] = users_on(router, name, 1)
+        operations.add_many(user_id, [f"task {i}" for i in range(3)])
+
+    assert operations.compact_log(keep=1) == 4
+    assert operations.reconcile_counts() == {}
+
+
+
+def test_request_storage_closes_the_shards_it_opened(router, monkeypatch):
+    monkeypatch.setattr(db_storage, "shard_router", router)
+    dependency = db_storage.get_storage(router.directory())
+    storage = next(dependency)
+    [user_id] = users_on(router, "a", 1)
+    TaskOperations(storage).get_user_tasks(user_id)
+    shard_session = storage.shard(user_id).session
+    assert shard_session.in_transaction()
+
+    dependency.close()
+    assert not shard_session.in_transaction()
+
+# --- Tests for moving users ---
+
+def test_move_copies_then_fences_the_source(router):
+    [user_id] = users_on(router, "a", 1)
+    operations = task_operations(router)
+    tasks = operations.add_many(user_id, ["one", "two", "three"])
+    # Routes by placements loaded before the move
+    stale = ShardRouter(router.session_factories, router.directory)
+
+    def settle(seconds):
+        assert router.shard_of(user_id) == "b"
+        with pytest.raises(ShardMoved):
+            task_operations(stale).change_status(tasks[0].id, user_id)
+        # Reads on stale workers still see the source copy meanwhile
+        assert len(task_operations(stale).get_user_tasks(user_id)) == 3
+
+    assert move_users(router, [Move(user_id, "a", "b")], sleep=settle) == [Move(user_id, "a", "b")]
+
+    assert shard_tasks(router, "a") == {}
+    assert [task.id for task in operations.get_user_tasks(user_id)] == [task.id for task in tasks]
+    assert operations.get_changes(user_id, 0)[0] == 3
+    operations.delete(tasks[1].id, user_id)
+    assert operations.get_counts(user_id) == {"total": 2, "completed": 0, "open": 2}
+
+
+def test_catch_up_replays_what_changed_after_the_copy(router):
+    [user_id] = users_on(router, "a", 1)
+    operations = task_operations(router)
+    first, second = operations.add_many(user_id, ["one", "two"])
+
+    with router.session("a") as source, router.session("b") as target:
+        version = copy_user(source, target, user_id)
+        [third] = operations.add_many(user_id, ["three"])
+        operations.change_status(first.id, user_id)
+        operations.delete(second.id, user_id)
+        fence(source, user_id)
+        catch_up(source, target, user_id, version)
+
+    copied = shard_tasks(router, "b")
+    assert {id: (task.content, task.completed) for id, task in copied.items()} == {first.id: ("one", True), third.id: ("three", False)}
+    with router.session("b") as session:
+        count = session.get(TaskCount, user_id)
+        assert (count.total, count.completed, count.version, count.moved) == (2, 1, 5, False)
+        assert len(session.exec(select(TaskChange)).all()) == 5
+
+
+def test_rebalance_after_adding_a_shard(databases, router):
+    directory, shards = databases
+    operations = task_operations(router)
+    for user_id in range(1, 21):
+        operations.add_many(user_id, [f"task of {user_id}"])
+    grown = ShardRouter(shards, directory)
+    misplaced = {user_id for user_id in range(1, 21) if grown.ring.shard_of(user_id) != router.shard_of(user_id)}
+
+    # Pinned before the new list goes live, so nothing looks lost in between
+    assert set(pin_users(grown)) == misplaced
+    assert all(len(task_operations(grown).get_user_tasks(user_id)) == 1 for user_id in range(1, 21))
+
+    moves = rebalance(grown, sleep=lambda seconds: None)
+
+    assert {move.user_id for move in moves} == misplaced
+    assert grown.placements == {}
+    for name in shards:
+        assert {task.user_id for task in shard_tasks(grown, name).values()} <= {u for u in range(1, 21) if grown.shard_of(u) == name}
+    assert all(len(task_operations(grown).get_user_tasks(user_id)) == 1 for user_id in range(1, 21))
+
+
+# --- Tests for write-behind ---
+
+def test_write_behind_flushes_each_shard_on_its_own(router, tmp_path):
+    write_behind = WriteBehind(tmp_path / "journal", id_block=10, fsync=False, session_factory=router.directory, shards=router)
+    write_behind.start()
+    [on_a] = users_on(router, "a", 1)
+    [on_b] = users_on(router, "b", 1)
+
+    async def scenario():
+        await write_behind.apply_batch(on_a, [{"action": "add", "content": "mine"}])
+        await write_behind.apply_batch(on_b, [{"action": "add", "content": "theirs"}])
+        await write_behind.flush()
+
+    asyncio.run(scenario())
+
+    assert [task.user_id for task in shard_tasks(router, "a").values()] == [on_a]
+    assert [task.user_id for task in shard_tasks(router, "b").values()] == [on_b]
+    for name in ("a", "b"):
+        with router.session(name) as session:
+            assert session.get(Sequence, write_behind.journal.name).value == 2
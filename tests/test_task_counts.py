@@ -0,0 +1,124 @@
+import pytest
+from sqlmodel import Session, create_engine, select
+from sqlalchemy.pool import StaticPool
+from src.common import cache as caching
+from src.common.cache import Cache, MemoryCacheBackend
+from src.common.db_storage import DBStorageHandler
+from src.common.migrations import run_migrations
+from src.common.models import Task, TaskCount, User
+from src.modules.task_operations import TaskOperations
+
+
+# --- Fixtures ---
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(caching, "default_cache", None)
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    run_migrations(engine)
+    session = Session(engine, expire_on_commit=False)
+    session.add_all([User(id=1, username="one", email="one@x.io", password="p"), User(id=2, username="two", email="two@x.io", password="p")])
+    session.commit()
+    yield session
+    session.close()
+
+@pytest.fixture
+def task_operations(session):
+    return TaskOperations(DBStorageHandler(session))
+
+
+def stored(session, user_id: int) -> tuple[int, int]:
+    row = session.exec(select(TaskCount).where(TaskCount.user_id == user_id).execution_options(populate_existing=True)).one()
+    return row.total, row.completed
+
+
+# --- Tests for the counts ---
+
+def test_writes_keep_the_counts(task_operations, session):
+    first, second, third = task_operations.add_many(1, ["one", "two", "three"])
+    task_operations.change_status(first.id, 1)
+    task_operations.change_status(second.id, 1)
+    task_operations.change_status(second.id, 1)
+    task_operations.delete(first.id, 1)
+    task_operations.add({"user_id": 2, "content": "theirs", "completed": True})
+
+    assert task_operations.get_counts(1) == {"total": 2, "completed": 0, "open": 2}
+    assert task_operations.get_counts(2) == {"total": 1, "completed": 1, "open": 0}
+    assert stored(session, 1) == (2, 0)
+
+
+def test_batch_counts_commit_with_it(task_operations, session):
+    [task] = task_operations.add_many(1, ["kept"])
+
+    results = task_operations.apply_batch(1, [{"action": "add", "content": "new"}, {"action": "update", "id": task.id}, {"action": "delete", "id": 99}])
+    assert [result["status"] for result in results] == [1, 1, 0]
+    assert stored(session, 1) == (2, 1)
+
+    # The NULL content fails the insert, and nothing in the batch sticks
+    results = task_operations.apply_batch(1, [{"action": "delete", "id": task.id}, {"action": "add", "content": None}])
+    assert [result["status"] for result in results] == [0, 0]
+    assert stored(session, 1) == (2, 1)
+
+
+def test_users_without_tasks_count_zero(task_operations):
+    assert task_operations.get_counts(2) == {"total": 0, "completed": 0, "open": 0}
+
+
+def test_cached_counts_are_invalidated_by_writes(session):
+    task_operations = TaskOperations(DBStorageHandler(session, cache=Cache(MemoryCacheBackend(), ttl=60)))
+    [task] = task_operations.add_many(1, ["cached"])
+    assert task_operations.get_counts(1)["open"] == 1
+    assert task_operations.get_counts(1)["open"] == 1
+
+    task_operations.change_status(task.id, 1)
+    assert task_operations.get_counts(1) == {"total": 1, "completed": 1, "open": 0}
+
+
+def test_reconcile_repairs_drift(task_operations, session):
+    task_operations.add_many(1, ["one", "two"])
+    # Rows written around TaskOperations, as a manual fix or an older worker would
+    session.add(Task(user_id=2, content="unseen", completed=True))
+    session.exec(TaskCount.__table__.update().where(TaskCount.user_id == 1).values(total=7))
+    session.commit()
+
+    drifted = task_operations.reconcile_counts()
+
+    assert drifted == {
+        1: ({"total": 7, "completed": 0, "open": 7}, {"total": 2, "completed": 0, "open": 2}),
+        2: ({"total": 0, "completed": 0, "open": 0}, {"total": 1, "completed": 1, "open": 0}),
+    }
+    assert stored(session, 1) == (2, 0)
+    assert stored(session, 2) == (1, 1)
+    assert task_operations.reconcile_counts() == {}
+
+
+def test_reconcile_with_a_cache(session):
+    task_operations = TaskOperations(DBStorageHandler(session, cache=Cache(MemoryCacheBackend(), ttl=60)))
+    task_operations.add_many(1, ["one", "two"])
+    assert task_operations.get_counts(1)["total"] == 2
+    session.exec(TaskCount.__table__.update().where(TaskCount.user_id == 1).values(total=7))
+    session.commit()
+
+    assert task_operations.reconcile_counts() == {1: ({"total": 7, "completed": 0, "open": 7}, {"total": 2, "completed": 0, "open": 2})}
+    assert stored(session, 1) == (2, 0)
+
+
+def test_reconcile_leaves_drift_a_write_has_evened_out(task_operations, session, monkeypatch):
+    task_operations.add_many(1, ["one", "two"])
+    version = task_operations.get_version(1)
+    select_rows = task_operations.db_storage.select
+
+    def select_then_catch_up(stmt):
+        rows = select_rows(stmt)
+        if rows and isinstance(rows[0], TaskCount):
+            # A write landing between the scan and the repair
+            session.exec(TaskCount.__table__.update().where(TaskCount.user_id == 1).values(total=2))
+        return rows
+
+    session.exec(TaskCount.__table__.update().where(TaskCount.user_id == 1).values(total=7))
+    session.commit()
+    monkeypatch.setattr(task_operations.db_storage, "select", select_then_catch_up)
+
+    assert task_operations.reconcile_counts() == {}
+    assert stored(session, 1) == (2, 0)
+    assert task_operations.get_version(1) == version
@@ -0,0 +1,127 @@
+import asyncio
+import pytest
+from sqlmodel import Session, create_engine, select
+from sqlalchemy.pool import StaticPool
+from src.common import cache as caching
+from src.common.db_storage import DBStorageHandler
+from src.common.migrations import run_migrations
+from src.common.models import Task, TaskCount, User
+from src.modules import task_transfer
+from src.modules.task_operations import TaskOperations
+from src.modules.task_transfer import export_tasks, import_tasks, upload_format
+
+
+async def upload(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+def run_import(format: str, *chunks: bytes, chunk_size: int = 100):
+    inserted = []
+
+    async def insert(rows):
+        inserted.append(rows)
+        return len(rows)
+
+    report = asyncio.run(import_tasks(upload(*chunks), format, insert, chunk_size=chunk_size))
+    return report, inserted
+
+
+# --- Tests for parsing ---
+
+def test_csv_rows_and_errors():
+    report, inserted = run_import(
+        "csv",
+        b'\xef\xbb\xbfid,Content,completed\n1,"first, with a\nline break",true\n',
+        b'2,ab,\n3,second,maybe\n4,third,\n',
+    )
+
+    assert inserted == [[
+        {"content": "first, with a\nline break", "completed": True},
+        {"content": "third", "completed": False},
+    ]]
+    assert (report.imported, report.rejected, report.error) == (2, 2, None)
+    assert [error["line"] for error in report.errors] == [4, 5]
+
+
+def test_csv_needs_a_content_column():
+    report, inserted = run_import("csv", b"title\nsomething\n")
+
+    assert report.error == "The CSV header has no content column"
+    assert inserted == []
+
+
+def test_ndjson_rows_split_across_chunks():
+    report, inserted = run_import(
+        "ndjson",
+        b'{"content": "one task", "id": 9}\n{"content": "two t',
+        b'asks", "completed": true}\n\nnot json\n[1]\n',
+    )
+
+    assert inserted == [[{"content": "one task", "completed": False}, {"content": "two tasks", "completed": True}]]
+    assert report.errors == [{"line": 4, "error": "Invalid JSON"}, {"line": 5, "error": "Expected a JSON object"}]
+
+
+def test_rows_are_inserted_in_chunks():
+    lines = b"".join(b'{"content": "task %d"}\n' % i for i in range(7))
+    report, inserted = run_import("ndjson", lines, chunk_size=3)
+
+    assert [len(rows) for rows in inserted] == [3, 3, 1]
+    assert report.imported == 7
+
+
+def test_a_broken_upload_keeps_the_rows_before_it():
+    report, inserted = run_import("ndjson", b'{"content": "kept row"}\n', b"\xff\xfe\n")
+
+    assert report.imported == 1
+    assert report.error == "The upload is not UTF-8"
+
+
+def test_upload_format():
+    assert upload_format("text/csv; charset=utf-8") == "csv"
+    assert upload_format("application/x-ndjson") == "ndjson"
+    assert upload_format("application/json") is None
+    assert upload_format(None) is None
+
+
+# --- Tests against a database ---
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(caching, "default_cache", None)
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    run_migrations(engine)
+    session = Session(engine, expire_on_commit=False)
+    session.add(User(id=1, username="one", email="one@x.io", password="p"))
+    session.commit()
+    yield session
+    session.close()
+
+
+def test_import_rows_keeps_the_counts(session):
+    task_operations = TaskOperations(DBStorageHandler(session))
+    task_operations.add_many(1, ["already here"])
+
+    imported = task_operations.import_rows(1, [{"content": "new", "completed": True}, {"content": "newer", "completed": False}])
+
+    assert imported == 2
+    assert task_operations.get_counts(1) == {"total": 3, "completed": 1, "open": 2}
+    assert sorted(task.content for task in session.exec(select(Task).where(Task.user_id == 1))) == ["already here", "new", "newer"]
+    assert session.get(TaskCount, 1).total == 3
+
+
+def test_export_round_trips(monkeypatch):
+    tasks = [Task(id=1, user_id=1, content='say "hi", then\nleave', completed=True), Task(id=2, user_id=1, content="plain", completed=False)]
+
+    async def stream_user_tasks(user_id):
+        yield tasks
+
+    monkeypatch.setattr(task_transfer, "stream_user_tasks", stream_user_tasks)
+
+    async def exported(format):
+        return "".join([text async for text in export_tasks(1, format)]).encode()
+
+    for format in ("csv", "ndjson"):
+        report, inserted = run_import(format, asyncio.run(exported(format)))
+        assert inserted == [[{"content": task.content, "completed": task.completed} for task in tasks]]
+        assert report.rejected == 0
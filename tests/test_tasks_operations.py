@@ -1,11 +1,22 @@
+import asyncio
 import pytest
 from unittest.mock import MagicMock
-from src.modules.task_operations import TaskOperations
-from src.common.models import Task
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+from src.common import cache as caching
+from src.common.cache import Cache, MemoryCacheBackend
+from src.common.db_storage import AsyncDBStorageHandler
+from src.common.migrations import run_migrations
+from src.modules.task_operations import TaskOperations, AsyncTaskOperations
+from src.common.models import Task, TaskCount, User
 
 @pytest.fixture
 def mock_db_storage():
-    return MagicMock()
+    db_storage = MagicMock(shards=None)
+    db_storage.shard.return_value = db_storage
+    db_storage.increment.return_value = TaskCount(user_id=123, version=4)
+    return db_storage
 
 @pytest.fixture
 def task_ops(mock_db_storage):
@@ -43,15 +54,149 @@ def test_get_user_tasks(task_ops, mock_db_storage):
     assert len(result) == 2
     assert all(t.user_id == 123 for t in result)
 
+def test_get_page_reads_version_counts_and_tasks_alike(task_ops, mock_db_storage):
+    mock_db_storage.find.return_value = TaskCount(user_id=123, total=2, completed=1, version=7)
+    mock_db_storage.get_all_where.return_value = [Task(id=1, content="a", user_id=123)]
+
+    version, tasks, counts = task_ops.get_page(123, 50)
+
+    mock_db_storage.find.assert_called_once_with(TaskCount, 123, replica=True)
+    assert mock_db_storage.get_all_where.call_args.kwargs["limit"] == 50
+    assert (version, len(tasks), counts["open"]) == (7, 1, 1)
+
 def test_delete_task(task_ops, mock_db_storage):
-    task_ops.delete(1)
-    mock_db_storage.delete.assert_called_once_with(1, Task)
+    mock_db_storage.delete_rows.return_value = [Task(id=1, content="a", user_id=123, completed=True)]
+
+    task_ops.delete(1, 123)
+
+    mock_db_storage.delete_rows.assert_called_once()
+    mock_db_storage.get_by_id.assert_not_called()
+    mock_db_storage.increment.assert_called_once_with(TaskCount, 123, {"total": -1, "completed": -1, "version": 1}, commit=False)
+    mock_db_storage.commit.assert_called_once()
+
+def test_delete_task_of_other_user(task_ops, mock_db_storage):
+    mock_db_storage.delete_rows.return_value = []
+
+    with pytest.raises(ValueError):
+        task_ops.delete(1, 456)
+    mock_db_storage.increment.assert_not_called()
 
 def test_change_status(task_ops, mock_db_storage):
-    mock_db_storage.get_by_id.return_value = Task(id=1, content="c", user_id=123, completed=False)
-    mock_db_storage.update.return_value = Task(id=1, content="c", user_id=123, completed=True)
+    mock_db_storage.update_where.return_value = [Task(id=1, content="c", user_id=123, completed=True)]
+
+    updated = task_ops.change_status(1, 123)
+
+    mock_db_storage.update_where.assert_called_once()
+    mock_db_storage.get_by_id.assert_not_called()
+    mock_db_storage.increment.assert_called_once_with(TaskCount, 123, {"total": 0, "completed": 1, "version": 1}, commit=False)
+    [change] = mock_db_storage.insert_many.call_args.args[1]
+    assert change == {"user_id": 123, "action": "update", "task_id": 1, "content": None, "completed": True, "version": 4}
+    assert updated.completed is True
+
+def test_change_status_of_other_user(task_ops, mock_db_storage):
+    mock_db_storage.update_where.return_value = []
+
+    with pytest.raises(ValueError):
+        task_ops.change_status(1, 456)
+
+def test_add_many(task_ops, mock_db_storage):
+    task_ops.add_many(123, ["one", "two"])
+
+    rows = mock_db_storage.bulk_insert.call_args.args[1]
+    assert [row["content"] for row in rows] == ["one", "two"]
+    assert all(row["user_id"] == 123 for row in rows)
+
+
+# --- Tests for AsyncTaskOperations ---
+
+@pytest.fixture
+def async_engine(monkeypatch, tmp_path):
+    monkeypatch.setattr(caching, "default_cache", Cache(MemoryCacheBackend(), ttl=60))
+    url = f"sqlite:///{tmp_path}/tasks.db"
+    engine = create_engine(url)
+    run_migrations(engine)
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert().values(id=123, username="user", email="e@x.io", password="secret"))
+    engine.dispose()
+    return create_async_engine(url.replace("sqlite://", "sqlite+aiosqlite://"))
 
-    updated = task_ops.change_status(1)
+def run_async(engine, scenario):
+    """scenario(task_ops) on an AsyncTaskOperations over a fresh AsyncSession"""
+    async def run():
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            return await scenario(AsyncTaskOperations(AsyncDBStorageHandler(session)))
+    return asyncio.run(run())
 
-    mock_db_storage.update.assert_called_once_with(1, Task, {"completed": True})
+def test_async_add_task(async_engine):
+    async def scenario(task_ops):
+        task = await task_ops.add({"content": "test", "user_id": 123})
+        return task, await task_ops.get_counts(123)
+
+    task, counts = run_async(async_engine, scenario)
+    assert (task.content, task.user_id, counts["total"]) == ("test", 123, 1)
+
+def test_async_get_user_tasks(async_engine):
+    async def scenario(task_ops):
+        await task_ops.add_many(123, ["one", "two"])
+        return await task_ops.get_user_tasks(123), await task_ops.get_user_tasks(123)
+
+    first, cached = run_async(async_engine, scenario)
+    assert [task.content for task in first] == [task.content for task in cached] == ["one", "two"]
+    assert caching.default_cache.stats.hits == 1
+
+def test_async_change_status(async_engine):
+    async def scenario(task_ops):
+        [task] = await task_ops.add_many(123, ["three"])
+        updated = await task_ops.change_status(task.id, 123)
+        return updated, await task_ops.get_changes(123, 0)
+
+    updated, (version, changes) = run_async(async_engine, scenario)
     assert updated.completed is True
+    assert (version, [change.action for change in changes]) == (2, ["add", "update"])
+
+def test_async_stream_user_tasks(async_engine):
+    async def scenario(task_ops):
+        await task_ops.add_many(123, [f"task {i}" for i in range(5)])
+        stream = task_ops.db_storage.stream_where(Task, Task.user_id == 123, batch_size=2)
+        return [len(chunk) async for chunk in task_ops.db_storage.iterate(stream)]
+
+    assert run_async(async_engine, scenario) == [2, 2, 1]
+
+
+# --- Tests for apply_batch ---
+
+def test_apply_batch_commits_once(task_ops, mock_db_storage):
+    mock_db_storage.bulk_insert.return_value = [Task(id=7, content="new", user_id=123), Task(id=8, content="new2", user_id=123)]
+    mock_db_storage.delete_rows.return_value = [Task(id=1, content="a", user_id=123)]
+    mock_db_storage.update_where.return_value = [Task(id=2, content="b", user_id=123, completed=True)]
+
+    results = task_ops.apply_batch(123, [
+        {"action": "add", "content": "new"},
+        {"action": "add", "content": "new2"},
+        {"action": "delete", "id": 1},
+        {"action": "update", "id": 2},
+    ])
+
+    assert [r["status"] for r in results] == [1, 1, 1, 1]
+    assert [r["id"] for r in results] == [7, 8, 1, 2]
+    mock_db_storage.bulk_insert.assert_called_once()
+    assert mock_db_storage.delete_rows.call_args.kwargs == {"commit": False}
+    assert mock_db_storage.update_where.call_args.kwargs == {"commit": False}
+    mock_db_storage.commit.assert_called_once()
+
+def test_apply_batch_reports_per_operation_errors(task_ops, mock_db_storage):
+    mock_db_storage.delete_rows.return_value = []
+
+    results = task_ops.apply_batch(123, [{"action": "delete", "id": 9}, {"action": "nope"}])
+
+    assert results[0] == {"status": 0, "action": "error", "error": "Task with id 9 not found"}
+    assert results[1]["error"] == "Unknown action: nope"
+    mock_db_storage.commit.assert_called_once()
+
+def test_apply_batch_rolls_back_on_database_error(task_ops, mock_db_storage):
+    mock_db_storage.commit.side_effect = RuntimeError("database is locked")
+
+    results = task_ops.apply_batch(123, [{"action": "delete", "id": 1}, {"action": "update", "id": 2}])
+
+    assert all(r["status"] == 0 for r in results)
+    mock_db_storage.rollback.assert_called_once()
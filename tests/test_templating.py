@@ -0,0 +1,24 @@
+import asyncio
+import jinja2
+from src.server import templating
+
+
+# --- Tests for streamed rendering ---
+
+def test_stream_matches_full_render(monkeypatch):
+    env = jinja2.Environment(loader=jinja2.DictLoader({"list.html": "{% for i in items %}<li>{{ i }}</li>{% endfor %}"}), enable_async=True)
+    monkeypatch.setattr(templating, "async_env", env)
+
+    async def collect():
+        return [chunk async for chunk in templating.stream_template("list.html", {"items": range(100)}, chunk_size=64)]
+
+    chunks = asyncio.run(collect())
+    assert len(chunks) > 1
+    assert "".join(chunks) == "".join(f"<li>{i}</li>" for i in range(100))
+
+
+def test_precompile_compiles_every_template():
+    fingerprint = templating.precompile()
+
+    assert fingerprint == templating.fingerprint == templating.precompile()
+    assert len(templating.async_env.cache) == len(templating.templates.env.list_templates())
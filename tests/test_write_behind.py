@@ -0,0 +1,270 @@
+import asyncio
+import json
+import pytest
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import SQLModel, Session, create_engine, select
+from src.common import cache as caching
+from src.common.broadcast import broadcaster
+from src.common.models import Task, TaskChange, TaskCount, User
+from src.common.db_storage import DBStorageHandler
+from src.modules.task_operations import TaskOperations, ThreadedTaskOperations, counts_reply
+from src.modules.write_behind import (
+    PendingTask, WriteBehind, WriteBehindTaskOperations, apply_record, overlay, overlay_counts,
+)
+
+
+# --- Fixtures ---
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'tasks.db'}", connect_args={"check_same_thread": False})
+    SQLModel.metadata.create_all(engine)
+    monkeypatch.setattr(caching, "default_cache", None)
+    with Session(engine) as session:
+        session.add_all([User(id=1, username="one", email="one@x.io", password="p"), User(id=2, username="two", email="two@x.io", password="p")])
+        session.add_all([Task(id=1, user_id=1, content="existing", completed=False), Task(id=2, user_id=2, content="theirs")])
+        session.add_all([TaskCount(user_id=1, total=1), TaskCount(user_id=2, total=1)])
+        session.commit()
+    return sessionmaker(bind=engine, class_=Session, expire_on_commit=False)
+
+@pytest.fixture
+def journal_dir(tmp_path):
+    return tmp_path / "journal"
+
+
+def started(journal_dir, session_factory, **options) -> WriteBehind:
+    write_behind = WriteBehind(journal_dir, id_block=10, fsync=False, session_factory=session_factory, **options)
+    write_behind.start()
+    return write_behind
+
+
+def db_tasks(session_factory) -> dict[int, Task]:
+    with session_factory() as session:
+        return {task.id: task for task in session.exec(select(Task))}
+
+
+# --- Tests for the pending state ---
+
+def test_toggles_collapse_to_their_net_effect():
+    pending = {}
+    for seq in range(3):
+        apply_record(pending, {"seq": seq, "user_id": 1, "action": "update", "id": 5})
+    assert pending[5] == PendingTask(1, toggled=True)
+
+    apply_record(pending, {"seq": 4, "user_id": 1, "action": "update", "id": 5})
+    assert pending[5].toggled is False
+
+
+def test_add_then_delete_leaves_nothing_to_write():
+    pending = {}
+    apply_record(pending, {"seq": 1, "user_id": 1, "action": "add", "id": 7, "content": "brief"})
+    apply_record(pending, {"seq": 2, "user_id": 1, "action": "update", "id": 7})
+    apply_record(pending, {"seq": 3, "user_id": 1, "action": "delete", "id": 7})
+    assert pending == {}
+
+
+def test_overlay_keeps_pages_in_id_order():
+    tasks = [Task(id=i, user_id=1, content=f"task {i}") for i in (1, 2, 3)]
+    changes = {2: PendingTask(1, deleted=True), 3: PendingTask(1, toggled=True), 12: PendingTask(1, content="new")}
+
+    page = overlay(tasks, changes, after=None, limit=2, complete=False)
+    assert [(task.id, task.completed) for task in page] == [(1, False), (3, True)]
+
+    last_page = overlay(tasks[2:], changes, after=2, limit=10, complete=True)
+    assert [task.id for task in last_page] == [3, 12]
+
+
+def test_overlay_counts_only_counts_changes_that_will_match():
+    changes = {1: PendingTask(1, toggled=True), 2: PendingTask(1, deleted=True), 3: PendingTask(1, deleted=True), 12: PendingTask(1, content="new", toggled=True)}
+    counts = overlay_counts(counts_reply(None, 2, 1), changes, completed={1: False, 2: True})
+    assert counts == {"total": 2, "completed": 2, "open": 0}
+
+
+# --- Tests for WriteBehind ---
+
+def test_actions_are_acknowledged_before_the_flush(journal_dir, session_factory):
+    write_behind = started(journal_dir, session_factory)
+
+    async def scenario():
+        results = await write_behind.apply_batch(1, [
+            {"action": "add", "content": "buy milk"},
+            {"action": "update", "id": "1"},
+            {"action": "update", "id": "1"},
+            {"action": "update", "id": "1"},
+        ])
+        assert [result["status"] for result in results] == [1, 1, 1, 1]
+        assert results[0]["id"] > 2
+        # Acknowledged with the state they leave the task in, as without write-behind
+        assert [result["completed"] for result in results[1:]] == [True, False, True]
+        [added_update] = await write_behind.apply_batch(1, [{"action": "update", "id": results[0]["id"]}])
+        assert added_update == {"status": 1, "action": "update", "id": results[0]["id"], "completed": True}
+        assert set(db_tasks(session_factory)) == {1, 2}
+
+        await write_behind.flush()
+        return results[0]["id"]
+
+    added = asyncio.run(scenario())
+    tasks = db_tasks(session_factory)
+    assert tasks[added].content == "buy milk"
+    assert tasks[1].completed is True
+    assert list(journal_dir.glob("*.log")) == [write_behind.journal.path]
+
+
+def test_reads_see_pending_writes(journal_dir, session_factory):
+    write_behind = started(journal_dir, session_factory)
+
+    async def fetch(after, limit):
+        with session_factory() as session:
+            query = select(Task).where(Task.user_id == 1).order_by(Task.id)
+            return list(session.exec(query.limit(limit) if limit else query))
+
+    async def scenario():
+        [added] = await write_behind.apply_batch(1, [{"action": "add", "content": "pending"}])
+        await write_behind.apply_batch(1, [{"action": "delete", "id": 1}])
+        assert write_behind.has_pending(1) and not write_behind.has_pending(2)
+        return added["id"], await write_behind.read(1, fetch, limit=10)
+
+    added, tasks = asyncio.run(scenario())
+    assert [task.id for task in tasks] == [added]
+
+
+def test_counts_see_pending_writes_and_flush_into_the_summary(journal_dir, session_factory):
+    write_behind = started(journal_dir, session_factory)
+
+    async def fetch_counts():
+        with session_factory() as session:
+            return counts_reply(session.get(TaskCount, 1))
+
+    async def fetch_completed(ids):
+        with session_factory() as session:
+            return dict(session.exec(select(Task.id, Task.completed).where(Task.user_id == 1, Task.id.in_(ids))).all())
+
+    async def scenario():
+        await write_behind.apply_batch(1, [{"action": "add", "content": "one"}, {"action": "add", "content": "two"}, {"action": "update", "id": 1}])
+        await write_behind.apply_batch(1, [{"action": "delete", "id": 2}])  # Someone else's; matches nothing
+        pending = await write_behind.counts(1, fetch_counts, fetch_completed)
+        await write_behind.flush()
+        return pending, await fetch_counts()
+
+    pending, flushed = asyncio.run(scenario())
+    assert pending == flushed == {"total": 3, "completed": 1, "open": 2}
+
+
+def test_flush_logs_the_changes_and_announces_their_versions(journal_dir, session_factory, monkeypatch):
+    write_behind = started(journal_dir, session_factory)
+    published = []
+
+    async def publish(user_id, message, origin=None):
+        published.append((user_id, message))
+
+    monkeypatch.setattr(broadcaster, "publish", publish)
+
+    async def scenario():
+        [added, _] = await write_behind.apply_batch(1, [{"action": "add", "content": "one"}, {"action": "update", "id": 1}])
+        assert "version" not in added
+        await write_behind.flush()
+        return added["id"]
+
+    id = asyncio.run(scenario())
+    with session_factory() as session:
+        log = [(change.version, change.action, change.task_id, change.completed) for change in session.exec(select(TaskChange).order_by(TaskChange.version))]
+    assert log == [(1, "add", id, False), (2, "update", 1, True)]
+    assert published == [(1, {"status": 1, "action": "synced", "since": 1, "version": 2})]
+
+
+def test_rejects_actions_on_tasks_gone_or_not_theirs_and_invalid_content(journal_dir, session_factory):
+    write_behind = started(journal_dir, session_factory)
+
+    async def scenario():
+        await write_behind.apply_batch(1, [{"action": "delete", "id": 1}])
+        return await write_behind.apply_batch(1, [
+            {"action": "update", "id": 1}, {"action": "update", "id": 2}, {"action": "update", "id": 99},
+            {"action": "add", "content": ""}, {"action": "add", "content": "ab"}, {"action": "add", "content": 123},
+        ])
+
+    assert [result["status"] for result in asyncio.run(scenario())] == [0, 0, 0, 0, 0, 0]
+    assert write_behind.pending == {1: PendingTask(1, deleted=True)}
+
+
+
+def test_clear_completed_flushes_then_clears_in_the_database(journal_dir, session_factory):
+    write_behind = started(journal_dir, session_factory)
+    task_operations = WriteBehindTaskOperations(ThreadedTaskOperations(TaskOperations(DBStorageHandler(session_factory()))), write_behind)
+
+    async def scenario():
+        added, toggled = await task_operations.apply_batch(1, [{"action": "add", "content": "pending"}, {"action": "update", "id": 1}])
+        [cleared] = await task_operations.apply_batch(1, [{"action": "clear_completed"}])
+        return added["id"], cleared
+
+    added, cleared = asyncio.run(scenario())
+    assert cleared["ids"] == [1] and not write_behind.has_pending(1)
+    assert sorted(db_tasks(session_factory)) == [2, added]
+
+def test_restart_replays_the_journal_once(journal_dir, session_factory):
+    crashed = started(journal_dir, session_factory)
+
+    async def unflushed():
+        return await crashed.apply_batch(1, [{"action": "add", "content": "survives"}, {"action": "update", "id": 1}])
+
+    [added, _] = asyncio.run(unflushed())
+    crashed.journal.release()  # Dies without flushing
+    segments = {path: path.read_bytes() for path in journal_dir.glob("*.log")}
+
+    restarted = started(journal_dir, session_factory)
+    tasks = db_tasks(session_factory)
+    assert tasks[added["id"]].content == "survives"
+    assert tasks[1].completed is True
+
+    # As if it had died after committing the replay but before deleting the segments
+    restarted.journal.release()
+    for path, data in segments.items():
+        path.write_bytes(data)
+    started(journal_dir, session_factory)
+    assert db_tasks(session_factory)[1].completed is True
+
+
+def test_actions_need_a_user(journal_dir, session_factory):
+    write_behind = started(journal_dir, session_factory)
+    with pytest.raises(ValueError):
+        asyncio.run(write_behind.apply_batch(None, [{"action": "add", "content": "nobody's"}]))
+    assert write_behind.pending == {}
+
+
+def test_changes_the_database_rejects_are_set_aside(journal_dir, session_factory):
+    crashed = started(journal_dir, session_factory)
+
+    async def unflushed():
+        return await crashed.apply_batch(1, [{"action": "add", "content": "kept"}, {"action": "update", "id": 1}])
+
+    [added, _] = asyncio.run(unflushed())
+    # Journaled before actions needed a user; it can never commit
+    crashed.journal.append([{"seq": crashed.seq + 1, "user_id": None, "action": "add", "id": added["id"] + 1, "content": "orphan"}])
+    crashed.journal.release()
+
+    restarted = started(journal_dir, session_factory)
+    tasks = db_tasks(session_factory)
+    assert tasks[added["id"]].content == "kept"
+    assert tasks[1].completed is True
+    assert added["id"] + 1 not in tasks
+    [rejected] = [json.loads(line) for line in (journal_dir / "rejected.log").read_text().splitlines()]
+    assert (rejected["id"], rejected["user_id"], rejected["content"]) == (added["id"] + 1, None, "orphan")
+
+    async def later():
+        await restarted.apply_batch(2, [{"action": "add", "content": "next"}])
+        await restarted.flush()
+
+    asyncio.run(later())
+    assert "next" in {task.content for task in db_tasks(session_factory).values()}
+
+
+def test_workers_reserve_disjoint_id_blocks(journal_dir, session_factory):
+    first = started(journal_dir, session_factory)
+    second = started(journal_dir, session_factory)
+    assert first.journal.slot != second.journal.slot
+
+    async def take():
+        return list(await first.take_ids(3)), list(await second.take_ids(3))
+
+    first_ids, second_ids = asyncio.run(take())
+    assert not set(first_ids) & set(second_ids)
+    assert min(first_ids + second_ids) > 2